@@ -0,0 +1,213 @@
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from tracing import metrics
+
+# Requests beyond these limits are turned away with 429 and a Retry-After, instead of queueing behind the model
+# quota until they time out. A batch counts once per file.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))
+ADMISSION_MAX_PER_USER = int(os.getenv("ADMISSION_MAX_PER_USER", "4"))
+# Used for Retry-After until a few requests have finished and their duration is known.
+ADMISSION_RETRY_AFTER_SECONDS = float(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "5"))
+# How many recently queued jobs are remembered, so an identical re-upload gets the same job id.
+ADMISSION_MAX_TRACKED_JOBS = int(os.getenv("ADMISSION_MAX_TRACKED_JOBS", "1024"))
+
+
+class Overloaded(Exception):
+    def __init__(self, scope: str, retry_after: int):
+        super().__init__(f"Too many diagnoses in flight ({scope}), retry in {retry_after}s.")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Global and per-user limits on concurrent diagnoses, plus coalescing: a request identical to one already
+    running (same user, input type and file content) waits for that execution instead of starting its own.
+    Coalesced requests take no slot, so a client retrying a slow upload is never shed.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, max_per_user: int = ADMISSION_MAX_PER_USER,
+                 retry_after_seconds: float = ADMISSION_RETRY_AFTER_SECONDS,
+                 max_tracked_jobs: int = ADMISSION_MAX_TRACKED_JOBS):
+        self.max_in_flight = max_in_flight
+        self.max_per_user = max_per_user
+        self.retry_after_seconds = retry_after_seconds
+        self.max_tracked_jobs = max_tracked_jobs
+        self.in_flight = 0
+        self._per_user = {}
+        self._executions = {}
+        self._jobs = OrderedDict()
+        self._average_seconds = None
+
+    def retry_after(self) -> int:
+        seconds = self._average_seconds if self._average_seconds is not None else self.retry_after_seconds
+        return max(1, math.ceil(seconds))
+
+    def admit(self, user_id: str = None, weight: int = 1):
+        """Takes `weight` slots or raises Overloaded. Returns the release callable, which is safe to call twice."""
+        weight = min(weight, self.max_in_flight)
+        if self.in_flight + weight > self.max_in_flight:
+            metrics.inc("glycosight_admission_total", {"outcome": "shed_global"})
+            raise Overloaded("global", self.retry_after())
+        if user_id is not None and self._per_user.get(user_id, 0) >= self.max_per_user:
+            metrics.inc("glycosight_admission_total", {"outcome": "shed_user"})
+            raise Overloaded("user", self.retry_after())
+        self.in_flight += weight
+        if user_id is not None:
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        metrics.inc("glycosight_admission_total", {"outcome": "admitted"})
+        started = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            self.in_flight -= weight
+            if user_id is not None:
+                remaining = self._per_user.pop(user_id) - 1
+                if remaining:
+                    self._per_user[user_id] = remaining
+            duration = time.perf_counter() - started
+            self._average_seconds = duration if self._average_seconds is None else 0.8 * self._average_seconds + 0.2 * duration
+
+        return release
+
+    @asynccontextmanager
+    async def slot(self, user_id: str = None, weight: int = 1):
+        release = self.admit(user_id, weight)
+        try:
+            yield
+        finally:
+            release()
+
+    async def run(self, key: tuple, user_id: str, call):
+        """
+        Runs `call` under a slot, or joins the identical execution already in flight. The execution outlives a
+        caller that disconnects, so the others still get its result (or its error).
+        """
+        execution = self._executions.get(key)
+        if execution is not None:
+            metrics.inc("glycosight_admission_total", {"outcome": "coalesced"})
+            print(f"---ADMISSION: Joining the in-flight execution for user {user_id}---")
+            return await asyncio.shield(execution)
+
+        release = self.admit(user_id)
+        execution = asyncio.ensure_future(call())
+        self._executions[key] = execution
+
+        def done(future):
+            if self._executions.get(key) is future:
+                del self._executions[key]
+            release()
+
+        execution.add_done_callback(done)
+        return await asyncio.shield(execution)
+
+    def queued_job(self, key: tuple, is_active):
+        """The id of an identical job that `is_active(job_id)` says is still queued or running."""
+        job_id = self._jobs.get(key)
+        if job_id is None:
+            return None
+        if not is_active(job_id):
+            del self._jobs[key]
+            return None
+        metrics.inc("glycosight_admission_total", {"outcome": "coalesced"})
+        return job_id
+
+    def remember_job(self, key: tuple, job_id: str):
+        self._jobs[key] = job_id
+        while len(self._jobs) > self.max_tracked_jobs:
+            self._jobs.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "max_per_user": self.max_per_user,
+            "busiest_users": sorted(self._per_user.values(), reverse=True)[:5],
+            "coalescing": len(self._executions),
+            "retry_after_seconds": self.retry_after(),
+        }
+
+
+class _Lane:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = []
+        self.users = 0
+
+
+class UserLanes:
+    """
+    Runs each user's diagnoses one at a time, so every diagnosis reads the profile the previous one stored rather
+    than racing it. Text diagnoses that queue up behind a running one are merged with `merge` and answered by a
+    single RAG call.
+    """
+
+    def __init__(self, merge):
+        self.merge = merge
+        self._lanes = {}
+
+    @asynccontextmanager
+    async def _enter(self, user_id: str):
+        lane = self._lanes.setdefault(user_id, _Lane())
+        lane.users += 1
+        try:
+            yield lane
+        finally:
+            lane.users -= 1
+            if lane.users == 0 and self._lanes.get(user_id) is lane:
+                del self._lanes[user_id]
+
+    @asynccontextmanager
+    async def hold(self, user_id: str):
+        async with self._enter(user_id) as lane, lane.lock:
+            yield
+
+    async def merge_and_run(self, user_id: str, data: dict, run):
+        """Awaits `run(merged_data)` for this upload together with any others of the user's that queued up meanwhile."""
+        async with self._enter(user_id) as lane:
+            future = asyncio.get_running_loop().create_future()
+            lane.pending.append((data, future))
+            try:
+                await self._run_pending(lane, future, user_id, run)
+                return await future
+            finally:
+                if not future.done():
+                    future.cancel()
+
+    async def _run_pending(self, lane: _Lane, future, user_id: str, run):
+        async with lane.lock:
+            if not future.done():
+                # A waiter that was cancelled meanwhile has a done future; its upload is dropped.
+                batch = [entry for entry in lane.pending if not entry[1].done()]
+                lane.pending = []
+                if len(batch) > 1:
+                    print(f"---ADMISSION: Merging {len(batch)} uploads for user {user_id} into one diagnosis---")
+                    metrics.inc("glycosight_admission_total", {"outcome": "merged"}, len(batch) - 1)
+                try:
+                    result = await run(self._merged(batch))
+                except Exception as e:
+                    for _, waiting in batch:
+                        if not waiting.done():
+                            waiting.set_exception(e)
+                except BaseException:
+                    # Cancelled: the others go back in line for the next holder of the lock.
+                    lane.pending[:0] = [entry for entry in batch if entry[1] is not future]
+                    raise
+                else:
+                    for _, waiting in batch:
+                        if not waiting.done():
+                            waiting.set_result(result)
+
+    def _merged(self, batch: list) -> dict:
+        merged = batch[0][0]
+        for data, _ in batch[1:]:
+            merged = self.merge(merged, data)
+        return merged
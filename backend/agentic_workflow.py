@@ -1,87 +1,188 @@
+import os
+import asyncio
+from functools import reduce, lru_cache
 from typing import TypedDict, Optional, Literal, Dict, Any
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
+from streaming import PartialJSONFieldParser
+from tracing import traced_node
+from model_scheduler import call_priority
+from admission import UserLanes
 from utils import (
-    extract_patient_parameters_from_pdf,
-    identify_image_type,
-    convert_dicom_to_jpeg,
-    extract_patient_parameters_from_image,
-    rag_from_corpus,
-    vlm_analysis_for_scans
+    aextract_patient_parameters_from_pdf,
+    aidentify_image_type,
+    aclassify_and_extract_image,
+    aconvert_dicom_to_jpeg_bytes,
+    aextract_patient_parameters_from_image,
+    arag_from_corpus,
+    avlm_analysis_for_scans,
+    afetch_user_profile,
+    merge_clinical_data,
+    profile_cache,
+    PROFILE_NOT_LOADED
 )
 
+# When enabled, report images are classified and extracted in a single model call.
+FUSED_IMAGE_MODE = os.getenv("FUSED_IMAGE_MODE", "false").lower() == "true"
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+
+# Each user's diagnoses run one after another (text uploads that pile up are merged), so none overwrites another's profile.
+user_lanes = UserLanes(merge_clinical_data)
+
 class AgenticWorkflowState(TypedDict):
     user_id: str
-    file_path: str
+    file_path: Optional[str] = None
+    file_bytes: Optional[bytes] = None
+    file_name: Optional[str] = None
     input_type: Literal["pdf", "image", "dicom"]
+    fused_image_mode: Optional[bool] = None
+    stream_diagnosis: Optional[bool] = None
     image_type: Optional[Literal["TRUE", "FALSE", "NEITHER"]] = None
     structured_data: Optional[Dict[str, Any]] = None
+    past_profile: Optional[Dict[str, Any]] = None
+    past_profile_loaded: Optional[bool] = None
+    past_profile_generation: Optional[int] = None
     final_response: Optional[Dict[str, Any]] = None
     error_message: Optional[str] = None
 
 
-def entry_point_node(state: AgenticWorkflowState) -> dict:
+def get_file_data(state: AgenticWorkflowState):
+    """Returns the in-memory upload when present, otherwise the path it was written to."""
+    if state.get("file_bytes") is not None:
+        return state["file_bytes"]
+    return state["file_path"]
+
+
+def current_profile(user_id: str, profile, generation):
+    """The prefetched profile, unless it was written since (e.g. by a diagnosis this one queued behind)."""
+    current = generation is not None and generation == profile_cache.generation(user_id)
+    return profile if current else PROFILE_NOT_LOADED
+
+
+def prefetched_profile(state: AgenticWorkflowState):
+    if not state.get("past_profile_loaded"):
+        return PROFILE_NOT_LOADED
+    return current_profile(state["user_id"], state.get("past_profile"), state.get("past_profile_generation"))
+
+
+# Citations name retrieved chunks and get their page and reference only after generation, so they are sent with
+# final_response rather than as they stream in.
+UNSTREAMED_FIELDS = {"citations"}
+
+
+def diagnosis_stream_callback(state: AgenticWorkflowState):
+    """When the caller is streaming, forwards each completed response field to the stream."""
+    if not state.get("stream_diagnosis"):
+        return None
+    writer = get_stream_writer()
+    parser = PartialJSONFieldParser()
+
+    def on_text(text):
+        try:
+            fields = parser.feed(text)
+        except ValueError:
+            return
+        for field, value in fields:
+            if field not in UNSTREAMED_FIELDS:
+                writer({"event": "diagnosis_field", "field": field, "value": value})
+
+    return on_text
+
+
+async def entry_point_node(state: AgenticWorkflowState) -> dict:
     print("---NODE: Workflow Started---")
     return {}
 
-def process_pdf_document(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def prefetch_user_profile(state: AgenticWorkflowState) -> dict:
+    """Runs beside extraction, so the diagnosis finds the user's past records already loaded."""
+    generation = profile_cache.generation(state["user_id"])
+    try:
+        return {"past_profile": await afetch_user_profile(state["user_id"]), "past_profile_loaded": True,
+                "past_profile_generation": generation}
+    except Exception as e:
+        print(f"---NODE: Profile prefetch failed, the diagnosis will fetch it itself: {e}---")
+        return {}
+
+async def process_pdf_document(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Processing PDF Document---")
-    file_path = state["file_path"]
+    file_data = get_file_data(state)
     try:
-        structured_data = extract_patient_parameters_from_pdf(file_path)
+        structured_data = await aextract_patient_parameters_from_pdf(file_data)
         return {"structured_data": structured_data}
     except Exception as e:
         return {"error_message": f"Failed to process PDF: {str(e)}"}
 
-def classify_image_content(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def classify_image_content(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Classifying Image Content---")
-    file_path = state["file_path"]
+    file_data = get_file_data(state)
     try:
-        image_type = identify_image_type(file_path)
+        image_type = await aidentify_image_type(file_data)
         cleaned_image_type = image_type.strip().upper()
         return {"image_type": cleaned_image_type}
     except Exception as e:
         return {"error_message": f"Failed to classify image: {str(e)}"}
 
-def process_dicom_file(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def classify_and_extract_image_content(state: AgenticWorkflowState) -> Dict[str, Any]:
+    print("---NODE: Classifying and Extracting Image Content---")
+    file_data = get_file_data(state)
+    try:
+        result = await aclassify_and_extract_image(file_data)
+        cleaned_image_type = result["image_type"].strip().upper()
+        update = {"image_type": cleaned_image_type}
+        if cleaned_image_type == "TRUE":
+            update["structured_data"] = result["clinical_data"]
+        return update
+    except Exception as e:
+        return {"error_message": f"Failed to classify and extract image: {str(e)}"}
+
+async def process_dicom_file(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Processing DICOM File---")
-    file_path = state["file_path"]
+    file_data = get_file_data(state)
     try:
-        jpeg_path = file_path + ".jpg" 
-        converted_path = convert_dicom_to_jpeg(file_path, jpeg_path)
-        return {"file_path": converted_path}
+        jpeg_bytes = await aconvert_dicom_to_jpeg_bytes(file_data)
+        return {"file_bytes": jpeg_bytes, "file_name": f"{state.get('file_name') or 'scan'}.jpg"}
     except Exception as e:
         return {"error_message": f"Failed to convert DICOM file: {str(e)}"}
 
-def extract_data_from_report_image(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def extract_data_from_report_image(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Extracting Data from Report Image---")
-    file_path = state["file_path"]
+    file_data = get_file_data(state)
     try:
-        structured_data = extract_patient_parameters_from_image(file_path)
+        structured_data = await aextract_patient_parameters_from_image(file_data)
         return {"structured_data": structured_data}
     except Exception as e:
         return {"error_message": f"Failed to extract data from image: {str(e)}"}
 
-def generate_text_based_diagnosis(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def generate_text_based_diagnosis(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Generating Diagnosis from Text/PDF---")
     user_id = state["user_id"]
     structured_data = state["structured_data"]
+    on_text = diagnosis_stream_callback(state)
+
+    async def diagnose(merged_data):
+        return await arag_from_corpus(user_id, merged_data, on_text=on_text, patient_past_data=prefetched_profile(state))
+
     try:
-        final_response = rag_from_corpus(user_id, structured_data)
+        final_response = await user_lanes.merge_and_run(user_id, structured_data, diagnose)
         return {"final_response": final_response}
     except Exception as e:
         return {"error_message": f"Failed to generate text-based diagnosis: {str(e)}"}
 
-def generate_scan_based_diagnosis(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def generate_scan_based_diagnosis(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Generating Diagnosis from Scan---")
     user_id = state["user_id"]
-    file_path = state["file_path"]
+    file_data = get_file_data(state)
     try:
-        final_response = vlm_analysis_for_scans(user_id, file_path)
+        async with user_lanes.hold(user_id):
+            final_response = await avlm_analysis_for_scans(
+                user_id, file_data, file_name=state.get("file_name"), on_text=diagnosis_stream_callback(state),
+                patient_past_data=prefetched_profile(state)
+            )
         return {"final_response": final_response}
     except Exception as e:
         return {"error_message": f"Failed to generate scan-based diagnosis: {str(e)}"}
 
-def handle_unsupported_file(state: AgenticWorkflowState) -> Dict[str, Any]:
+async def handle_unsupported_file(state: AgenticWorkflowState) -> Dict[str, Any]:
     print("---NODE: Handling Unsupported File Type---")
     return {"error_message": "The uploaded image is neither a recognized medical report nor a scan."}
 
@@ -93,17 +194,31 @@ def route_initial_input(state: AgenticWorkflowState) -> str:
     if input_type == "pdf":
         return "process_pdf_document"
     elif input_type == "image":
+        fused_image_mode = state.get("fused_image_mode")
+        if fused_image_mode is None:
+            fused_image_mode = FUSED_IMAGE_MODE
+        if fused_image_mode:
+            return "classify_and_extract_image_content"
         return "classify_image_content"
     elif input_type == "dicom":
         return "process_dicom_file"
     else:
         return "handle_unsupported_file"
 
+def route_initial_input_with_prefetch(state: AgenticWorkflowState):
+    """Routes as route_initial_input and, once the input type is accepted, also starts the profile prefetch."""
+    route = route_initial_input(state)
+    if route == "handle_unsupported_file":
+        return route
+    return [route, "prefetch_user_profile"]
+
 def route_image_type(state: AgenticWorkflowState) -> str:
     """This function is a router. It decides how to handle an image after classification."""
     image_type = state["image_type"]
     print(f"---ROUTING: Classified image type is '{image_type}'---")
-    if image_type == "TRUE":
+    if image_type == "TRUE" and state.get("structured_data"):
+        return "generate_text_based_diagnosis"
+    elif image_type == "TRUE":
         return "extract_data_from_report_image"
     elif image_type == "FALSE":
         return "generate_scan_based_diagnosis"
@@ -111,44 +226,169 @@ def route_image_type(state: AgenticWorkflowState) -> str:
         return "handle_unsupported_file"
 
 
-workflow = StateGraph(AgenticWorkflowState)
+def add_traced_node(workflow: StateGraph, name: str, node):
+    workflow.add_node(name, traced_node(name, node))
+
 
-workflow.add_node("entry_point", entry_point_node)
-workflow.add_node("process_pdf_document", process_pdf_document)
-workflow.add_node("classify_image_content", classify_image_content)
-workflow.add_node("process_dicom_file", process_dicom_file)
-workflow.add_node("extract_data_from_report_image", extract_data_from_report_image)
-workflow.add_node("generate_text_based_diagnosis", generate_text_based_diagnosis)
-workflow.add_node("generate_scan_based_diagnosis", generate_scan_based_diagnosis)
-workflow.add_node("handle_unsupported_file", handle_unsupported_file)
-workflow.set_entry_point("entry_point")
+def build_workflow(extraction_only: bool = False) -> StateGraph:
+    """
+    Builds the agentic graph. With extraction_only, the graph stops once a file has been classified and its
+    parameters extracted (or converted, for scans), so callers can merge several files before diagnosing.
+    """
+    text_diagnosis = END if extraction_only else "generate_text_based_diagnosis"
+    scan_diagnosis = END if extraction_only else "generate_scan_based_diagnosis"
 
-workflow.add_conditional_edges(
-    "entry_point",
-    route_initial_input,
-    {
+    workflow = StateGraph(AgenticWorkflowState)
+
+    add_traced_node(workflow, "entry_point", entry_point_node)
+    add_traced_node(workflow, "process_pdf_document", process_pdf_document)
+    add_traced_node(workflow, "classify_image_content", classify_image_content)
+    add_traced_node(workflow, "classify_and_extract_image_content", classify_and_extract_image_content)
+    add_traced_node(workflow, "process_dicom_file", process_dicom_file)
+    add_traced_node(workflow, "extract_data_from_report_image", extract_data_from_report_image)
+    if not extraction_only:
+        add_traced_node(workflow, "prefetch_user_profile", prefetch_user_profile)
+        add_traced_node(workflow, "generate_text_based_diagnosis", generate_text_based_diagnosis)
+        add_traced_node(workflow, "generate_scan_based_diagnosis", generate_scan_based_diagnosis)
+    add_traced_node(workflow, "handle_unsupported_file", handle_unsupported_file)
+    workflow.set_entry_point("entry_point")
+
+    initial_routes = {
         "process_pdf_document": "process_pdf_document",
         "classify_image_content": "classify_image_content",
+        "classify_and_extract_image_content": "classify_and_extract_image_content",
         "process_dicom_file": "process_dicom_file",
         "handle_unsupported_file": "handle_unsupported_file"
     }
-)
+    if extraction_only:
+        workflow.add_conditional_edges("entry_point", route_initial_input, initial_routes)
+    else:
+        # The prefetch is a parallel branch: it finishes in the same step as the first extraction node, so its
+        # result is in the state before any diagnosis node runs.
+        workflow.add_conditional_edges("entry_point", route_initial_input_with_prefetch,
+                                       {**initial_routes, "prefetch_user_profile": "prefetch_user_profile"})
 
-workflow.add_conditional_edges(
-    "classify_image_content",
-    route_image_type,
-    {
-        "extract_data_from_report_image": "extract_data_from_report_image",
-        "generate_scan_based_diagnosis": "generate_scan_based_diagnosis",
-        "handle_unsupported_file": "handle_unsupported_file"
-    }
-)
+    workflow.add_conditional_edges(
+        "classify_image_content",
+        route_image_type,
+        {
+            "extract_data_from_report_image": "extract_data_from_report_image",
+            "generate_scan_based_diagnosis": scan_diagnosis,
+            "handle_unsupported_file": "handle_unsupported_file"
+        }
+    )
+
+    workflow.add_conditional_edges(
+        "classify_and_extract_image_content",
+        route_image_type,
+        {
+            "generate_text_based_diagnosis": text_diagnosis,
+            "extract_data_from_report_image": "extract_data_from_report_image",
+            "generate_scan_based_diagnosis": scan_diagnosis,
+            "handle_unsupported_file": "handle_unsupported_file"
+        }
+    )
+
+    if not extraction_only:
+        workflow.add_edge("prefetch_user_profile", END)
+
+    workflow.add_edge("process_pdf_document", text_diagnosis)
+    workflow.add_edge("extract_data_from_report_image", text_diagnosis)
+    workflow.add_edge("process_dicom_file", scan_diagnosis)
+    if not extraction_only:
+        workflow.add_edge("generate_text_based_diagnosis", END)
+        workflow.add_edge("generate_scan_based_diagnosis", END)
+    workflow.add_edge("handle_unsupported_file", END)
+
+    return workflow
+
+
+@lru_cache(maxsize=None)
+def get_app(extraction_only: bool = False):
+    """Compiles each graph variant on first use and reuses it afterwards."""
+    return build_workflow(extraction_only).compile()
+
+
+def __getattr__(name):
+    # Keeps `from agentic_workflow import app` working without compiling at import time.
+    if name == "app":
+        return get_app()
+    if name == "extraction_app":
+        return get_app(extraction_only=True)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def has_clinical_values(structured_data) -> bool:
+    """Whether an extraction found any lab value or symptom/history entry, rather than only nulls."""
+    if not structured_data:
+        return False
+    lab_results = (structured_data.get("lab_results") or {}).values()
+    symptoms = (structured_data.get("symptoms_history") or {}).values()
+    return (any(isinstance(result, dict) and result.get("value") is not None for result in lab_results)
+            or any(value not in (None, "", []) for value in symptoms))
+
+
+async def run_batch_diagnosis(initial_states: list, max_concurrency: int = BATCH_MAX_CONCURRENCY) -> dict:
+    """
+    Runs extraction for every file concurrently (bounded by max_concurrency), merges each user's extracted
+    parameters into one record and diagnoses it with a single RAG call; files with nothing extracted are reported
+    as errors instead. Scans still need their own image in the prompt, so they are analysed one by one per user
+    after the text diagnosis has been stored. Model calls are queued at batch priority, so interactive requests go first.
+    """
+    with call_priority("batch"):
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def extract(initial_state):
+            async with semaphore:
+                return await get_app(extraction_only=True).ainvoke(initial_state)
+
+        # Each user's profile is read once, while their files are being extracted.
+        user_ids = list(dict.fromkeys(state["user_id"] for state in initial_states))
+        generations = {user_id: profile_cache.generation(user_id) for user_id in user_ids}
+        profile_fetches = {user_id: asyncio.ensure_future(afetch_user_profile(user_id)) for user_id in user_ids}
+        extracted_states = await asyncio.gather(*(extract(state) for state in initial_states))
+        fetched = await asyncio.gather(*profile_fetches.values(), return_exceptions=True)
+        profiles = {user_id: PROFILE_NOT_LOADED if isinstance(profile, Exception) else profile
+                    for user_id, profile in zip(profile_fetches, fetched)}
+
+        per_user = {}
+        for state in extracted_states:
+            user = per_user.setdefault(state["user_id"], {"structured_data": [], "scans": [], "errors": []})
+            if error_message := state.get("error_message"):
+                user["errors"].append({"file_name": state.get("file_name"), "error": error_message})
+            elif state["input_type"] == "dicom" or state.get("image_type") == "FALSE":
+                user["scans"].append(state)
+            elif has_clinical_values(state.get("structured_data")):
+                user["structured_data"].append(state["structured_data"])
+            else:
+                # Diagnosing an empty record would only store a made-up assessment in the user's profile.
+                user["errors"].append({"file_name": state.get("file_name"), "error": "No clinical values could be extracted from the file."})
+
+        async def diagnose_user(user_id, user):
+            result = {"diagnosis": None, "scan_diagnoses": [], "errors": user["errors"]}
+            if user["structured_data"]:
+                merged_data = reduce(merge_clinical_data, user["structured_data"])
+
+                async def diagnose(merged_data):
+                    async with semaphore:
+                        return await arag_from_corpus(
+                            user_id, merged_data, patient_past_data=current_profile(user_id, profiles[user_id], generations[user_id])
+                        )
 
-workflow.add_edge("process_pdf_document", "generate_text_based_diagnosis")
-workflow.add_edge("extract_data_from_report_image", "generate_text_based_diagnosis")
-workflow.add_edge("process_dicom_file", "generate_scan_based_diagnosis")
-workflow.add_edge("generate_text_based_diagnosis", END)
-workflow.add_edge("generate_scan_based_diagnosis", END)
-workflow.add_edge("handle_unsupported_file", END)
+                try:
+                    result["diagnosis"] = await user_lanes.merge_and_run(user_id, merged_data, diagnose)
+                except Exception as e:
+                    result["errors"].append({"file_name": None, "error": f"Failed to generate text-based diagnosis: {str(e)}"})
+            for scan_state in user["scans"]:
+                try:
+                    async with user_lanes.hold(user_id), semaphore:
+                        scan_diagnosis = await avlm_analysis_for_scans(
+                            user_id, get_file_data(scan_state), file_name=scan_state.get("file_name")
+                        )
+                    result["scan_diagnoses"].append({"file_name": scan_state.get("file_name"), "diagnosis": scan_diagnosis})
+                except Exception as e:
+                    result["errors"].append({"file_name": scan_state.get("file_name"), "error": f"Failed to generate scan-based diagnosis: {str(e)}"})
+            return user_id, result
 
-app = workflow.compile()
\ No newline at end of file
+        results = await asyncio.gather(*(diagnose_user(user_id, user) for user_id, user in per_user.items()))
+        return dict(results)
@@ -1,18 +1,183 @@
 import os
-import shutil
-import tempfile
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import asyncio
+import time
+import sys
+from contextlib import asynccontextmanager
+from typing import Optional, List
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from agentic_workflow import app as agentic_app
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
+from starlette.background import BackgroundTask
+from starlette.formparsers import MultiPartParser
+from job_queue import create_job_queue, QueueFull, QueueNotRunning
+from admission import AdmissionController, Overloaded
+from result_cache import file_sha256
+import http_transport
+from streaming import format_sse
+from tracing import metrics, start_trace, end_trace, record_payload
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+# Uploads up to this size stay in memory while the multipart body is parsed, instead of spilling to /tmp.
+MultiPartParser.spool_max_size = int(os.getenv("UPLOAD_SPOOL_MAX_BYTES", str(MAX_UPLOAD_BYTES)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "50"))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+
+STATIC_CONTEXT_REFRESH_SECONDS = 600
+
+_workflow = None
+
+
+def _load_workflow():
+    import agentic_workflow
+    agentic_workflow.get_app()
+    agentic_workflow.get_app(extraction_only=True)
+    return agentic_workflow
+
+
+async def get_workflow():
+    """
+    The workflow pulls in LangGraph, the Gemini SDK and Supabase, so it is imported and compiled off the event
+    loop on first use instead of at import. That keeps cold starts for /, /jobs and /metrics cheap.
+    """
+    global _workflow
+    if _workflow is None:
+        _workflow = await asyncio.to_thread(_load_workflow)
+    return _workflow
+
+
+async def refresh_static_context():
+    while True:
+        try:
+            await get_workflow()
+            break
+        except Exception as e:
+            print(f"--- API: Loading the workflow failed, retrying in {STATIC_CONTEXT_REFRESH_SECONDS}s: {e} ---")
+            await asyncio.sleep(STATIC_CONTEXT_REFRESH_SECONDS)
+    from utils import awarm_up_static_context, awarm_up_connections, profile_outbox
+    if profile_outbox is not None:
+        profile_outbox.start()
+    try:
+        await awarm_up_connections()
+    except Exception as e:
+        # Only a head start: the first real calls open their own connections.
+        print(f"--- API: Connection warm-up failed: {e} ---")
+    while True:
+        try:
+            await awarm_up_static_context()
+        except Exception as e:
+            print(f"--- API: Static context refresh failed, retrying in {STATIC_CONTEXT_REFRESH_SECONDS}s: {e} ---")
+        await asyncio.sleep(STATIC_CONTEXT_REFRESH_SECONDS)
+
+
+async def run_workflow(initial_state: dict) -> dict:
+    print(f"--- API: Invoking workflow for user {initial_state['user_id']} with file {initial_state.get('file_name')} ---")
+
+    workflow = await get_workflow()
+    final_state = await workflow.get_app().ainvoke(initial_state)
+
+    print(f"--- API: Workflow finished for user {initial_state['user_id']} ---")
+
+    if error_message := final_state.get("error_message"):
+        raise HTTPException(status_code=400, detail=error_message)
+
+    if final_response := final_state.get("final_response"):
+        return final_response
+    else:
+        raise HTTPException(status_code=500, detail="Workflow did not produce a final response.")
+
+
+async def run_job(initial_state: dict) -> dict:
+    """Runs a queued job under the same admission limits as direct requests, waiting its turn instead of failing."""
+    key = request_key(initial_state)
+    while True:
+        try:
+            return await admission.run(key, initial_state["user_id"], lambda: run_workflow(initial_state))
+        except Overloaded as e:
+            await asyncio.sleep(e.retry_after)
+
+
+# Opt-in async mode: /diagnose returns a job id and a local worker pool runs the workflow.
+DIAGNOSE_ASYNC_DEFAULT = os.getenv("DIAGNOSE_ASYNC_DEFAULT", "false").lower() == "true"
+job_queue = create_job_queue(run_job)
+admission = AdmissionController()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs in the background so the server starts accepting requests straight away.
+    refresh_task = asyncio.create_task(refresh_static_context())
+    await job_queue.start()
+    yield
+    refresh_task.cancel()
+    await job_queue.stop()
+    if (utils := sys.modules.get("utils")) is not None and utils.profile_outbox is not None:
+        await asyncio.to_thread(utils.profile_outbox.stop)
+    await http_transport.aclose()
+
 
 app = FastAPI(
     title="GlycoSight AI API",
     description="API for the GlycoSight AI diabetes risk assessment workflow.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+
+class UploadTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Upload exceeds the {limit} byte limit.")
+
+
+class MaxUploadSizeMiddleware:
+    """
+    Rejects request bodies over the upload limit with 413. The Content-Length header is checked up front, and
+    the body is counted as it arrives, so a chunked upload without one is cut off at the limit instead of being
+    parsed and spooled in full first.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        limit = MAX_BATCH_UPLOAD_BYTES if scope["path"] == "/diagnose/batch" else MAX_UPLOAD_BYTES
+        too_large = JSONResponse(status_code=413, content={"detail": f"Upload exceeds the {limit} byte limit."})
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > limit + MULTIPART_OVERHEAD_BYTES:
+            return await too_large(scope, receive, send)
+
+        received = 0
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit + MULTIPART_OVERHEAD_BYTES:
+                    raise UploadTooLarge(limit)
+            return message
+
+        async def tracked_send(message):
+            nonlocal response_started
+            response_started = response_started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except UploadTooLarge:
+            if response_started:
+                raise
+            await too_large(scope, receive, send)
+
+
+app.add_middleware(MaxUploadSizeMiddleware)
+
 origins = ["*"]
 
+# Added after the size limit so CORS wraps it and its 413s carry the CORS headers the browser needs to read them.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -21,39 +186,237 @@ app.add_middleware(
     allow_headers=["*"], 
 )
 
+
+# Per-request timings are returned in a Server-Timing header when enabled here or asked for with X-Timing: true.
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "false").lower() == "true"
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    token = start_trace()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        trace = end_trace(token)
+        route = request.scope.get("route")
+        duration = time.perf_counter() - started
+        metrics.observe_duration("request", route.path if route else "unmatched", duration)
+    if TIMING_HEADER_ENABLED or request.headers.get("x-timing", "").lower() == "true":
+        response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+@app.exception_handler(Overloaded)
+async def shed_load(request: Request, exc: Overloaded):
+    return JSONResponse(status_code=429, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+
+def request_key(initial_state: dict) -> tuple:
+    """Identifies requests that would produce the same diagnosis: same user, same file content, same options."""
+    return (initial_state["user_id"], initial_state["input_type"], initial_state.get("fused_image_mode"),
+            file_sha256(initial_state["file_bytes"]))
+
+
+def job_is_active(job_id: str) -> bool:
+    job = job_queue.get(job_id)
+    return job is not None and job["status"] in ("queued", "running")
+
+
+async def read_upload(file: UploadFile) -> bytes:
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+    file_bytes = await file.read(MAX_UPLOAD_BYTES + 1)
+    if len(file_bytes) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {MAX_UPLOAD_BYTES} byte limit.")
+    record_payload("request_upload", len(file_bytes))
+    return file_bytes
+
+
 @app.post("/diagnose")
 async def diagnose(
     user_id: str = Form(...),
     input_type: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    fused_image_mode: Optional[bool] = Form(None),
+    async_mode: Optional[bool] = Form(None)
 ):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        file_path = os.path.join(temp_dir, file.filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    file_bytes = await read_upload(file)
 
-        initial_state = {
-            "user_id": user_id,
-            "file_path": file_path,
-            "input_type": input_type,
-        }
+    initial_state = {
+        "user_id": user_id,
+        "file_bytes": file_bytes,
+        "file_name": file.filename,
+        "input_type": input_type,
+        "fused_image_mode": fused_image_mode,
+    }
 
-        print(f"--- API: Invoking workflow for user {user_id} with file {file.filename} ---")
+    if async_mode is None:
+        async_mode = DIAGNOSE_ASYNC_DEFAULT
+    key = request_key(initial_state)
+    if async_mode:
+        if (job_id := admission.queued_job(key, job_is_active)) is not None:
+            print(f"--- API: Identical job {job_id} is already queued for user {user_id} ---")
+        else:
+            try:
+                job_id = await job_queue.submit(initial_state)
+            except QueueFull as e:
+                raise Overloaded("queue", admission.retry_after()) from e
+            except QueueNotRunning as e:
+                raise HTTPException(status_code=503, detail="The job queue is not running; try again shortly.") from e
+            admission.remember_job(key, job_id)
+            print(f"--- API: Queued job {job_id} for user {user_id} ---")
+        return JSONResponse(status_code=202, content={"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"})
 
-        final_state = await agentic_app.ainvoke(initial_state)
+    return await admission.run(key, user_id, lambda: run_workflow(initial_state))
 
-        print(f"--- API: Workflow finished for user {user_id} ---")
 
-        if error_message := final_state.get("error_message"):
-            raise HTTPException(status_code=400, detail=error_message)
+async def stream_workflow(initial_state: dict, release=None):
+    try:
+        async for event in _stream_workflow(initial_state):
+            yield event
+    finally:
+        if release is not None:
+            release()
 
-        if final_response := final_state.get("final_response"):
-            return final_response
-        else:
-            raise HTTPException(status_code=500, detail="Workflow did not produce a final response.")
+
+async def _stream_workflow(initial_state: dict):
+    print(f"--- API: Streaming workflow for user {initial_state['user_id']} with file {initial_state.get('file_name')} ---")
+
+    started_at = {}
+    final_response = None
+    error_message = None
+    workflow = await get_workflow()
+    async for mode, chunk in workflow.get_app().astream(initial_state, stream_mode=["tasks", "custom"]):
+        if mode == "custom":
+            yield format_sse(chunk["event"], {k: v for k, v in chunk.items() if k != "event"})
+            continue
+
+        if "input" in chunk:
+            started_at[chunk["id"]] = time.perf_counter()
+            yield format_sse("node_started", {"node": chunk["name"]})
+            continue
+
+        duration = time.perf_counter() - started_at.pop(chunk["id"], time.perf_counter())
+        yield format_sse("node_finished", {"node": chunk["name"], "duration_ms": round(duration * 1000, 1)})
+        result = chunk.get("result") or {}
+        if result.get("image_type"):
+            yield format_sse("classification", {"image_type": result["image_type"]})
+        if result.get("structured_data"):
+            yield format_sse("structured_data", result["structured_data"])
+        error_message = result.get("error_message") or error_message
+        final_response = result.get("final_response") or final_response
+
+    print(f"--- API: Streaming workflow finished for user {initial_state['user_id']} ---")
+
+    if error_message:
+        yield format_sse("error", {"detail": error_message})
+    elif final_response:
+        yield format_sse("final_response", final_response)
+    else:
+        yield format_sse("error", {"detail": "Workflow did not produce a final response."})
+    yield format_sse("done", {})
+
+
+@app.post("/diagnose/stream")
+async def diagnose_stream(
+    user_id: str = Form(...),
+    input_type: str = Form(...),
+    file: UploadFile = File(...),
+    fused_image_mode: Optional[bool] = Form(None)
+):
+    """
+    Server-Sent Events variant of /diagnose. Emits node_started/node_finished for each graph node, the
+    classification and extracted data as soon as they exist, diagnosis_field events as each field of the
+    RAGDiagnosisResponse is generated (except citations, which are only final once resolved against the
+    retrieved passages), and finally final_response (or error) followed by done.
+    """
+    file_bytes = await read_upload(file)
+
+    initial_state = {
+        "user_id": user_id,
+        "file_bytes": file_bytes,
+        "file_name": file.filename,
+        "input_type": input_type,
+        "fused_image_mode": fused_image_mode,
+        "stream_diagnosis": True,
+    }
+
+    # Streams aren't coalesced, since each client needs its own events, but they do count against the limits.
+    release = admission.admit(user_id)
+    return StreamingResponse(
+        stream_workflow(initial_state, release),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(release)
+    )
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+
+@app.post("/diagnose/batch")
+async def diagnose_batch(
+    user_ids: List[str] = Form(...),
+    input_types: List[str] = Form(...),
+    files: List[UploadFile] = File(...),
+    fused_image_mode: Optional[bool] = Form(None)
+):
+    """
+    Diagnoses many files at once. user_ids and input_types are given either once for the whole batch or once
+    per file, in the same order as files. Each user's extractions are merged and diagnosed with one RAG call.
+    """
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(status_code=413, detail=f"A batch can contain at most {MAX_BATCH_FILES} files.")
+    for name, values in (("user_ids", user_ids), ("input_types", input_types)):
+        if len(values) not in (1, len(files)):
+            raise HTTPException(status_code=400, detail=f"{name} must have one entry or one entry per file.")
+
+    initial_states = []
+    for i, file in enumerate(files):
+        initial_states.append({
+            "user_id": user_ids[i] if len(user_ids) > 1 else user_ids[0],
+            "file_bytes": await read_upload(file),
+            "file_name": file.filename,
+            "input_type": input_types[i] if len(input_types) > 1 else input_types[0],
+            "fused_image_mode": fused_image_mode,
+        })
+
+    print(f"--- API: Invoking batch workflow for {len(files)} files across {len(set(user_ids))} users ---")
+
+    async with admission.slot(weight=len(initial_states)):
+        workflow = await get_workflow()
+        results = await workflow.run_batch_diagnosis(initial_states)
+
+    print("--- API: Batch workflow finished ---")
+
+    return {"results": results}
 
 
 @app.get("/")
 def read_root():
-    return {"status": "GlycoSight AI API is running"}
\ No newline at end of file
+    return {"status": "GlycoSight AI API is running"}
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    await get_workflow()
+    from utils import result_cache, context_cache, profile_cache, profile_outbox
+    return {
+        "result_cache": result_cache.stats(),
+        "context_cache": context_cache.usage,
+        "profile_cache": profile_cache.stats(),
+        "profile_outbox": profile_outbox.stats() if profile_outbox is not None else None,
+        "admission": admission.stats(),
+        "job_queue": job_queue.stats(),
+    }
@@ -0,0 +1,290 @@
+# Offline benchmark for the diagnosis workflow. Gemini and Supabase are replaced by the local stand-ins in
+# fakes.py, so runs are free, repeatable and can inject latency and errors. Each sample input (PDF report,
+# report photo, retinal scan, DICOM study) goes through the compiled graph and/or the FastAPI app at each
+# concurrency level; the report gives p50/p95/p99 latency, throughput and peak Python memory per input.
+#
+# Usage: python benchmark.py --target both --levels 1 5 10 25 --requests 50 --latency-ms 800 --error-rate 0.02
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import tempfile
+import time
+import tracemalloc
+import httpx
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+import utils
+from fakes import FakeGeminiClient, FakeSupabaseClient, FaultProfile
+from result_cache import LRUResultCache, ResultCache
+from profile_outbox import ProfileOutbox
+
+REPORT_LINES = [
+    "CITY DIAGNOSTICS LABORATORY - Clinical Chemistry Report",
+    "Patient: Benchmark Patient    Age: 52    Gender: Female",
+    "Report Date: 2025-03-14",
+    "HbA1c (Glycated Hemoglobin)          6.8 %        [4.0 - 5.6]   HIGH",
+    "Fasting Plasma Glucose               131 mg/dL    [70 - 99]     HIGH",
+    "Body Mass Index                      29.4 kg/m2   [18.5 - 24.9] HIGH",
+]
+
+
+def make_pdf_report() -> bytes:
+    """A single-page PDF with a real text layer."""
+    text = "BT /F1 11 Tf 50 760 Td 16 TL " + " ".join(f"({line}) '" for line in REPORT_LINES) + " ET"
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(text)} >>\nstream\n{text}\nendstream".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>",
+    ]
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+
+def make_report_image() -> bytes:
+    """A phone-photo sized picture of a printed report."""
+    image = Image.new("RGB", (2400, 3200), "white")
+    draw = ImageDraw.Draw(image)
+    # About the size 10pt print comes out at in a photo of an A4 page at this resolution.
+    font = ImageFont.load_default(size=40)
+    for i, line in enumerate(REPORT_LINES * 4):
+        draw.text((120, 150 + i * 110), line, fill="black", font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def make_scan_image() -> bytes:
+    """A dark, roughly circular fundus-like image, with a bright optic disc and the vessels leaving it."""
+    size = 2048
+    y, x = np.ogrid[:size, :size]
+    radius = np.hypot(x - size / 2, y - size / 2) / (size / 2)
+    noise = np.random.default_rng(0).normal(0, 8, (size, size))
+    red = np.where(radius < 0.9, 150 - 60 * radius + noise, 0)
+    pixels = np.stack([red, red * 0.45, red * 0.2], axis=-1)
+    disc_x, disc_y = size * 0.68, size * 0.5
+    from_disc = np.hypot(x - disc_x, y - disc_y)
+    angle = np.arctan2(y - disc_y, x - disc_x)
+    vessels = (radius < 0.9) & (from_disc > size * 0.06) & (np.abs(np.sin(3 * angle + from_disc / size)) < 0.04)
+    pixels[vessels] *= 0.6
+    pixels[from_disc < size * 0.06] = (250, 220, 160)
+    pixels = pixels.clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+def make_dicom_study(frames: int = 16, size: int = 512) -> bytes:
+    """A 16-bit multi-frame MR-like study with rescale and window tags."""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, MRImageStorage, generate_uid
+
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = MRImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.SOPClassUID = MRImageStorage
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.Modality = "MR"
+    dataset.PatientName = "Benchmark^Patient"
+    dataset.Rows = dataset.Columns = size
+    dataset.NumberOfFrames = frames
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 12
+    dataset.HighBit = 11
+    dataset.PixelRepresentation = 0
+    dataset.RescaleSlope = 1
+    dataset.RescaleIntercept = 0
+    dataset.WindowCenter = 1024
+    dataset.WindowWidth = 2048
+
+    y, x = np.ogrid[:size, :size]
+    radius = np.hypot(x - size / 2, y - size / 2)
+    volume = np.stack([np.where(radius < size * (0.3 + 0.01 * i), 1800, 200) for i in range(frames)])
+    volume = volume + np.random.default_rng(0).integers(0, 100, volume.shape)
+    dataset.PixelData = volume.astype(np.uint16).tobytes()
+
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+SAMPLE_BUILDERS = {
+    "pdf": ("pdf", "report.pdf", make_pdf_report),
+    "report_image": ("image", "report.jpg", make_report_image),
+    "scan_image": ("image", "fundus.jpg", make_scan_image),
+    "dicom": ("dicom", "study.dcm", make_dicom_study),
+}
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def install_fakes(args) -> FakeGeminiClient:
+    gemini = FakeGeminiClient(
+        model_faults=FaultProfile(args.latency_ms, args.jitter_ms, args.error_rate, args.seed),
+        upload_faults=FaultProfile(args.upload_latency_ms, args.upload_latency_ms / 4, args.error_rate, args.seed)
+    )
+    db_faults = FaultProfile(args.db_latency_ms, args.db_latency_ms / 4, args.db_error_rate, args.seed)
+    tables = {}
+    utils.use_clients(
+        gemini_client=gemini,
+        supabase_client=FakeSupabaseClient(db_faults, tables=tables),
+        async_supabase_client=FakeSupabaseClient(db_faults, asynchronous=True, tables=tables)
+    )
+    if utils.profile_outbox is not None:
+        # A throwaway outbox, so rows from earlier runs aren't replayed into this one.
+        utils.profile_outbox = ProfileOutbox(utils._write_profile_rows, utils._profile_write_abandoned, path=f"{tempfile.mkdtemp()}/outbox.sqlite3")
+    if not args.keep_caches:
+        # Every request uses the same sample bytes, so without this everything after the first is a cache hit.
+        utils.result_cache = ResultCache(LRUResultCache(max_entries=0))
+        utils.UPLOAD_HANDLE_MAX_ENTRIES = 0
+    return gemini
+
+
+async def invoke_graph(request_id: str, input_type: str, file_name: str, file_bytes: bytes, http_client) -> bool:
+    from agentic_workflow import get_app
+    final_state = await get_app().ainvoke({
+        "user_id": request_id, "file_bytes": file_bytes, "file_name": file_name, "input_type": input_type
+    })
+    return bool(final_state.get("final_response")) and not final_state.get("error_message")
+
+
+async def invoke_api(request_id: str, input_type: str, file_name: str, file_bytes: bytes, http_client) -> bool:
+    response = await http_client.post(
+        "/diagnose",
+        data={"user_id": request_id, "input_type": input_type},
+        files={"file": (file_name, file_bytes)}
+    )
+    return response.status_code == 200
+
+
+TARGETS = {"graph": invoke_graph, "api": invoke_api}
+
+
+async def run_level(target: str, sample_name: str, sample: tuple, concurrency: int, requests: int, http_client) -> dict:
+    input_type, file_name, file_bytes = sample
+    invoke = TARGETS[target]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                ok = await invoke(f"bench-{target}-{sample_name}-{concurrency}-{i}", input_type, file_name, file_bytes, http_client)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            if not ok:
+                failures += 1
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "target": target, "input": sample_name, "concurrency": concurrency, "requests": requests,
+        "failed": failures, "wall_s": wall, "throughput_rps": requests / wall,
+        "p50_s": percentile(latencies, 50), "p95_s": percentile(latencies, 95), "p99_s": percentile(latencies, 99),
+    }
+
+
+async def measure_peak_memory(target: str, sample_name: str, sample: tuple, concurrency: int, http_client) -> float:
+    """Peak traced Python allocations while `concurrency` requests for this input are in flight."""
+    tracemalloc.start()
+    try:
+        await run_level(target, sample_name, sample, concurrency, concurrency, http_client)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput/memory benchmark for GlycoSight AI.")
+    parser.add_argument("--target", default="both", choices=["graph", "api", "both"])
+    parser.add_argument("--inputs", nargs="+", default=list(SAMPLE_BUILDERS), choices=list(SAMPLE_BUILDERS))
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 5, 10, 25])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per input and concurrency level.")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Mean model call latency.")
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--upload-latency-ms", type=float, default=150)
+    parser.add_argument("--db-latency-ms", type=float, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of Gemini calls that fail with a 503.")
+    parser.add_argument("--db-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--keep-caches", action="store_true", help="Leave the result and upload caches on.")
+    parser.add_argument("--skip-memory", action="store_true")
+    parser.add_argument("--json", dest="json_path", help="Also write the results to this file.")
+    args = parser.parse_args()
+
+    gemini = install_fakes(args)
+    samples = {}
+    for name in args.inputs:
+        input_type, file_name, build = SAMPLE_BUILDERS[name]
+        samples[name] = (input_type, file_name, build())
+
+    targets = ["graph", "api"] if args.target == "both" else [args.target]
+    results = []
+    peak_memory = []
+    from api import app as api_app
+    transport = httpx.ASGITransport(app=api_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http_client:
+        print(f"{'target':>6} {'input':>12} {'conc':>5} {'reqs':>5} {'failed':>6} {'rps':>7} "
+              f"{'p50_s':>7} {'p95_s':>7} {'p99_s':>7}")
+        for target in targets:
+            for name, sample in samples.items():
+                for level in args.levels:
+                    r = await run_level(target, name, sample, level, args.requests, http_client)
+                    results.append(r)
+                    print(f"{r['target']:>6} {r['input']:>12} {r['concurrency']:>5} {r['requests']:>5} {r['failed']:>6} "
+                          f"{r['throughput_rps']:>7.2f} {r['p50_s']:>7.3f} {r['p95_s']:>7.3f} {r['p99_s']:>7.3f}")
+
+        if not args.skip_memory:
+            print(f"\n{'target':>6} {'input':>12} {'conc':>5} {'size_kb':>8} {'peak_mb':>8}")
+            for target in targets:
+                for name, sample in samples.items():
+                    level = max(args.levels)
+                    peak_mb = await measure_peak_memory(target, name, sample, level, http_client)
+                    peak_memory.append({"target": target, "input": name, "concurrency": level, "peak_mb": peak_mb})
+                    print(f"{target:>6} {name:>12} {level:>5} {len(sample[2]) / 1024:>8.0f} {peak_mb:>8.1f}")
+
+    print(f"\nFake Gemini calls: {gemini.fake.calls}")
+    if utils.profile_outbox is not None:
+        utils.profile_outbox.stop()
+        print(f"Profile outbox after drain: {utils.profile_outbox.stats()}")
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({"args": vars(args), "latency": results, "peak_memory": peak_memory,
+                       "gemini_calls": gemini.fake.calls}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
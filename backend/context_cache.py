@@ -0,0 +1,120 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from prompts import final_rag_prompt, visual_rag_prompt
+
+# Each static prefix is a guideline corpus followed by the system prompt that always accompanies it.
+STATIC_PREFIXES = {
+    "ada_rag": ("ada", final_rag_prompt),
+    "visual_rag": ("visual_rag", visual_rag_prompt),
+}
+
+CACHE_TTL = timedelta(hours=1)
+RENEW_MARGIN = timedelta(minutes=10)
+FAILURE_BACKOFF = timedelta(minutes=5)
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "true").lower() == "true"
+
+
+class ContextCacheManager:
+    """Keeps one Gemini cached-content entry per static prefix alive, renewing it before its TTL runs out."""
+
+    def __init__(self, route_for, corpus_registry, prefixes: dict = STATIC_PREFIXES,
+                 ttl: timedelta = CACHE_TTL, renew_margin: timedelta = RENEW_MARGIN, enabled: bool = CONTEXT_CACHE_ENABLED):
+        # Caches are tied to a model, so each prefix is created with the model its task is routed to.
+        self.route_for = route_for
+        self.corpus_registry = corpus_registry
+        self.prefixes = prefixes
+        self.ttl = ttl
+        self.renew_margin = renew_margin
+        self.enabled = enabled
+        self._entries = {}
+        self._retry_after = {}
+        self._async_locks = {key: asyncio.Lock() for key in prefixes}
+        self.usage = {key: {"calls": 0, "cached_calls": 0, "cached_tokens": 0, "uncached_tokens": 0, "output_tokens": 0}
+                      for key in prefixes}
+
+    def _ttl_config(self) -> dict:
+        return {"ttl": f"{int(self.ttl.total_seconds())}s"}
+
+    def _state(self, key: str) -> str:
+        now = datetime.now(timezone.utc)
+        if now < self._retry_after.get(key, now):
+            return "backoff"
+        entry = self._entries.get(key)
+        if entry is None:
+            return "missing"
+        if now >= entry["expires_at"]:
+            return "missing"
+        if now >= entry["expires_at"] - self.renew_margin:
+            return "renew"
+        return "fresh"
+
+    def _store(self, key: str, cached) -> str:
+        expires_at = cached.expire_time or datetime.now(timezone.utc) + self.ttl
+        self._entries[key] = {"name": cached.name, "expires_at": expires_at}
+        self._retry_after.pop(key, None)
+        return cached.name
+
+    def _mark_failed(self, key: str, error: Exception):
+        print(f"---CONTEXT_CACHE: Could not prepare '{key}', using uncached path: {error}---")
+        self.invalidate(key)
+        self._retry_after[key] = datetime.now(timezone.utc) + FAILURE_BACKOFF
+
+    def _create_config(self, key: str, corpus_part) -> dict:
+        _, static_prompt = self.prefixes[key]
+        return {
+            "contents": [corpus_part, static_prompt],
+            "display_name": f"glycosight-{key}",
+            **self._ttl_config(),
+        }
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    async def aget(self, key: str):
+        if not self.enabled:
+            return None
+        if self._state(key) == "fresh":
+            return self._entries[key]["name"]
+        async with self._async_locks[key]:
+            state = self._state(key)
+            try:
+                if state == "renew":
+                    cached = await self.route_for(key).client.aio.caches.update(name=self._entries[key]["name"], config=self._ttl_config())
+                    return self._store(key, cached)
+                if state == "missing":
+                    corpus_part = await self.corpus_registry.aget(self.prefixes[key][0])
+                    route = self.route_for(key)
+                    cached = await route.client.aio.caches.create(model=route.model, config=self._create_config(key, corpus_part))
+                    print(f"---CONTEXT_CACHE: Created '{key}' as {cached.name}---")
+                    return self._store(key, cached)
+                if state == "backoff":
+                    return None
+                return self._entries[key]["name"]
+            except Exception as e:
+                self._mark_failed(key, e)
+                return None
+
+    async def awarm_up(self, keys: list = None):
+        await asyncio.gather(*(self.aget(key) for key in (self.prefixes if keys is None else keys)))
+
+    def record_usage(self, key: str, response) -> dict:
+        usage_metadata = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", None) or 0
+        call_usage = {
+            "cached_tokens": cached_tokens,
+            "uncached_tokens": prompt_tokens - cached_tokens,
+            "output_tokens": output_tokens,
+        }
+
+        totals = self.usage[key]
+        totals["calls"] += 1
+        totals["cached_calls"] += 1 if cached_tokens else 0
+        for field, value in call_usage.items():
+            totals[field] += value
+
+        print(f"---TOKENS: {key} cached={call_usage['cached_tokens']} "
+              f"uncached={call_usage['uncached_tokens']} output={call_usage['output_tokens']}---")
+        return call_usage
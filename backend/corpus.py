@@ -0,0 +1,88 @@
+import asyncio
+import pathlib
+import time
+from datetime import datetime, timedelta, timezone
+from google.genai import types
+from tracing import span
+
+ASSETS_DIR = pathlib.Path(__file__).parent / "assets"
+
+CORPUS_FILES = {
+    "ada": ASSETS_DIR / "ADA.pdf",
+    "visual_rag": ASSETS_DIR / "VisualRAG.pdf",
+}
+CORPUS_TITLES = {
+    "ada": "Classification and Diagnosis of Diabetes: Standards of Medical Care in Diabetes 2022 (ADA)",
+    "visual_rag": "VisualRAG reference collection",
+}
+
+# Files uploaded through the Gemini Files API are deleted after 48 hours.
+FILE_TTL = timedelta(hours=48)
+REFRESH_MARGIN = timedelta(hours=2)
+FAILURE_BACKOFF = timedelta(minutes=5)
+PROCESSING_POLL_SECONDS = 1
+PROCESSING_TIMEOUT_SECONDS = 60
+
+
+class CorpusRegistry:
+    """Uploads each static guideline PDF once and hands out the file reference until it nears expiry."""
+
+    def __init__(self, get_client, files: dict = CORPUS_FILES, refresh_margin: timedelta = REFRESH_MARGIN):
+        self.get_client = get_client
+        self.files = {name: pathlib.Path(path) for name, path in files.items()}
+        self.refresh_margin = refresh_margin
+        self._handles = {}
+        self._retry_after = {}
+        self._async_locks = {name: asyncio.Lock() for name in self.files}
+
+    def _is_fresh(self, name: str) -> bool:
+        handle = self._handles.get(name)
+        if handle is None:
+            return False
+        return datetime.now(timezone.utc) < handle["expires_at"] - self.refresh_margin
+
+    def _in_backoff(self, name: str) -> bool:
+        now = datetime.now(timezone.utc)
+        return now < self._retry_after.get(name, now)
+
+    def _store(self, name: str, uploaded: types.File) -> types.File:
+        expires_at = uploaded.expiration_time or datetime.now(timezone.utc) + FILE_TTL
+        self._handles[name] = {"file": uploaded, "expires_at": expires_at}
+        self._retry_after.pop(name, None)
+        return uploaded
+
+    def _mark_failed(self, name: str, error: Exception):
+        print(f"---CORPUS: Upload of '{name}' failed, inlining bytes instead: {error}---")
+        self._retry_after[name] = datetime.now(timezone.utc) + FAILURE_BACKOFF
+
+    def _fallback_part(self, name: str) -> types.Part:
+        return types.Part.from_bytes(data=self.files[name].read_bytes(), mime_type="application/pdf")
+
+    def _upload_config(self, name: str) -> dict:
+        return {"mime_type": "application/pdf", "display_name": f"glycosight-{name}"}
+
+    async def aget(self, name: str):
+        if self._is_fresh(name):
+            return self._handles[name]["file"]
+        async with self._async_locks[name]:
+            if self._is_fresh(name):
+                return self._handles[name]["file"]
+            if self._in_backoff(name):
+                return await asyncio.to_thread(self._fallback_part, name)
+            try:
+                with span("gemini_upload", f"corpus.{name}", size_bytes=self.files[name].stat().st_size):
+                    uploaded = await self.get_client().aio.files.upload(file=self.files[name], config=self._upload_config(name))
+                deadline = time.monotonic() + PROCESSING_TIMEOUT_SECONDS
+                while uploaded.state == types.FileState.PROCESSING and time.monotonic() < deadline:
+                    await asyncio.sleep(PROCESSING_POLL_SECONDS)
+                    uploaded = await self.get_client().aio.files.get(name=uploaded.name)
+                if uploaded.state == types.FileState.FAILED:
+                    raise RuntimeError(f"Gemini failed to process corpus file '{name}'")
+                print(f"---CORPUS: Uploaded '{name}' as {uploaded.name}---")
+                return self._store(name, uploaded)
+            except Exception as e:
+                self._mark_failed(name, e)
+                return await asyncio.to_thread(self._fallback_part, name)
+
+    async def awarm_up(self, names: list = None):
+        await asyncio.gather(*(self.aget(name) for name in (self.files if names is None else names)))
@@ -0,0 +1,297 @@
+# Offline BM25 index over the guideline corpora, so the RAG step sends a handful of relevant passages instead of
+# the whole ADA document. The index is built ahead of time and shipped under assets/index:
+#
+#   python corpus_index.py build
+#
+# Postings are stored as .npy arrays and memory-mapped at load, so a cold start only maps them in; chunk text and
+# page/section metadata live next to them in JSON.
+
+import json
+import logging
+import os
+import pathlib
+import re
+import sys
+import threading
+import numpy as np
+from corpus import ASSETS_DIR, CORPUS_FILES, CORPUS_TITLES
+from result_cache import file_sha256
+
+RAG_RETRIEVAL_ENABLED = os.getenv("RAG_RETRIEVAL_ENABLED", "true").lower() == "true"
+CORPUS_INDEX_DIR = pathlib.Path(os.getenv("CORPUS_INDEX_DIR", str(ASSETS_DIR / "index")))
+# Corpora searched for the lab-report diagnosis. VisualRAG is indexed too, but scan analysis keeps the full
+# document since what it compares against are the reference images.
+RAG_CORPORA = [name.strip() for name in os.getenv("RAG_CORPORA", "ada").split(",") if name.strip()]
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+RAG_PASSAGES_PER_QUERY = int(os.getenv("RAG_PASSAGES_PER_QUERY", "2"))
+
+INDEX_VERSION = 1
+CHUNK_WORDS = 160
+CHUNK_OVERLAP_WORDS = 40
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+SYNONYMS = {"hba1c": "a1c", "glycated": "a1c"}
+STOPWORDS = set(
+    "a an and are as at be been but by for from had has have if in into is it its may more most no not of on or "
+    "such than that the their then there these they this those to was were which while who will with".split()
+)
+# A line ending in one of these is a sentence wrapping onto the next line, not a heading.
+TRAILING_WORDS = {"a", "an", "and", "as", "at", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+HEADING_PATTERN = re.compile(r"[A-Z][A-Z0-9 ,/\-–—()]{3,}")
+ARRAYS = ("term_ptr", "doc_ids", "term_freqs", "doc_lengths", "doc_corpus", "idf")
+
+# One retrieval query per parameter that has a value; abnormal ones are searched first.
+LAB_QUERIES = {
+    "hba1c": "A1C criteria diagnosis diabetes prediabetes 6.5% 5.7% assay",
+    "fasting_plasma_glucose": "fasting plasma glucose FPG 126 mg/dL impaired fasting glucose 100",
+    "two_hr_ogtt_glucose": "2-h plasma glucose oral glucose tolerance test OGTT 200 mg/dL impaired glucose tolerance 140",
+    "random_plasma_glucose": "random plasma glucose 200 mg/dL classic symptoms hyperglycemia hyperglycemic crisis",
+    "bmi": "BMI overweight obesity 25 kg/m2 23 Asian American risk-based testing",
+}
+HISTORY_QUERIES = {
+    "family_history_diabetes": "first-degree relative with diabetes family history risk",
+    "history_gestational_diabetes": "women diagnosed with gestational diabetes mellitus lifelong testing",
+    "history_prediabetes": "prediabetes testing yearly progression",
+    "history_hypertension": "hypertension 140/90 risk factor testing",
+    "history_dyslipidemia": "HDL cholesterol triglyceride level risk factor",
+    "history_pcos": "polycystic ovary syndrome risk",
+}
+SYMPTOM_QUERY = "classic symptoms of hyperglycemia polyuria polydipsia weight loss"
+BASE_QUERY = "criteria for the diagnosis of diabetes and prediabetes classification type 2"
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = SYNONYMS.get(token, token)
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _is_subheading(lines: list, i: int) -> bool:
+    """A short, unpunctuated line between the end of a paragraph and a capitalised line, e.g. 'Race/Ethnicity'."""
+    line = lines[i].strip()
+    previous = lines[i - 1].strip() if i > 0 else ""
+    following = lines[i + 1].strip() if i + 1 < len(lines) else ""
+    words = line.split()
+    return (
+        0 < len(line) < 60 and len(words) <= 6 and line[0].isupper() and any(c.islower() for c in line)
+        and "," not in line and line[-1] not in ".;:-)" and words[-1].lower() not in TRAILING_WORDS
+        and (not previous or previous[-1] in ".)")
+        and following[:1].isupper()
+    )
+
+
+def chunk_pages(corpus: str, pages: list) -> list:
+    """Splits each page into overlapping word windows, tagged with the page and the section heading they sit under."""
+    chunks = []
+    section, subsection = None, None
+    for page_number, text in enumerate(pages, start=1):
+        lines = re.sub(r"-\n(?=[a-z])", "", text).splitlines()
+        words, new_words, heading = [], 0, []
+        started_under = (section, subsection)
+
+        def flush(keep: int = 0):
+            nonlocal words, new_words, started_under
+            if new_words:
+                section_name, subsection_name = started_under
+                chunks.append({
+                    "id": f"{corpus}-p{page_number}-{sum(chunk['page'] == page_number for chunk in chunks if chunk['corpus'] == corpus) + 1}",
+                    "corpus": corpus,
+                    "page": page_number,
+                    "section": section_name,
+                    "subsection": subsection_name,
+                    "text": " ".join(words),
+                })
+            words, new_words = (words[-keep:] if keep else []), 0
+            started_under = (section, subsection)
+
+        for i, raw_line in enumerate(lines):
+            line = raw_line.strip()
+            # Section headings are set in capitals and often wrap over several lines.
+            if HEADING_PATTERN.fullmatch(line):
+                heading.append(line)
+                continue
+            if heading:
+                flush()
+                section, subsection, heading = " ".join(heading), None, []
+                started_under = (section, subsection)
+            elif _is_subheading(lines, i):
+                flush()
+                subsection = line
+                started_under = (section, subsection)
+            line_words = line.split()
+            words.extend(line_words)
+            new_words += len(line_words)
+            if len(words) >= CHUNK_WORDS:
+                flush(keep=CHUNK_OVERLAP_WORDS)
+        flush()
+        if heading:
+            section, subsection = " ".join(heading), None
+    return chunks
+
+
+def extract_pages(path: pathlib.Path) -> list:
+    from pypdf import PdfReader
+    logging.getLogger("pypdf").setLevel(logging.ERROR)
+    return [page.extract_text() or "" for page in PdfReader(path).pages]
+
+
+def build(files: dict = CORPUS_FILES, out_dir: pathlib.Path = CORPUS_INDEX_DIR):
+    corpora = list(files)
+    chunks = []
+    for name, path in files.items():
+        chunks.extend(chunk_pages(name, extract_pages(path)))
+
+    postings = {}
+    doc_lengths = np.zeros(len(chunks), dtype=np.float32)
+    for doc_id, chunk in enumerate(chunks):
+        tokens = tokenize(f"{chunk['section'] or ''} {chunk['subsection'] or ''} {chunk['text']}")
+        doc_lengths[doc_id] = len(tokens)
+        for token in tokens:
+            counts = postings.setdefault(token, {})
+            counts[doc_id] = counts.get(doc_id, 0) + 1
+
+    vocabulary = sorted(postings)
+    term_ptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    doc_ids, term_freqs = [], []
+    for i, token in enumerate(vocabulary):
+        docs = sorted(postings[token].items())
+        doc_ids.extend(doc for doc, _ in docs)
+        term_freqs.extend(count for _, count in docs)
+        term_ptr[i + 1] = len(doc_ids)
+    document_frequency = np.diff(term_ptr).astype(np.float32)
+    arrays = {
+        "term_ptr": term_ptr,
+        "doc_ids": np.asarray(doc_ids, dtype=np.int32),
+        "term_freqs": np.asarray(term_freqs, dtype=np.float32),
+        "doc_lengths": doc_lengths,
+        "doc_corpus": np.asarray([corpora.index(chunk["corpus"]) for chunk in chunks], dtype=np.int8),
+        "idf": np.log(1 + (len(chunks) - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32),
+    }
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(out_dir / f"{name}.npy", array)
+    (out_dir / "chunks.json").write_text(json.dumps(chunks, ensure_ascii=False))
+    (out_dir / "manifest.json").write_text(json.dumps({
+        "version": INDEX_VERSION,
+        "corpora": corpora,
+        "sources": {name: file_sha256(str(path)) for name, path in files.items()},
+        "avg_doc_length": float(doc_lengths.mean()) if len(chunks) else 0.0,
+        "vocabulary": {token: i for i, token in enumerate(vocabulary)},
+    }, ensure_ascii=False))
+    print(f"---CORPUS_INDEX: Indexed {len(chunks)} chunks, {len(vocabulary)} terms into {out_dir}---")
+
+
+def retrieval_queries(clinical_data: dict) -> list:
+    lab_results = clinical_data.get("lab_results") or {}
+    history = clinical_data.get("symptoms_history") or {}
+    present = [field for field in LAB_QUERIES if (lab_results.get(field) or {}).get("value") is not None]
+    abnormal = [field for field in present if (lab_results[field].get("status_flag") or "").lower() in ("high", "low")]
+    queries = [LAB_QUERIES[field] for field in abnormal + [field for field in present if field not in abnormal]]
+    if any(history.get(symptom) for symptom in ("polyuria", "polydipsia", "polyphagia", "unexplained_weight_loss")):
+        queries.append(SYMPTOM_QUERY)
+    queries.extend(query for field, query in HISTORY_QUERIES.items() if history.get(field))
+    if history.get("ethnicity"):
+        queries.append(f"race ethnicity {history['ethnicity']} high-risk testing")
+    queries.append(BASE_QUERY)
+    return queries
+
+
+class CorpusIndex:
+    """Loads the prebuilt index on first use and answers BM25 queries over it."""
+
+    def __init__(self, index_dir: pathlib.Path = CORPUS_INDEX_DIR, enabled: bool = RAG_RETRIEVAL_ENABLED):
+        self.index_dir = pathlib.Path(index_dir)
+        self.enabled = enabled
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def available(self) -> bool:
+        return self.enabled and (self.index_dir / "manifest.json").exists()
+
+    def _load(self):
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    manifest = json.loads((self.index_dir / "manifest.json").read_text())
+                    if manifest["version"] != INDEX_VERSION:
+                        raise RuntimeError(f"Corpus index version {manifest['version']} != {INDEX_VERSION}, rebuild it")
+                    for name, sha256 in manifest["sources"].items():
+                        path = CORPUS_FILES.get(name)
+                        if path is not None and path.exists() and file_sha256(str(path)) != sha256:
+                            print(f"---CORPUS_INDEX: '{name}' changed since the index was built; "
+                                  f"run `python corpus_index.py build`---")
+                    arrays = {name: np.load(self.index_dir / f"{name}.npy", mmap_mode="r") for name in ARRAYS}
+                    chunks = json.loads((self.index_dir / "chunks.json").read_text())
+                    self._loaded = (manifest, arrays, chunks)
+        return self._loaded
+
+    def search(self, query: str, k: int, corpora: list = None) -> list:
+        manifest, arrays, chunks = self._load()
+        scores = np.zeros(len(chunks), dtype=np.float32)
+        average_length = manifest["avg_doc_length"] or 1.0
+        for token in set(tokenize(query)):
+            term = manifest["vocabulary"].get(token)
+            if term is None:
+                continue
+            start, end = arrays["term_ptr"][term], arrays["term_ptr"][term + 1]
+            docs = arrays["doc_ids"][start:end]
+            tf = arrays["term_freqs"][start:end]
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * arrays["doc_lengths"][docs] / average_length)
+            scores[docs] += arrays["idf"][term] * tf * (BM25_K1 + 1) / (tf + norm)
+        if corpora:
+            allowed = [manifest["corpora"].index(name) for name in corpora if name in manifest["corpora"]]
+            scores[~np.isin(arrays["doc_corpus"], allowed)] = 0
+        top = np.argsort(-scores)[:k]
+        return [{**chunks[i], "score": float(scores[i])} for i in top if scores[i] > 0]
+
+    def passages_for(self, clinical_data: dict, k: int = RAG_TOP_K, corpora: list = RAG_CORPORA) -> list:
+        """The top passages across one query per parameter, so every abnormal value gets its own evidence."""
+        passages = {}
+        for query in retrieval_queries(clinical_data):
+            for hit in self.search(query, RAG_PASSAGES_PER_QUERY, corpora):
+                passages.setdefault(hit["id"], hit)
+            if len(passages) >= k:
+                break
+        return list(passages.values())[:k]
+
+
+def _location(passage: dict) -> str:
+    parts = [f"Page {passage['page']}", passage.get("subsection"), passage.get("section")]
+    return ", ".join(part for part in parts if part)
+
+
+def format_passages(passages: list) -> str:
+    return "\n\n".join(
+        f"[{passage['id']}] {_location(passage)}, {CORPUS_TITLES.get(passage['corpus'], passage['corpus'])}\n{passage['text']}"
+        for passage in passages
+    )
+
+
+def resolve_citations(response: dict, passages: list) -> dict:
+    """Rewrites each citation's reference from the metadata of the chunk it names."""
+    by_id = {passage["id"]: passage for passage in passages}
+    for citation in response.get("citations") or []:
+        passage = by_id.get(citation.get("chunk_id"))
+        if passage is None:
+            if citation.get("chunk_id"):
+                print(f"---CORPUS_INDEX: Citation names unknown chunk '{citation['chunk_id']}'---")
+                citation["chunk_id"] = None
+            continue
+        citation["page"] = passage["page"]
+        citation["reference"] = f"{_location(passage)}, {CORPUS_TITLES.get(passage['corpus'], passage['corpus'])}"
+    return response
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["build"]:
+        sys.exit("Usage: python corpus_index.py build")
+    build()
@@ -0,0 +1,97 @@
+import io
+import os
+import numpy as np
+import pydicom
+from pydicom.pixels import pixel_array, apply_rescale, apply_voi_lut
+from PIL import Image
+
+# Gemini downsamples large images anyway, so anything past this only costs upload bandwidth.
+DICOM_MAX_DIMENSION = int(os.getenv("DICOM_MAX_DIMENSION", "1024"))
+DICOM_MAX_FRAMES = int(os.getenv("DICOM_MAX_FRAMES", "4"))
+DICOM_JPEG_QUALITY = int(os.getenv("DICOM_JPEG_QUALITY", "90"))
+
+
+def _as_source(dicom_data):
+    if isinstance(dicom_data, (bytes, bytearray)):
+        return io.BytesIO(dicom_data)
+    return dicom_data
+
+
+def select_frame_indices(number_of_frames: int, max_frames: int = DICOM_MAX_FRAMES) -> list:
+    """Picks evenly spaced frames, always including the middle one for single-frame selection."""
+    if number_of_frames <= max_frames:
+        return list(range(number_of_frames))
+    if max_frames == 1:
+        return [number_of_frames // 2]
+    return np.linspace(0, number_of_frames - 1, max_frames).round().astype(int).tolist()
+
+
+def _first_value(value) -> float:
+    return float(value[0] if isinstance(value, pydicom.multival.MultiValue) else value)
+
+
+def normalize_to_uint8(frame: np.ndarray, dataset) -> np.ndarray:
+    """
+    Applies rescale slope/intercept and VOI windowing, then maps the result to 8-bit. When the header lists several
+    windows (e.g. soft tissue and bone), the first, default one is used for every frame. Windowed frames are scaled
+    by the window's output range rather than their own min/max, so every frame of a study shares one gray scale.
+    """
+    if dataset.get("SamplesPerPixel", 1) == 3:
+        if frame.dtype == np.uint8:
+            return frame
+        frame = frame.astype(np.float32)
+        low, high = frame.min(), frame.max()
+        return ((frame - low) / max(high - low, 1e-6) * 255).astype(np.uint8)
+
+    frame = apply_rescale(frame, dataset).astype(np.float32)
+    if "VOILUTSequence" in dataset:
+        frame = apply_voi_lut(frame, dataset, index=0).astype(np.float32)
+        low, high = 0, 2 ** dataset.VOILUTSequence[0].LUTDescriptor[2] - 1
+    elif "WindowCenter" in dataset and "WindowWidth" in dataset:
+        center, width = _first_value(dataset.WindowCenter), _first_value(dataset.WindowWidth)
+        low, high = center - width / 2, center + width / 2
+    else:
+        low, high = np.percentile(frame, (0.5, 99.5))
+
+    frame = np.clip((frame - low) / max(high - low, 1e-6), 0, 1)
+    if dataset.get("PhotometricInterpretation") == "MONOCHROME1":
+        frame = 1 - frame
+    return (frame * 255).astype(np.uint8)
+
+
+def _montage(frames: list) -> np.ndarray:
+    columns = int(np.ceil(np.sqrt(len(frames))))
+    rows = int(np.ceil(len(frames) / columns))
+    height, width = frames[0].shape[:2]
+    grid = np.zeros((rows * height, columns * width) + frames[0].shape[2:], dtype=np.uint8)
+    for i, frame in enumerate(frames):
+        row, column = divmod(i, columns)
+        grid[row * height:(row + 1) * height, column * width:(column + 1) * width] = frame
+    return grid
+
+
+def convert_dicom_to_jpeg_bytes(dicom_data, max_dimension: int = DICOM_MAX_DIMENSION,
+                                max_frames: int = DICOM_MAX_FRAMES, quality: int = DICOM_JPEG_QUALITY) -> bytes:
+    """
+    Renders a DICOM study as a single JPEG in memory. Only the header is parsed up front; pixel data is
+    decoded frame by frame for the selected frames, which are tiled into one image when there are several.
+    """
+    source = _as_source(dicom_data)
+    dataset = pydicom.dcmread(source, stop_before_pixels=True)
+    number_of_frames = int(dataset.get("NumberOfFrames", 1) or 1)
+
+    frames = []
+    for frame_index in select_frame_indices(number_of_frames, max_frames):
+        if hasattr(source, "seek"):
+            source.seek(0)
+        frame = pixel_array(source, index=frame_index if number_of_frames > 1 else None)
+        frames.append(normalize_to_uint8(frame, dataset))
+
+    image = Image.fromarray(frames[0] if len(frames) == 1 else _montage(frames))
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue()
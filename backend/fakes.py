@@ -0,0 +1,273 @@
+# Local stand-ins for the Gemini and Supabase clients, so the workflow can be benchmarked offline.
+# They implement only the calls this backend makes, with configurable latency and error injection.
+
+import asyncio
+import io
+import json
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from google.genai import errors, types
+from postgrest.exceptions import APIError
+from PIL import Image
+from schemas import DiabetesClinicalData, ImageClassificationWithData, RAGDiagnosisResponse
+
+# Rough token costs, only used to fill in usage metadata.
+TOKENS_PER_FILE = 258
+TOKENS_PER_CORPUS = 120_000
+STREAM_CHUNK_CHARS = 64
+
+SAMPLE_CLINICAL_DATA = {
+    "patient_info": {"name": "Benchmark Patient", "age_years": 52, "gender": "Female", "report_date": "2025-03-14"},
+    "lab_results": {
+        "hba1c": {"value": 6.8, "unit": "%", "status_flag": "High"},
+        "fasting_plasma_glucose": {"value": 131, "unit": "mg/dL", "status_flag": "High"},
+        "two_hr_ogtt_glucose": {"value": None, "unit": None, "status_flag": None},
+        "random_plasma_glucose": {"value": None, "unit": None, "status_flag": None},
+        "bmi": {"value": 29.4, "unit": "kg/m2", "status_flag": "High"},
+    },
+    "symptoms_history": {"polyuria": True, "fatigue": True, "family_history_diabetes": True},
+}
+
+SAMPLE_DIAGNOSIS = {
+    "summary": "Lab values meet the ADA thresholds for Type 2 Diabetes.",
+    "analysis": [
+        {"parameter_name": "HbA1c", "analysis_text": "6.8% is at or above the 6.5% diagnostic threshold."},
+        {"parameter_name": "Fasting Plasma Glucose", "analysis_text": "131 mg/dL is above the 126 mg/dL threshold."},
+    ],
+    "citations": [{"id": 1, "reference": "ADA Standards of Care in Diabetes, Section 2", "url": "https://diabetesjournals.org"}],
+    "final_diagnosis": "High risk of Type 2 Diabetes",
+    "confidence_score": {"score": 85, "justification": "Two independent lab values agree."},
+    "alert_color": "red",
+}
+
+
+class FaultProfile:
+    """Latency and error-rate knobs shared by the fake clients."""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0.0, seed: int = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def delay(self) -> float:
+        return max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+def _config_value(config, name: str):
+    if config is None:
+        return None
+    if isinstance(config, dict):
+        return config.get(name)
+    return getattr(config, name, None)
+
+
+def _classify_upload(file_bytes: bytes):
+    """Light images are treated as photographed reports, dark ones as scans."""
+    try:
+        with Image.open(io.BytesIO(file_bytes)) as image:
+            image.draft("L", (64, 64))
+            histogram = image.convert("L").resize((64, 64)).histogram()
+    except Exception:
+        return None
+    mean = sum(level * count for level, count in enumerate(histogram)) / max(sum(histogram), 1)
+    return "TRUE" if mean > 127 else "FALSE"
+
+
+class FakeGemini:
+    """Shared state and response logic behind the async surfaces of FakeGeminiClient."""
+
+    def __init__(self, model_faults: FaultProfile, upload_faults: FaultProfile):
+        self.model_faults = model_faults
+        self.upload_faults = upload_faults
+        self.image_types = {}
+        self.calls = {"generate": 0, "upload": 0, "cache": 0}
+
+    def _server_error(self):
+        return errors.ServerError(503, {"error": {"code": 503, "message": "Injected failure", "status": "UNAVAILABLE"}})
+
+    def upload(self, file, config=None) -> types.File:
+        self.calls["upload"] += 1
+        if self.upload_faults.should_fail():
+            raise self._server_error()
+        name = f"files/{uuid.uuid4().hex[:16]}"
+        if isinstance(file, io.BytesIO):
+            self.image_types[name] = _classify_upload(file.getvalue())
+        return types.File(
+            name=name, uri=f"https://fake.googleapis.com/{name}", state=types.FileState.ACTIVE,
+            mime_type=_config_value(config, "mime_type"),
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48)
+        )
+
+    def get_file(self, name: str) -> types.File:
+        return types.File(name=name, uri=f"https://fake.googleapis.com/{name}", state=types.FileState.ACTIVE)
+
+    def cache(self, config=None) -> types.CachedContent:
+        self.calls["cache"] += 1
+        if self.model_faults.should_fail():
+            raise self._server_error()
+        ttl_seconds = int(str(_config_value(config, "ttl") or "3600s").rstrip("s"))
+        return types.CachedContent(
+            name=f"cachedContents/{uuid.uuid4().hex[:16]}",
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+        )
+
+    def respond(self, contents: list, config=None):
+        self.calls["generate"] += 1
+        if self.model_faults.should_fail():
+            raise self._server_error()
+
+        files = [part for part in contents if isinstance(part, (types.File, types.Part))]
+        image_type = next((self.image_types[f.name] for f in files
+                           if isinstance(f, types.File) and self.image_types.get(f.name)), "TRUE")
+        schema = _config_value(config, "response_schema")
+        if schema is DiabetesClinicalData:
+            text = json.dumps(SAMPLE_CLINICAL_DATA)
+        elif schema is ImageClassificationWithData:
+            clinical_data = SAMPLE_CLINICAL_DATA if image_type == "TRUE" else DiabetesClinicalData().model_dump()
+            text = json.dumps({"image_type": image_type, "clinical_data": clinical_data})
+        elif schema is RAGDiagnosisResponse:
+            text = json.dumps(SAMPLE_DIAGNOSIS)
+        else:
+            text = image_type
+
+        cached_tokens = TOKENS_PER_CORPUS if _config_value(config, "cached_content") else 0
+        prompt_tokens = sum(len(part) for part in contents if isinstance(part, str)) // 4 \
+            + TOKENS_PER_FILE * len(files) + cached_tokens
+        usage_metadata = types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens, cached_content_token_count=cached_tokens,
+            candidates_token_count=len(text) // 4
+        )
+        return text, usage_metadata
+
+    @staticmethod
+    def response(text: str, usage_metadata=None) -> types.GenerateContentResponse:
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(parts=[types.Part(text=text)], role="model"))],
+            usage_metadata=usage_metadata
+        )
+
+
+class _AsyncModels:
+    def __init__(self, fake: FakeGemini):
+        self._fake = fake
+
+    async def generate_content(self, model: str, contents: list, config=None):
+        await asyncio.sleep(self._fake.model_faults.delay())
+        return FakeGemini.response(*self._fake.respond(contents, config))
+
+    async def generate_content_stream(self, model: str, contents: list, config=None):
+        total_delay = self._fake.model_faults.delay()
+        text, usage_metadata = self._fake.respond(contents, config)
+        chunks = [text[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(text), STREAM_CHUNK_CHARS)] or [""]
+
+        async def stream():
+            # Spread the latency so the first chunk arrives early, like a real streamed response.
+            for i, chunk in enumerate(chunks):
+                await asyncio.sleep(total_delay / len(chunks))
+                yield FakeGemini.response(chunk, usage_metadata if i == len(chunks) - 1 else None)
+
+        return stream()
+
+
+class _AsyncFiles:
+    def __init__(self, fake: FakeGemini):
+        self._fake = fake
+
+    async def upload(self, file, config=None):
+        await asyncio.sleep(self._fake.upload_faults.delay())
+        return self._fake.upload(file, config)
+
+    async def get(self, name: str):
+        return self._fake.get_file(name)
+
+
+class _AsyncCaches:
+    def __init__(self, fake: FakeGemini):
+        self._fake = fake
+
+    async def create(self, model: str, config=None):
+        await asyncio.sleep(self._fake.upload_faults.delay())
+        return self._fake.cache(config)
+
+    async def update(self, name: str, config=None):
+        return self._fake.cache(config)
+
+
+class FakeGeminiClient:
+    """Mirrors the parts of genai.Client used here: the .aio models, files and caches."""
+
+    def __init__(self, model_faults: FaultProfile = None, upload_faults: FaultProfile = None):
+        self.fake = FakeGemini(model_faults or FaultProfile(), upload_faults or FaultProfile())
+        self.aio = SimpleNamespace(models=_AsyncModels(self.fake), files=_AsyncFiles(self.fake),
+                                   caches=_AsyncCaches(self.fake))
+
+
+class _FakeQuery:
+    def __init__(self, client, table: str):
+        self._client = client
+        self._table = table
+        self._filters = {}
+        self._single = False
+        self._upsert = None
+
+    def select(self, *columns):
+        return self
+
+    def eq(self, column: str, value):
+        self._filters[column] = value
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def upsert(self, row):
+        self._upsert = row
+        return self
+
+    def _run(self):
+        if self._client.faults.should_fail():
+            raise APIError({"message": "Injected failure", "code": "503", "hint": None, "details": None})
+        rows = self._client.tables.setdefault(self._table, {})
+        if self._upsert is not None:
+            upserted = self._upsert if isinstance(self._upsert, list) else [self._upsert]
+            for row in upserted:
+                rows[row["id"]] = row
+            return SimpleNamespace(data=upserted)
+        matches = [row for row in rows.values() if all(row.get(k) == v for k, v in self._filters.items())]
+        if self._single:
+            if len(matches) != 1:
+                raise APIError({"message": "JSON object requested, multiple (or no) rows returned",
+                                "code": "PGRST116", "hint": None, "details": None})
+            return SimpleNamespace(data=matches[0])
+        return SimpleNamespace(data=matches)
+
+    def execute(self):
+        if self._client.asynchronous:
+            return self._aexecute()
+        # The profile outbox flushes from its own thread through the sync client.
+        time.sleep(self._client.faults.delay())
+        return self._run()
+
+    async def _aexecute(self):
+        await asyncio.sleep(self._client.faults.delay())
+        return self._run()
+
+
+class FakeSupabaseClient:
+    """An in-memory table store answering the select/eq/single and upsert chains used for user profiles."""
+
+    def __init__(self, faults: FaultProfile = None, asynchronous: bool = False, tables: dict = None):
+        self.faults = faults or FaultProfile()
+        self.asynchronous = asynchronous
+        self.tables = tables if tables is not None else {}
+
+    def table(self, name: str) -> _FakeQuery:
+        return _FakeQuery(self, name)
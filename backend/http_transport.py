@@ -0,0 +1,81 @@
+import asyncio
+import os
+import threading
+import httpx
+
+# One pooled HTTP client per mode (sync/async) is shared by the Gemini and Supabase SDKs, so connections and
+# TLS sessions are reused across requests instead of each SDK keeping its own pool with default limits.
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+HTTP_POOL_TIMEOUT_SECONDS = float(os.getenv("HTTP_POOL_TIMEOUT_SECONDS", "10"))
+# Applies to calls that don't set their own timeout (Supabase); Gemini calls pass theirs per request.
+HTTP_DEFAULT_TIMEOUT_SECONDS = float(os.getenv("HTTP_DEFAULT_TIMEOUT_SECONDS", "15"))
+
+_sync_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def _client_kwargs() -> dict:
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("---HTTP: HTTP/2 is enabled but the h2 package is missing (install httpx[http2]), using HTTP/1.1---")
+            http2 = False
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "timeout": httpx.Timeout(
+            HTTP_DEFAULT_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS, pool=HTTP_POOL_TIMEOUT_SECONDS
+        ),
+    }
+
+
+def get_sync_http_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        with _lock:
+            if _sync_client is None:
+                _sync_client = httpx.Client(**_client_kwargs())
+    return _sync_client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                _async_client = httpx.AsyncClient(**_client_kwargs())
+    return _async_client
+
+
+async def awarm_up(urls: list):
+    """Opens a pooled connection to each host ahead of the first real call. Any response, even an error, will do."""
+    client = get_async_http_client()
+
+    async def touch(url):
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            print(f"---HTTP: Warm-up request to {url} failed: {e}---")
+
+    await asyncio.gather(*(touch(url) for url in urls if url))
+
+
+async def aclose():
+    global _sync_client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
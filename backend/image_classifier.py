@@ -0,0 +1,83 @@
+import io
+import os
+import numpy as np
+from PIL import Image
+from tracing import metrics
+
+# Fundus photos have a distinctive signature that a few image statistics recognise in milliseconds, so those skip
+# the model. Printed pages don't: pixels can't tell a lab report from a letter, and only the model can answer
+# "NEITHER", so reports and everything else that isn't clearly a fundus photo are sent to the model.
+LOCAL_IMAGE_CLASSIFIER = os.getenv("LOCAL_IMAGE_CLASSIFIER", "true").lower() == "true"
+CLASSIFIER_MAX_DIMENSION = 768
+
+# Fundus photos: black surround outside the circular field of view, and a red-orange retina inside it with the
+# much brighter optic disc. Without that highlight a round orange object on black would pass as well.
+FUNDUS_MIN_DARK_CORNERS = 0.85
+FUNDUS_MAX_DARK_DISC = 0.15
+FUNDUS_MIN_DISC_LEVEL = 40
+FUNDUS_MIN_RED_RATIO = 1.3
+FUNDUS_MIN_DISC_HIGHLIGHT = 1.4
+FUNDUS_MAX_EDGE_DENSITY = 0.05
+FUNDUS_ASPECT_RANGE = (0.75, 1.6)
+
+DARK_LEVEL = 30
+EDGE_THRESHOLD = 40
+
+
+def _load_rgb(image_data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(image_data)) as image:
+        image.draft("RGB", (CLASSIFIER_MAX_DIMENSION, CLASSIFIER_MAX_DIMENSION))
+        image = image.convert("RGB")
+        scale = CLASSIFIER_MAX_DIMENSION / max(image.size)
+        if scale < 1:
+            image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.Resampling.BOX)
+        return np.asarray(image, dtype=np.float32)
+
+
+def image_features(pixels: np.ndarray) -> dict:
+    height, width = pixels.shape[:2]
+    gray = pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    edges = (np.abs(np.diff(gray, axis=0))[:, :-1] + np.abs(np.diff(gray, axis=1))[:-1, :]) > EDGE_THRESHOLD
+
+    y, x = np.ogrid[:height, :width]
+    radius = np.hypot((x - (width - 1) / 2) / (width / 2), (y - (height - 1) / 2) / (height / 2))
+    corners, disc = radius > 1.1, radius < 0.8
+    disc_pixels = pixels[disc]
+    red, green = disc_pixels[:, 0].mean(), disc_pixels[:, 1].mean()
+
+    return {
+        "aspect_ratio": round(max(width, height) / min(width, height), 3),
+        "edge_density": round(float(edges.mean()), 4),
+        "dark_corners": round(float((gray[corners] < DARK_LEVEL).mean()) if corners.any() else 0.0, 3),
+        "dark_disc": round(float((gray[disc] < DARK_LEVEL).mean()), 3),
+        "disc_level": round(float(gray[disc].mean()), 1),
+        "disc_red_ratio": round(float(red / max(green, 1)), 3),
+        "disc_highlight": round(float(np.percentile(gray[disc], 99.5) / max(np.median(gray[disc]), 1)), 3),
+    }
+
+
+def looks_like_fundus(features: dict) -> bool:
+    return (FUNDUS_ASPECT_RANGE[0] <= features["aspect_ratio"] <= FUNDUS_ASPECT_RANGE[1]
+            and features["dark_corners"] >= FUNDUS_MIN_DARK_CORNERS
+            and features["dark_disc"] <= FUNDUS_MAX_DARK_DISC
+            and features["disc_level"] >= FUNDUS_MIN_DISC_LEVEL
+            and features["disc_red_ratio"] >= FUNDUS_MIN_RED_RATIO
+            and features["disc_highlight"] >= FUNDUS_MIN_DISC_HIGHLIGHT
+            and features["edge_density"] <= FUNDUS_MAX_EDGE_DENSITY)
+
+
+def classify_image(image_data: bytes):
+    """
+    Returns (image_type, features) with image_type "FALSE" (the model's answer for a scan) for a clear fundus
+    photo, or None when the model should decide.
+    """
+    try:
+        features = image_features(_load_rgb(image_data))
+    except Exception as e:
+        print(f"---IMAGE_CLASSIFIER: Could not read the image, leaving it to the model: {e}---")
+        metrics.inc("glycosight_image_classifier_total", {"outcome": "unreadable"})
+        return None, {}
+
+    image_type = "FALSE" if looks_like_fundus(features) else None
+    metrics.inc("glycosight_image_classifier_total", {"outcome": "scan" if image_type else "uncertain"})
+    return image_type, features
@@ -0,0 +1,133 @@
+import io
+import os
+import numpy as np
+from PIL import Image, ImageOps
+from tracing import metrics
+
+# Phone photos and scanner exports are often 5-20 MB, while the model tiles images at a fixed resolution and
+# reads a report just as well from a ~2K JPEG. Images are resized and re-encoded per task before upload.
+IMAGE_PREPROCESSING = os.getenv("IMAGE_PREPROCESSING", "true").lower() == "true"
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+IMAGE_PROFILES = {
+    # Small print on lab reports needs the resolution.
+    # Also good enough for retinal detail, as a scan is analysed from the upload made to classify it.
+    "document": {
+        "max_dimension": int(os.getenv("IMAGE_DOCUMENT_MAX_DIMENSION", "2048")),
+        "target_bytes": int(os.getenv("IMAGE_DOCUMENT_TARGET_BYTES", str(600 * 1024))),
+        "min_quality": int(os.getenv("IMAGE_DOCUMENT_MIN_QUALITY", "80")),
+    },
+    "scan": {
+        "max_dimension": int(os.getenv("IMAGE_SCAN_MAX_DIMENSION", "1536")),
+        "target_bytes": int(os.getenv("IMAGE_SCAN_TARGET_BYTES", str(500 * 1024))),
+        "min_quality": int(os.getenv("IMAGE_SCAN_MIN_QUALITY", "80")),
+    },
+}
+# Classification shares the document profile, so a report is uploaded once for classification and extraction.
+TASK_IMAGE_PROFILES = {
+    "identify_image_type": "document",
+    "extract_image": "document",
+    "classify_and_extract_image": "document",
+    "visual_rag": "scan",
+}
+# An upload made with any of these profiles serves a task that asks for the key profile just as well, so a file
+# classified as a scan is not uploaded a second time for its analysis.
+PROFILE_SUBSTITUTES = {
+    "scan": ("document",),
+}
+
+EXIF_ORIENTATION = 0x0112
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "photoshop", "iptc")
+QUALITY_STEP = 5
+
+
+def profile_for(task: str):
+    return TASK_IMAGE_PROFILES.get(task) if IMAGE_PREPROCESSING else None
+
+
+def acceptable_profiles(profile_name: str) -> tuple:
+    return (profile_name, *PROFILE_SUBSTITUTES.get(profile_name, ()))
+
+
+def _has_metadata(image: Image.Image) -> bool:
+    return bool(image.getexif()) or any(key in image.info for key in METADATA_KEYS) or bool(getattr(image, "text", None))
+
+
+def _target_size(size: tuple, max_dimension: int) -> tuple:
+    scale = max_dimension / max(size)
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+def _to_rgb_or_gray(image: Image.Image) -> Image.Image:
+    """Brings any mode down to 8-bit RGB or grayscale, which is all JPEG (and the model) needs."""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        # High bit-depth scans: stretch between robust percentiles, as for DICOM frames.
+        pixels = np.asarray(image, dtype=np.float32)
+        low, high = np.percentile(pixels, (0.5, 99.5))
+        scaled = np.clip((pixels - low) / max(high - low, 1e-6), 0, 1) * 255
+        return Image.fromarray(scaled.astype(np.uint8), "L")
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        rgba = image.convert("RGBA")
+        return Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba).convert("RGB")
+    if image.mode == "1":
+        return image.convert("L")
+    return image.convert("RGB")
+
+
+def _encode_jpeg(image: Image.Image, profile: dict, icc_profile) -> bytes:
+    """The highest quality, in steps down to the profile's floor, that fits the byte target."""
+    for quality in range(IMAGE_JPEG_QUALITY, profile["min_quality"] - 1, -QUALITY_STEP):
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality, optimize=True, icc_profile=icc_profile)
+        if buffer.tell() <= profile["target_bytes"]:
+            break
+    return buffer.getvalue()
+
+
+def preprocess_image(image_data: bytes, profile_name: str):
+    """
+    Applies the EXIF orientation, drops metadata (EXIF, XMP, text chunks; the ICC profile is kept unless the
+    color mode changes) and downsizes to the profile's maximum dimension, re-encoding as JPEG. Returns (bytes,
+    outcome); the original is returned when it can't be decoded, or already fits and re-encoding would gain
+    nothing.
+    """
+    profile = IMAGE_PROFILES[profile_name]
+    try:
+        with Image.open(io.BytesIO(image_data)) as image:
+            oriented = image.getexif().get(EXIF_ORIENTATION, 1) != 1
+            has_metadata = _has_metadata(image)
+            oversized = max(image.size) > profile["max_dimension"]
+            if not (oriented or has_metadata or oversized) and len(image_data) <= profile["target_bytes"]:
+                outcome = "unchanged"
+            else:
+                source_mode = image.mode
+                icc_profile = image.info.get("icc_profile")
+                if oversized:
+                    # For JPEGs this decodes at a reduced scale straight away, which is most of the saving in time.
+                    image.draft(None, _target_size(image.size, profile["max_dimension"]))
+                processed = _to_rgb_or_gray(image)
+                if max(processed.size) > profile["max_dimension"]:
+                    # Only ever downscaling, where Hamming is close to Lanczos in quality at half the cost.
+                    processed = processed.resize(_target_size(processed.size, profile["max_dimension"]), Image.Resampling.HAMMING)
+                if oriented:
+                    processed.info["exif"] = image.getexif().tobytes()
+                    processed = ImageOps.exif_transpose(processed)
+                # Pillow carries some of these (e.g. JPEG comments) into the output unless they're dropped here.
+                processed.info = {}
+                if processed.mode != source_mode:
+                    # The profile describes the source color space (e.g. CMYK); on converted pixels it would be wrong.
+                    icc_profile = None
+                encoded = _encode_jpeg(processed, profile, icc_profile)
+                if len(encoded) >= len(image_data) and not (oriented or has_metadata or oversized):
+                    outcome = "unchanged"
+                else:
+                    outcome = "reencoded"
+    except Exception as e:
+        print(f"---IMAGE_PREPROCESS: Could not decode the image, uploading it as is: {e}---")
+        outcome = "undecodable"
+
+    result = encoded if outcome == "reencoded" else image_data
+    metrics.inc("glycosight_image_preprocess_total", {"profile": profile_name, "outcome": outcome})
+    metrics.inc("glycosight_image_bytes_saved_total", {"profile": profile_name}, len(image_data) - len(result))
+    return result, outcome
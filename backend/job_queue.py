@@ -0,0 +1,200 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory")
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "/tmp/glycosight_jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(24 * 60 * 60)))
+# Queued jobs hold their upload until they finish, so the number waiting is capped and further submissions refused.
+JOB_QUEUE_MAX_PENDING = int(os.getenv("JOB_QUEUE_MAX_PENDING", "100"))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueNotRunning(Exception):
+    pass
+
+
+class MemoryJobStore:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, payload: dict):
+        with self._lock:
+            self._jobs[job_id] = {"job_id": job_id, "status": "queued", "payload": payload, "result": None,
+                                  "error": None, "created_at": time.time(), "updated_at": time.time()}
+
+    def update(self, job_id: str, status: str, result=None, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update({"status": status, "result": result, "error": error, "updated_at": time.time()})
+            if status in ("succeeded", "failed"):
+                job["payload"] = None
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return {k: v for k, v in job.items() if k != "payload"} if job else None
+
+    def payload(self, job_id: str):
+        with self._lock:
+            return self._jobs[job_id]["payload"]
+
+    def pending(self) -> list:
+        with self._lock:
+            return [job["job_id"] for job in self._jobs.values() if job["status"] in ("queued", "running")]
+
+    def purge(self, older_than: float):
+        with self._lock:
+            for job_id in [j for j, job in self._jobs.items()
+                           if job["status"] in ("succeeded", "failed") and job["updated_at"] < older_than]:
+                del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Keeps jobs on local disk so queued work survives a restart. Upload bytes are dropped once a job finishes."""
+
+    def __init__(self, path: str = JOB_QUEUE_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT, "
+            "file_bytes BLOB, result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def create(self, job_id: str, payload: dict):
+        payload = dict(payload)
+        file_bytes = payload.pop("file_bytes", None)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, status, payload, file_bytes, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), file_bytes, now, now)
+            )
+            self._conn.commit()
+
+    def update(self, job_id: str, status: str, result=None, error=None):
+        finished = status in ("succeeded", "failed")
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ?"
+                + (", payload = NULL, file_bytes = NULL" if finished else "") + " WHERE job_id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, status, result, error, created_at, updated_at FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"job_id": row[0], "status": row[1], "result": json.loads(row[2]) if row[2] else None,
+                "error": row[3], "created_at": row[4], "updated_at": row[5]}
+
+    def payload(self, job_id: str):
+        with self._lock:
+            payload, file_bytes = self._conn.execute(
+                "SELECT payload, file_bytes FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return {**json.loads(payload), "file_bytes": file_bytes}
+
+    def pending(self) -> list:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT job_id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [job_id for job_id, in rows]
+
+    def purge(self, older_than: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?", (older_than,))
+            self._conn.commit()
+
+
+class JobQueue:
+    """
+    A local queue with a fixed pool of workers, which also caps how many workflows call the model at once. Only
+    job ids are queued; a worker loads the upload from the store when it picks the job up. Store writes run in a
+    thread, as the SQLite store commits to disk.
+    """
+
+    def __init__(self, handler, store=None, workers: int = JOB_WORKERS, max_pending: int = JOB_QUEUE_MAX_PENDING):
+        self.handler = handler
+        self.store = store if store is not None else MemoryJobStore()
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        job_ids = await asyncio.to_thread(self.store.pending)
+        for job_id in job_ids:
+            self._queue.put_nowait(job_id)
+        # Counted from the store, so jobs left over from before a restart in the same process aren't counted twice.
+        self.pending = len(job_ids)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self.pending = 0
+
+    async def submit(self, payload: dict) -> str:
+        if self._queue is None:
+            raise QueueNotRunning("The job queue is not running.")
+        if self.pending >= self.max_pending:
+            raise QueueFull(f"{self.pending} jobs are already queued or running.")
+        job_id = uuid.uuid4().hex
+        self.pending += 1
+        try:
+            await asyncio.to_thread(self.store.create, job_id, payload)
+        except BaseException:
+            self.pending -= 1
+            raise
+        self._queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await asyncio.to_thread(self.store.update, job_id, "running")
+                result = await self.handler(await asyncio.to_thread(self.store.payload, job_id))
+                await asyncio.to_thread(self.store.update, job_id, "succeeded", result=result)
+            except Exception as e:
+                try:
+                    await asyncio.to_thread(self.store.update, job_id, "failed", error=str(getattr(e, "detail", e)))
+                except Exception as store_error:
+                    print(f"---JOB_QUEUE: Could not record the failure of job {job_id}: {store_error}---")
+            finally:
+                self.pending -= 1
+                self._queue.task_done()
+                await asyncio.to_thread(self.store.purge, time.time() - JOB_RETENTION_SECONDS)
+
+    def stats(self) -> dict:
+        return {"pending": self.pending, "max_pending": self.max_pending, "workers": self.workers}
+
+
+def create_job_queue(handler, backend_name: str = JOB_QUEUE_BACKEND) -> JobQueue:
+    if backend_name == "sqlite":
+        return JobQueue(handler, SQLiteJobStore())
+    return JobQueue(handler, MemoryJobStore())
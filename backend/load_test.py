@@ -0,0 +1,72 @@
+# Load test for the /diagnose endpoint. Fires batches of concurrent diagnoses at a running API
+# and reports throughput per concurrency level, to check that a single uvicorn worker scales.
+#
+# Usage: python load_test.py <file> --input-type pdf --url http://localhost:8000 --levels 1 5 10 25 32
+#
+# Requests the server sheds with 429 (past ADMISSION_MAX_IN_FLIGHT) are counted apart and left out of the latencies.
+
+import argparse
+import asyncio
+import pathlib
+import time
+import httpx
+from admission import ADMISSION_MAX_IN_FLIGHT
+
+# Levels above the admission limit only measure how fast requests are shed, so the defaults stop at it.
+DEFAULT_LEVELS = sorted({min(level, ADMISSION_MAX_IN_FLIGHT) for level in (1, 5, 10, 25, 50)})
+
+
+async def send_diagnosis(client, url, user_id, input_type, filename, file_bytes):
+    start = time.perf_counter()
+    response = await client.post(
+        f"{url}/diagnose",
+        data={"user_id": user_id, "input_type": input_type},
+        files={"file": (filename, file_bytes)}
+    )
+    return response.status_code, time.perf_counter() - start
+
+
+async def run_level(url, concurrency, input_type, filename, file_bytes, user_prefix):
+    async with httpx.AsyncClient(timeout=None) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[
+            send_diagnosis(client, url, f"{user_prefix}-{concurrency}-{i}", input_type, filename, file_bytes)
+            for i in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for status, latency in results if status == 200)
+    shed = sum(1 for status, _ in results if status == 429)
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "shed": shed,
+        "failed": concurrency - len(latencies) - shed,
+        "wall_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_s": latencies[len(latencies) // 2] if latencies else float("nan"),
+        "max_s": latencies[-1] if latencies else float("nan"),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Concurrency load test for GlycoSight AI /diagnose.")
+    parser.add_argument("file", help="Sample file to upload with every request.")
+    parser.add_argument("--input-type", default="pdf", choices=["pdf", "image", "dicom"])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--levels", type=int, nargs="+", default=DEFAULT_LEVELS)
+    parser.add_argument("--user-prefix", default="loadtest")
+    args = parser.parse_args()
+
+    filepath = pathlib.Path(args.file)
+    file_bytes = filepath.read_bytes()
+
+    print(f"{'concurrency':>11} {'ok':>4} {'shed':>4} {'failed':>6} {'wall_s':>8} {'rps':>7} {'p50_s':>7} {'max_s':>7}")
+    for level in args.levels:
+        r = await run_level(args.url, level, args.input_type, filepath.name, file_bytes, args.user_prefix)
+        print(f"{r['concurrency']:>11} {r['ok']:>4} {r['shed']:>4} {r['failed']:>6} {r['wall_s']:>8.2f} "
+              f"{r['throughput_rps']:>7.2f} {r['p50_s']:>7.2f} {r['max_s']:>7.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
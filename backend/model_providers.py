@@ -0,0 +1,135 @@
+import os
+import threading
+import http_transport
+
+# Each tier is "<provider>:<model>". Classification and extraction run on the fast tier, diagnosis on the strong one.
+MODEL_FAST = os.getenv("MODEL_FAST", "gemini:gemini-2.5-flash-lite")
+MODEL_STRONG = os.getenv("MODEL_STRONG", "gemini:gemini-2.5-flash-preview-05-20")
+# Optional per-task overrides, e.g. "identify_image_type=fast,ada_rag=gemini:gemini-2.5-pro".
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "120"))
+
+TASK_TIERS = {
+    "identify_image_type": "fast",
+    "extract_pdf": "fast",
+    "extract_image": "fast",
+    "classify_and_extract_image": "fast",
+    "ada_rag": "strong",
+    "visual_rag": "strong",
+}
+# These tasks read the guideline corpus, whose uploaded files and context caches live with the default provider.
+CORPUS_TASKS = {"ada_rag", "visual_rag"}
+
+
+class GeminiProvider:
+    """The Gemini API, through the shared pooled HTTP transport."""
+
+    name = "gemini"
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from google import genai
+                    from google.genai import types
+                    self._client = genai.Client(
+                        api_key=os.getenv("GEMINI_API_KEY"),
+                        http_options=types.HttpOptions(
+                            timeout=int(GEMINI_TIMEOUT_SECONDS * 1000),
+                            httpx_client=http_transport.get_sync_http_client(),
+                            httpx_async_client=http_transport.get_async_http_client(),
+                        )
+                    )
+        return self._client
+
+    def set_client(self, client):
+        self._client = client
+
+
+class StubProvider:
+    """Answers locally with canned, schema-valid responses and no latency. For tests and offline development."""
+
+    name = "stub"
+
+    def __init__(self):
+        self._client = None
+
+    def get_client(self):
+        if self._client is None:
+            from fakes import FakeGeminiClient
+            self._client = FakeGeminiClient()
+        return self._client
+
+    def set_client(self, client):
+        self._client = client
+
+
+PROVIDERS = {"gemini": GeminiProvider, "stub": StubProvider}
+
+
+class ModelRoute:
+    def __init__(self, task: str, provider, model: str):
+        self.task = task
+        self.provider = provider
+        self.model = model
+
+    @property
+    def client(self):
+        return self.provider.get_client()
+
+    def __repr__(self):
+        return f"ModelRoute({self.task!r}, {self.provider.name}:{self.model})"
+
+
+def parse_routes(text: str) -> dict:
+    routes = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        task, _, target = item.partition("=")
+        if not target:
+            raise ValueError(f"Model route '{item}' should look like task=fast|strong|provider:model")
+        routes[task.strip()] = target.strip()
+    return routes
+
+
+class ModelRouter:
+    """Resolves each task to a provider and model, from its tier or an explicit per-task route."""
+
+    def __init__(self, fast: str = MODEL_FAST, strong: str = MODEL_STRONG, task_tiers: dict = TASK_TIERS,
+                 overrides: str = MODEL_ROUTES):
+        self.providers = {}
+        self.tiers = {"fast": fast, "strong": strong}
+        self.targets = {**task_tiers, **parse_routes(overrides)}
+        self.default_provider = self._resolve(strong)[0]
+        # Resolved up front, so a misspelled provider or target fails at startup rather than on the first request.
+        for task in self.targets:
+            self.route(task)
+        for task in CORPUS_TASKS:
+            if self.route(task).provider is not self.default_provider:
+                raise ValueError(f"'{task}' must use the strong tier's provider ({self.default_provider.name}), "
+                                 f"since the guideline corpus is uploaded and cached there")
+
+    def _provider(self, name: str):
+        if name not in self.providers:
+            if name not in PROVIDERS:
+                raise ValueError(f"Unknown model provider '{name}', expected one of {sorted(PROVIDERS)}")
+            self.providers[name] = PROVIDERS[name]()
+        return self.providers[name]
+
+    def _resolve(self, target: str):
+        target = self.tiers.get(target, target)
+        provider_name, _, model = target.partition(":")
+        if not model:
+            raise ValueError(f"Model target '{target}' should look like provider:model")
+        return self._provider(provider_name), model
+
+    def route(self, task: str) -> ModelRoute:
+        provider, model = self._resolve(self.targets.get(task, "strong"))
+        return ModelRoute(task, provider, model)
+
+    def describe(self) -> dict:
+        routes = {task: self.route(task) for task in self.targets}
+        return {task: f"{route.provider.name}:{route.model}" for task, route in routes.items()}
@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import httpx
+from tracing import metrics
+
+# Our Gemini quota. Calls beyond it wait briefly in a priority queue instead of failing with a 429.
+MODEL_REQUESTS_PER_MINUTE = float(os.getenv("MODEL_REQUESTS_PER_MINUTE", "600"))
+MODEL_BURST = int(os.getenv("MODEL_BURST", "20"))
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "32"))
+MODEL_QUEUE_TIMEOUT_SECONDS = float(os.getenv("MODEL_QUEUE_TIMEOUT_SECONDS", "30"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "3"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_SECONDS", "0.5"))
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "8"))
+# When set, a short non-streamed call still running after this long gets a second, competing request. 0 disables.
+MODEL_HEDGE_AFTER_SECONDS = float(os.getenv("MODEL_HEDGE_AFTER_SECONDS", "0"))
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+_priority: contextvars.ContextVar = contextvars.ContextVar("glycosight_model_priority", default="interactive")
+
+
+@contextmanager
+def call_priority(name: str):
+    """Model calls made inside this block (including from tasks it starts) are queued with this priority."""
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class ModelQueueTimeout(Exception):
+    pass
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+def server_retry_delay(error: Exception):
+    """Reads the delay the API asked for, from a Retry-After header or a google.rpc.RetryInfo detail."""
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if retry_after and retry_after.replace(".", "", 1).isdigit():
+        return float(retry_after)
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in details.get("error", {}).get("details", []) or []:
+            delay = detail.get("retryDelay") if isinstance(detail, dict) else None
+            if isinstance(delay, str) and delay.endswith("s"):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+class ModelCallScheduler:
+    """
+    Token-bucket rate limiting and a concurrency cap for model calls, with a priority queue so interactive
+    requests go ahead of batch work. Retryable failures are retried with jittered exponential backoff (or after
+    the delay the API asks for), and short calls can optionally be hedged once they run past a latency threshold.
+    """
+
+    def __init__(self, requests_per_minute: float = MODEL_REQUESTS_PER_MINUTE, burst: int = MODEL_BURST,
+                 max_concurrency: int = MODEL_MAX_CONCURRENCY, queue_timeout_seconds: float = MODEL_QUEUE_TIMEOUT_SECONDS,
+                 max_retries: int = MODEL_MAX_RETRIES, retry_base_seconds: float = MODEL_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = MODEL_RETRY_MAX_SECONDS, hedge_after_seconds: float = MODEL_HEDGE_AFTER_SECONDS):
+        self.rate = requests_per_minute / 60
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.queue_timeout_seconds = queue_timeout_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.hedge_after_seconds = hedge_after_seconds
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._condition = None
+        self._condition_loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _token_wait(self):
+        if self.rate <= 0 or self._tokens >= 1:
+            return None
+        return (1 - self._tokens) / self.rate
+
+    def _take(self) -> bool:
+        """Takes a token (and a concurrency slot) if both are free. Caller holds self._lock."""
+        self._refill()
+        if self._token_wait() is not None or self._in_flight >= self.max_concurrency:
+            return False
+        if self.rate > 0:
+            self._tokens -= 1
+        self._in_flight += 1
+        return True
+
+    def _throttle(self, seconds: float):
+        """After a 429, empties the bucket for `seconds` so every queued call backs off, not just this one."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = server_retry_delay(error)
+        if delay is None:
+            cap = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** attempt)
+            delay = cap / 2 + random.uniform(0, cap / 2)
+        if getattr(error, "code", None) == 429:
+            self._throttle(delay)
+        return delay
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._condition_loop is not loop:
+            self._condition = asyncio.Condition()
+            self._condition_loop = loop
+        return self._condition
+
+    async def _acquire(self, priority: str):
+        condition = self._get_condition()
+        entry = (PRIORITIES.get(priority, 0), next(self._sequence))
+        deadline = time.monotonic() + self.queue_timeout_seconds
+        async with condition:
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    with self._lock:
+                        if self._waiters[0] == entry and self._take():
+                            heapq.heappop(self._waiters)
+                            condition.notify_all()
+                            return
+                        token_wait = self._token_wait()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise ModelQueueTimeout(f"No model capacity within {self.queue_timeout_seconds:.0f}s")
+                    try:
+                        await asyncio.wait_for(condition.wait(), remaining if token_wait is None else min(token_wait, remaining))
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    condition.notify_all()
+                raise
+
+    async def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        condition = self._get_condition()
+        async with condition:
+            condition.notify_all()
+
+    async def _guarded(self, call):
+        try:
+            return await call()
+        finally:
+            await self._release()
+
+    async def _attempt(self, task: str, call, priority: str, hedge: bool, rate_limited: bool):
+        if not rate_limited:
+            return await call()
+        queued_at = time.perf_counter()
+        await self._acquire(priority)
+        metrics.observe_duration("model_queue", task, time.perf_counter() - queued_at)
+
+        primary = asyncio.ensure_future(self._guarded(call))
+        done, pending = set(), {primary}
+        try:
+            if hedge and self.hedge_after_seconds > 0:
+                done, pending = await asyncio.wait(pending, timeout=self.hedge_after_seconds)
+                if not done:
+                    # A hedge only goes out if it fits in the quota right now; it never waits in the queue.
+                    with self._lock:
+                        can_hedge = not self._waiters and self._take()
+                    if can_hedge:
+                        print(f"---SCHEDULER: '{task}' slower than {self.hedge_after_seconds}s, sending a hedged request---")
+                        metrics.inc("glycosight_model_hedges_total", {"task": task})
+                        pending.add(asyncio.ensure_future(self._guarded(call)))
+
+            last_error = None
+            while True:
+                # The first pass sees whatever already finished inside the hedge window.
+                for finished in done:
+                    if finished.exception() is None:
+                        if finished is not primary:
+                            metrics.inc("glycosight_model_hedge_wins_total", {"task": task})
+                        return finished.result()
+                    last_error = finished.exception()
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            raise last_error
+        finally:
+            for unfinished in pending:
+                unfinished.cancel()
+
+    async def arun(self, task: str, call, hedge: bool = False, can_retry=None, rate_limited: bool = True):
+        """
+        Runs `call` (a zero-argument coroutine function) under the rate limit, retrying retryable failures.
+        `can_retry` lets the caller veto a retry, e.g. once part of a streamed response has been forwarded.
+        Calls outside the generation quota, like file uploads, pass rate_limited=False to get only the retries.
+        """
+        priority = _priority.get()
+        attempt = 0
+        while True:
+            try:
+                return await self._attempt(task, call, priority, hedge, rate_limited)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e) or (can_retry is not None and not can_retry()):
+                    raise
+                delay = self._backoff(attempt, e)
+                metrics.inc("glycosight_model_retries_total", {"task": task, "code": str(getattr(e, "code", type(e).__name__))})
+                print(f"---SCHEDULER: '{task}' failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s---")
+                await asyncio.sleep(delay)
+                attempt += 1
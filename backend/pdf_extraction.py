@@ -0,0 +1,374 @@
+import io
+import os
+import re
+from datetime import date
+from pydantic import ValidationError
+from schemas import DiabetesClinicalData
+from tracing import metrics
+
+# Digital lab reports usually carry a text layer, and the handful of fields we need sit on predictable lines.
+# Rules read those locally; the model is only asked when a required field is missing or a value is ambiguous.
+PDF_LOCAL_EXTRACTION = os.getenv("PDF_LOCAL_EXTRACTION", "true").lower() == "true"
+# Comma-separated requirements; "a|b" is satisfied by either field.
+PDF_LOCAL_REQUIRED_FIELDS = os.getenv(
+    "PDF_LOCAL_REQUIRED_FIELDS",
+    "hba1c|fasting_plasma_glucose|two_hr_ogtt_glucose|random_plasma_glucose,report_date",
+)
+PDF_LOCAL_MAX_PAGES = int(os.getenv("PDF_LOCAL_MAX_PAGES", "10"))
+PDF_LOCAL_MIN_TEXT_CHARS = int(os.getenv("PDF_LOCAL_MIN_TEXT_CHARS", "40"))
+
+GLUCOSE_LABEL = r"(?:(?:plasma|blood|serum|capillary|venous)\s+)?(?:glucose|sugar)"
+# "Fasting Plasma Glucose", "Plasma Glucose (Fasting)", "Glucose - Fasting", "Blood sugar (random)" ...
+QUALIFIER_SEPARATOR = r"\s*[(\[,:\-–]*\s*"
+LAB_LABELS = {
+    "hba1c": r"hb\s*a1c|a1c|glyc(?:osyl)?ated\s+(?:ha?emoglobin|hb)",
+    "two_hr_ogtt_glucose": r"ogtt(?:\s*[(,-]?\s*2\s*-?\s*h(?:ou)?rs?\.?\)?)?|2\s*-?\s*h(?:ou)?rs?\.?\s+(?:post[\s-]*load\s+)?(?:plasma\s+)?glucose",
+    "fasting_plasma_glucose": rf"fasting\s+{GLUCOSE_LABEL}|{GLUCOSE_LABEL}{QUALIFIER_SEPARATOR}fasting|fpg|fbs",
+    "random_plasma_glucose": rf"random\s+{GLUCOSE_LABEL}|{GLUCOSE_LABEL}{QUALIFIER_SEPARATOR}random|rpg|rbs",
+    "bmi": r"bmi|body\s+mass\s+index",
+}
+LAB_PATTERNS = {field: re.compile(rf"\b(?:{label})\b", re.IGNORECASE) for field, label in LAB_LABELS.items()}
+# A glycaemic result none of the labels above recognise (post-prandial glucose, an unusual label) must not be
+# dropped silently: the whole report then goes to the model.
+GLYCAEMIC_MENTION_PATTERN = re.compile(r"\b(?:glucose|sugar|hb\s*a1c|a1c|glyc\w*|ogtt|gtt)\b", re.IGNORECASE)
+
+UNITS = {
+    "%": "%",
+    "mg/dl": "mg/dL",
+    "mmol/l": "mmol/L",
+    "mmol/mol": "mmol/mol",
+    "kg/m2": "kg/m2",
+    "kg/m²": "kg/m2",
+    "kg/m^2": "kg/m2",
+}
+VALUE_PATTERN = re.compile(
+    r"(?:[^\d\n]|\d+\s*(?:g|gm|h|hrs?|hours?)\b)*?(?<![\d.])(\d{1,4}(?:\.\d+)?)(?![\d.])(?!\s*(?:g|gm|h|hrs?|hours?)\b)\s*(%|mg\s*/\s*dl|mmol\s*/\s*mol|mmol\s*/\s*l|kg\s*/\s*m(?:2|²|\^2))?",
+    re.IGNORECASE,
+)
+RANGE_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*(?:-|–|to)\s*(\d+(?:\.\d+)?)")
+FLAG_PATTERN = re.compile(r"\b(high|low|normal|H|L|N)\b", re.IGNORECASE)
+# "Normal: 70-99" or "Ref. range < 5.7" describes the range, not this result.
+REFERENCE_TEXT_PATTERN = re.compile(
+    r"\b(?:normal|reference|ref|bio\.?\s*ref)\w*\.?\s*(?:range|interval|values?)?\s*[:\-]?\s*[<>≤≥]?\s*[\d.]*",
+    re.IGNORECASE,
+)
+REFERENCE_LABEL_PATTERN = re.compile(
+    r"\b(?:normal|reference|ref|bio\.?\s*ref)\w*\.?\s*(?:range|interval|values?)?\s*[:\-]?\s*[<>≤≥]?\s*$",
+    re.IGNORECASE,
+)
+CLOSING_BRACKET_PATTERN = re.compile(r"[)\]]")
+# A result that wasn't measured ("Pending", "NA", "—"); any number after it on the line is not the result.
+NO_RESULT_PATTERN = re.compile(
+    r"\b(?:pending|awaited|to\s+follow|not\s+done|n/?a|nil)\b|(?:^|\s)(?:—|--)(?=\s|$)",
+    re.IGNORECASE,
+)
+
+# Plausible values per unit, used to reject misreads (dates, reference ranges) and to infer a missing unit.
+PLAUSIBLE = {
+    "hba1c": {"%": (3, 20), "mmol/mol": (9, 195)},
+    "fasting_plasma_glucose": {"mg/dL": (20, 1000), "mmol/L": (1, 55)},
+    "two_hr_ogtt_glucose": {"mg/dL": (20, 1000), "mmol/L": (1, 55)},
+    "random_plasma_glucose": {"mg/dL": (20, 1000), "mmol/L": (1, 55)},
+    "bmi": {"kg/m2": (10, 80)},
+}
+# Readings of one result in two units (HbA1c as NGSP % and IFCC mmol/mol, glucose in mg/dL and mmol/L) are the
+# same result when they agree after conversion to the conventional unit, within the tolerance labs round to.
+UNIT_CONVERSIONS = {
+    ("hba1c", "mmol/mol"): lambda value: value / 10.929 + 2.15,
+    ("fasting_plasma_glucose", "mmol/L"): lambda value: value * 18.016,
+    ("two_hr_ogtt_glucose", "mmol/L"): lambda value: value * 18.016,
+    ("random_plasma_glucose", "mmol/L"): lambda value: value * 18.016,
+}
+UNIT_TOLERANCES = {
+    "hba1c": 0.3,
+    "fasting_plasma_glucose": 4,
+    "two_hr_ogtt_glucose": 4,
+    "random_plasma_glucose": 4,
+}
+# Used for the status flag when the report prints neither a flag nor a reference range.
+DEFAULT_RANGES = {
+    ("hba1c", "%"): (4.0, 5.6),
+    ("hba1c", "mmol/mol"): (20, 38),
+    ("fasting_plasma_glucose", "mg/dL"): (70, 99),
+    ("fasting_plasma_glucose", "mmol/L"): (3.9, 5.5),
+    ("two_hr_ogtt_glucose", "mg/dL"): (70, 139),
+    ("two_hr_ogtt_glucose", "mmol/L"): (3.9, 7.7),
+    ("random_plasma_glucose", "mg/dL"): (70, 139),
+    ("random_plasma_glucose", "mmol/L"): (3.9, 7.7),
+    ("bmi", "kg/m2"): (18.5, 24.9),
+}
+
+NAME_PATTERN = re.compile(
+    r"(?:\bpatient(?:'s)?\s+name|\bname\s+of\s+patient|\bpatient|^name|\s{2}name)\s*[:\-]\s*"
+    r"([A-Za-z][A-Za-z.'\-]*(?: (?!(?:age|sex|gender|dob|id|mrn|uhid)\b)[A-Za-z][A-Za-z.'\-]*)*)",
+    re.IGNORECASE | re.MULTILINE,
+)
+AGE_PATTERN = re.compile(r"\bage(?:\s*/\s*(?:sex|gender))?\s*(?:\(\s*y(?:ea)?rs?\s*\))?\s*[:\-]?\s*(\d{1,3})(?!\d)", re.IGNORECASE)
+GENDER_PATTERN = re.compile(
+    r"\b(?:sex|gender)\s*[:\-]?\s*(male|female|other|m|f)\b"
+    r"|\bage\s*/\s*(?:sex|gender)\s*[:\-]?\s*\d{1,3}\s*(?:y(?:ea)?rs?|y)?\s*/\s*(male|female|m|f)\b",
+    re.IGNORECASE,
+)
+MONTHS = {month: number for number, month in enumerate(
+    ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"], start=1)}
+DATE_PATTERNS = [
+    (re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})"), "ymd"),
+    (re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{4})"), "dmy_or_mdy"),
+    (re.compile(r"(\d{1,2})[\s-]*([A-Za-z]{3})[A-Za-z]*\.?[\s,-]*(\d{4})"), "d_mon_y"),
+    (re.compile(r"([A-Za-z]{3})[A-Za-z]*\.?\s+(\d{1,2}),?\s+(\d{4})"), "mon_d_y"),
+]
+# A labelled report date wins; a bare "Date:" heading is the fallback. Collection dates and dates of birth are ignored.
+REPORT_DATE_PATTERNS = [
+    re.compile(r"\b(?:report(?:ed)?\s*(?:date|on)|date\s+of\s+report)\s*[:\-]?\s*([^\n]{6,30})", re.IGNORECASE),
+    re.compile(r"(?:^|\s{2})date\s*[:\-]\s*([^\n]{6,30})", re.IGNORECASE | re.MULTILINE),
+]
+
+# Free-text clinical content fills symptoms_history, which rules can't read reliably; leave such reports to the model.
+NARRATIVE_PATTERN = re.compile(
+    r"\b(symptoms?|complain\w*|history|medications?|prescri\w*|rx|polyuria|polydipsia|polyphagia|"
+    r"pregnan\w*|gestational|hypertensi\w*|pcos|ethnicity)\b",
+    re.IGNORECASE,
+)
+
+_pypdf_missing_logged = False
+
+
+class Ambiguous(Exception):
+    pass
+
+
+def extract_text(pdf_bytes: bytes):
+    """Returns the PDF's text layer, or None when it can't be read locally (no pypdf, encrypted, too many pages)."""
+    global _pypdf_missing_logged
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        if not _pypdf_missing_logged:
+            print("---PDF: pypdf is not installed, every PDF goes to the model---")
+            _pypdf_missing_logged = True
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted and not reader.decrypt(""):
+            return None
+        if len(reader.pages) > PDF_LOCAL_MAX_PAGES:
+            return None
+        return "\n".join(page.extract_text() or "" for page in reader.pages)
+    except Exception as e:
+        print(f"---PDF: Could not read the text layer: {e}---")
+        return None
+
+
+def _unique(field: str, values: list):
+    values = list(dict.fromkeys(values))
+    if len(values) > 1:
+        raise Ambiguous(f"{field} has conflicting values {values}")
+    return values[0] if values else None
+
+
+def _lab_field(line: str):
+    matches = [(match.start(), field, match) for field, pattern in LAB_PATTERNS.items() if (match := pattern.search(line))]
+    if not matches:
+        return None, None
+    _, field, match = min(matches, key=lambda item: item[0])
+    return field, match
+
+
+def _status_flag(field: str, value: float, unit: str, rest: str):
+    """The flag in the extraction prompt's lowercase vocabulary, so local results read like the model's."""
+    flag = FLAG_PATTERN.search(REFERENCE_TEXT_PATTERN.sub(" ", rest))
+    if flag:
+        word = flag.group(1).lower()
+        if word in ("high", "h"):
+            return "high"
+        if word in ("low", "l"):
+            return "low"
+        if word in ("normal", "n"):
+            return "normal"
+    reference = RANGE_PATTERN.search(rest)
+    low, high = (float(reference.group(1)), float(reference.group(2))) if reference else DEFAULT_RANGES[(field, unit)]
+    if value > high:
+        return "high"
+    if value < low:
+        return "low"
+    return "normal"
+
+
+def _reference_end(line: str, label_end: int, match: re.Match):
+    """
+    Where the reference range holding the matched number ends (a bracketed range, "70 - 99", or a value after
+    "Normal:"), or None when the number can be the result itself.
+    """
+    number_start = match.start(1)
+    depth = 0
+    for character in line[label_end:number_start]:
+        if character in "([":
+            depth += 1
+        elif character in ")]":
+            depth = max(0, depth - 1)
+    if depth:
+        close = CLOSING_BRACKET_PATTERN.search(line, number_start)
+        return close.end() if close else len(line)
+    if span := RANGE_PATTERN.match(line, number_start):
+        return span.end()
+    if REFERENCE_LABEL_PATTERN.search(line[label_end:number_start]):
+        return match.end(1)
+    return None
+
+
+def _match_result(field: str, line: str, label_end: int):
+    """The result's value and unit after the label, skipping reference ranges printed before it."""
+    position = label_end
+    while True:
+        match = VALUE_PATTERN.match(line, position)
+        if not match:
+            raise Ambiguous(f"{field} is named but has no value on its line")
+        if NO_RESULT_PATTERN.search(line, label_end, match.start(1)):
+            raise Ambiguous(f"{field} has no numeric result before '{match.group(1)}'")
+        reference_end = _reference_end(line, label_end, match)
+        if reference_end is None:
+            return match
+        position = reference_end
+
+
+def _parse_lab_line(field: str, line: str, label_end: int) -> dict:
+    match = _match_result(field, line, label_end)
+    value = float(match.group(1))
+    raw_unit = re.sub(r"\s+", "", match.group(2) or "").lower()
+    if raw_unit:
+        unit = UNITS[raw_unit]
+        if unit not in PLAUSIBLE[field]:
+            raise Ambiguous(f"{field} is reported in an unexpected unit '{unit}'")
+    else:
+        candidates = [unit for unit, (low, high) in PLAUSIBLE[field].items() if low <= value <= high]
+        if len(candidates) != 1:
+            raise Ambiguous(f"{field} value {value} has no unit and fits {candidates or 'no known unit'}")
+        unit = candidates[0]
+    low, high = PLAUSIBLE[field][unit]
+    if not low <= value <= high:
+        raise Ambiguous(f"{field} value {value} {unit} is implausible")
+    return {
+        "value": int(value) if value.is_integer() else value,
+        "unit": unit,
+        "status_flag": _status_flag(field, value, unit, line[match.end():]),
+    }
+
+
+def _merge_readings(field: str, readings: list) -> dict:
+    """One result from every reading of a field; readings in the same unit must match exactly."""
+    by_unit = {}
+    for reading in readings:
+        by_unit.setdefault(reading["unit"], set()).add(reading["value"])
+    if any(len(values) > 1 for values in by_unit.values()):
+        raise Ambiguous(f"{field} appears with different values {[reading['value'] for reading in readings]}")
+    if len(by_unit) > 1:
+        converted = [UNIT_CONVERSIONS.get((field, reading["unit"]), lambda value: value)(reading["value"])
+                     for reading in readings]
+        if max(converted) - min(converted) > UNIT_TOLERANCES.get(field, 0):
+            raise Ambiguous(f"{field} readings {[(reading['value'], reading['unit']) for reading in readings]} disagree")
+    # The conventional unit (%, mg/dL) is kept, as the model would report it.
+    return next((reading for reading in readings if (field, reading["unit"]) not in UNIT_CONVERSIONS), readings[0])
+
+
+def _parse_date(text: str):
+    for pattern, order in DATE_PATTERNS:
+        match = pattern.search(text)
+        if not match:
+            continue
+        a, b, c = match.groups()
+        if order == "ymd":
+            year, month, day = int(a), int(b), int(c)
+        elif order == "dmy_or_mdy":
+            first, second, year = int(a), int(b), int(c)
+            if first <= 12 and second <= 12 and first != second:
+                raise Ambiguous(f"report date '{match.group(0)}' could be day-first or month-first")
+            day, month = (first, second) if second <= 12 else (second, first)
+        elif order == "d_mon_y":
+            day, month, year = int(a), MONTHS.get(b.lower()[:3]), int(c)
+        else:
+            month, day, year = MONTHS.get(a.lower()[:3]), int(b), int(c)
+        if month is None:
+            continue
+        try:
+            return date(year, month, day).isoformat()
+        except ValueError:
+            raise Ambiguous(f"report date '{match.group(0)}' is not a valid date")
+    return None
+
+
+def _normalise_gender(value: str) -> str:
+    value = value.lower()
+    return {"m": "Male", "f": "Female"}.get(value, value.capitalize())
+
+
+def parse_report_text(text: str) -> dict:
+    """Applies the rules to a report's text. Raises Ambiguous rather than guess between conflicting readings."""
+    lab_values = {}
+    for line in text.splitlines():
+        field, match = _lab_field(line)
+        if field:
+            lab_values.setdefault(field, []).append(_parse_lab_line(field, line, match.end()))
+        elif GLYCAEMIC_MENTION_PATTERN.search(line) and re.search(r"\d", line):
+            raise Ambiguous(f"unrecognised glycaemic result '{line.strip()}'")
+    lab_results = {field: _merge_readings(field, readings) for field, readings in lab_values.items()}
+
+    names = [match.group(1).strip() for match in NAME_PATTERN.finditer(text)]
+    ages = [int(match.group(1)) for match in AGE_PATTERN.finditer(text)]
+    genders = [_normalise_gender(match.group(1) or match.group(2)) for match in GENDER_PATTERN.finditer(text)]
+    dates = []
+    for pattern in REPORT_DATE_PATTERNS:
+        dates = [parsed for match in pattern.finditer(text) if (parsed := _parse_date(match.group(1)))]
+        if dates:
+            break
+    age = _unique("age", ages)
+    if age is not None and age > 120:
+        raise Ambiguous(f"age {age} is implausible")
+
+    return {
+        "patient_info": {
+            "name": _unique("name", names),
+            "age_years": age,
+            "gender": _unique("gender", genders),
+            "report_date": _unique("report_date", dates),
+        },
+        "lab_results": lab_results,
+    }
+
+
+def _missing_requirements(data: dict, required: str) -> list:
+    present = {field for field, value in data["patient_info"].items() if value is not None}
+    present.update(data["lab_results"])
+    return [requirement for requirement in filter(None, (part.strip() for part in required.split(",")))
+            if not present.intersection(requirement.split("|"))]
+
+
+def extract_clinical_data(pdf_bytes: bytes, required: str = PDF_LOCAL_REQUIRED_FIELDS):
+    """
+    Reads DiabetesClinicalData from the PDF's text layer. Returns (data, outcome); data is None whenever the
+    model should be asked instead, and outcome says why.
+    """
+    data, outcome = None, "disabled"
+    if PDF_LOCAL_EXTRACTION:
+        text = extract_text(pdf_bytes)
+        if text is None or len(text.strip()) < PDF_LOCAL_MIN_TEXT_CHARS:
+            outcome = "no_text_layer"
+        elif NARRATIVE_PATTERN.search(text):
+            outcome = "narrative"
+        else:
+            try:
+                parsed = parse_report_text(text)
+                missing = _missing_requirements(parsed, required)
+                if missing:
+                    outcome = "missing_fields"
+                    print(f"---PDF: Local extraction is missing {missing}, asking the model---")
+                else:
+                    data = DiabetesClinicalData.model_validate(parsed).model_dump()
+                    outcome = "local"
+            except Ambiguous as e:
+                outcome = "ambiguous"
+                print(f"---PDF: Local extraction is ambiguous ({e}), asking the model---")
+            except ValidationError as e:
+                outcome = "invalid"
+                print(f"---PDF: Local extraction failed validation, asking the model: {e}---")
+    metrics.inc("glycosight_pdf_local_extraction_total", {"outcome": outcome})
+    return data, outcome
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# A user who uploads several files in a few minutes should read their profile from Supabase once. Entries are
+# short-lived because other instances (and the dashboard) write the same rows.
+PROFILE_CACHE_BACKEND = os.getenv("PROFILE_CACHE_BACKEND", "memory")
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "120"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "2048"))
+PROFILE_CACHE_PATH = os.getenv("PROFILE_CACHE_PATH", "/tmp/glycosight_profile_cache.sqlite3")
+
+# PostgREST's error code when .single() matches no rows, i.e. the user has no profile yet.
+NO_ROWS_CODE = "PGRST116"
+
+
+def is_missing_profile(error: Exception) -> bool:
+    return getattr(error, "code", None) == NO_ROWS_CODE
+
+
+class MemoryProfileStore:
+    """In-process store with a per-entry TTL and LRU eviction."""
+
+    def __init__(self, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, serialized = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(serialized)
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            return self._generations.get(key, 0)
+
+    def bump(self, key: str):
+        with self._lock:
+            self._generations[key] = self._generations.pop(key, 0) + 1
+            while len(self._generations) > self.max_entries:
+                self._generations.popitem(last=False)
+
+    def set(self, key: str, value, ttl_seconds: float, generation: int = None):
+        """Stores `value`, or does nothing if `generation` is given and the key has been bumped past it."""
+        serialized = json.dumps(value)
+        with self._lock:
+            if generation is not None and self._generations.get(key, 0) != generation:
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + ttl_seconds, serialized)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteProfileStore:
+    """
+    Shared by the workers on one host, so a write in one is seen by the others. Generations live in the same
+    file, so a fetch in one worker can't cache a profile another worker has written since.
+    """
+
+    def __init__(self, path: str = PROFILE_CACHE_PATH, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profile_cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profile_generations "
+            "(key TEXT PRIMARY KEY, generation INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM profile_cache WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE profile_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def generation(self, key: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT generation FROM profile_generations WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, key: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO profile_generations (key, generation, updated_at) VALUES (?, 1, ?) "
+                "ON CONFLICT(key) DO UPDATE SET generation = generation + 1, updated_at = excluded.updated_at",
+                (key, now)
+            )
+            self._conn.execute(
+                "DELETE FROM profile_generations WHERE key NOT IN "
+                "(SELECT key FROM profile_generations ORDER BY updated_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def set(self, key: str, value, ttl_seconds: float, generation: int = None):
+        """Stores `value`, or does nothing if `generation` is given and the key has been bumped past it."""
+        now = time.time()
+        with self._lock:
+            # The check and the write are one statement, so a bump from another process can't land in between.
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profile_cache (key, value, expires_at, accessed_at) SELECT ?, ?, ?, ? "
+                "WHERE ? IS NULL OR COALESCE((SELECT generation FROM profile_generations WHERE key = ?), 0) = ?",
+                (key, json.dumps(value), now + ttl_seconds, now, generation, key, generation)
+            )
+            self._conn.execute("DELETE FROM profile_cache WHERE expires_at <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM profile_cache WHERE key NOT IN "
+                "(SELECT key FROM profile_cache ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM profile_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM profile_cache WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+
+
+class ProfileCache:
+    """
+    Read-through cache of user_health_profiles rows, including "no profile yet". Upserts write through; a failed
+    upsert invalidates, since the row's state is then unknown. A fetch that started before a write never
+    overwrites what that write cached: every write bumps the user's generation in the store, and a fetch only
+    fills the cache if the generation is still the one it started at.
+    """
+
+    def __init__(self, store=None, ttl_seconds: float = PROFILE_CACHE_TTL_SECONDS, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # With caching off, generations are still kept (in process) for callers that hold a prefetched profile.
+        self._generations = store if store is not None else MemoryProfileStore(max_entries)
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, user_id: str):
+        """Returns (hit, profile); the profile is None both on a miss and for a user with no profile."""
+        entry = None
+        if self.store is not None:
+            try:
+                entry = self.store.get(user_id)
+            except Exception as e:
+                print(f"---PROFILE_CACHE: Lookup failed, treating as a miss: {e}---")
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, entry["profile"]
+
+    def generation(self, user_id: str):
+        """The user's write count, or None if it can't be read; None never matches, so nothing stale is trusted."""
+        try:
+            return self._generations.generation(user_id)
+        except Exception as e:
+            print(f"---PROFILE_CACHE: Generation lookup failed: {e}---")
+            return None
+
+    def _bump(self, user_id: str):
+        try:
+            self._generations.bump(user_id)
+        except Exception as e:
+            print(f"---PROFILE_CACHE: Generation bump failed: {e}---")
+
+    def _store(self, user_id: str, profile, generation: int = None):
+        if self.store is None:
+            return
+        try:
+            self.store.set(user_id, {"profile": profile}, self.ttl_seconds, generation)
+        except Exception as e:
+            print(f"---PROFILE_CACHE: Store failed: {e}---")
+
+    def fill(self, user_id: str, profile, generation):
+        """Caches a fetched profile, unless it was written or invalidated after the fetch began."""
+        if generation is not None:
+            self._store(user_id, profile, generation)
+
+    def write_through(self, user_id: str, profile):
+        self._bump(user_id)
+        self._store(user_id, profile)
+
+    def invalidate(self, user_id: str):
+        self._bump(user_id)
+        if self.store is not None:
+            try:
+                self.store.delete(user_id)
+            except Exception as e:
+                print(f"---PROFILE_CACHE: Invalidate failed: {e}---")
+
+    async def aget_or_fetch(self, user_id: str, fetch):
+        """Serves from cache, or runs `fetch` once for any number of concurrent callers asking for the same user."""
+        hit, profile = self.lookup(user_id)
+        if hit:
+            return profile
+        pending = self._in_flight.get(user_id)
+        if pending is None or pending.get_loop() is not asyncio.get_running_loop():
+            generation = self.generation(user_id)
+            pending = asyncio.ensure_future(fetch())
+            self._in_flight[user_id] = pending
+
+            def done(future):
+                if self._in_flight.get(user_id) is future:
+                    del self._in_flight[user_id]
+                if not future.cancelled() and future.exception() is None:
+                    self.fill(user_id, future.result(), generation)
+
+            pending.add_done_callback(done)
+        return await asyncio.shield(pending)
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.store).__name__ if self.store is not None else None,
+            "entries": len(self.store) if self.store is not None else 0,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def create_profile_cache(backend_name: str = PROFILE_CACHE_BACKEND) -> ProfileCache:
+    if backend_name == "sqlite":
+        return ProfileCache(SQLiteProfileStore())
+    if backend_name == "off":
+        return ProfileCache(None)
+    return ProfileCache(MemoryProfileStore())
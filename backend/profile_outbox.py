@@ -0,0 +1,189 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from tracing import metrics
+
+# Profile writes are recorded here and flushed to Supabase in the background, so a finished diagnosis is returned
+# straight away and survives a slow or failing database. Each user has at most one pending row: a newer write
+# replaces the older one, since every write carries the whole profile.
+# Opt-in: it needs a long-lived process and a disk that outlives it. On serverless hosts (the Vercel deployment),
+# the background thread is frozen between requests and /tmp is discarded, so profiles are written directly.
+PROFILE_OUTBOX_ENABLED = os.getenv("PROFILE_OUTBOX_ENABLED", "false").lower() == "true"
+PROFILE_OUTBOX_PATH = os.getenv("PROFILE_OUTBOX_PATH", "/tmp/glycosight_profile_outbox.sqlite3")
+PROFILE_OUTBOX_BATCH_SIZE = int(os.getenv("PROFILE_OUTBOX_BATCH_SIZE", "50"))
+PROFILE_OUTBOX_FLUSH_INTERVAL_SECONDS = float(os.getenv("PROFILE_OUTBOX_FLUSH_INTERVAL_SECONDS", "0.5"))
+PROFILE_OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("PROFILE_OUTBOX_RETRY_BASE_SECONDS", "1"))
+PROFILE_OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("PROFILE_OUTBOX_RETRY_MAX_SECONDS", "300"))
+# After this many failed attempts a row is parked as 'dead' (kept on disk, reported in stats) until the user's
+# next write replaces it.
+PROFILE_OUTBOX_MAX_ATTEMPTS = int(os.getenv("PROFILE_OUTBOX_MAX_ATTEMPTS", "20"))
+
+
+class ProfileOutbox:
+    """
+    A durable, per-user coalescing write-behind queue in SQLite, drained by one background thread. `write_rows`
+    takes a list of rows and upserts them in one request; `on_dead(user_id)` is called when a user's write is
+    given up on, so anything serving it as stored can drop it.
+    """
+
+    def __init__(self, write_rows, on_dead=None, path: str = PROFILE_OUTBOX_PATH, batch_size: int = PROFILE_OUTBOX_BATCH_SIZE,
+                 flush_interval_seconds: float = PROFILE_OUTBOX_FLUSH_INTERVAL_SECONDS,
+                 retry_base_seconds: float = PROFILE_OUTBOX_RETRY_BASE_SECONDS,
+                 retry_max_seconds: float = PROFILE_OUTBOX_RETRY_MAX_SECONDS, max_attempts: int = PROFILE_OUTBOX_MAX_ATTEMPTS):
+        self.write_rows = write_rows
+        self.on_dead = on_dead
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profile_outbox (user_id TEXT PRIMARY KEY, version TEXT NOT NULL, "
+            "row TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, next_attempt_at REAL NOT NULL, "
+            "last_error TEXT, enqueued_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def enqueue(self, user_id: str, row: dict):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO profile_outbox (user_id, version, row, status, attempts, next_attempt_at, last_error, enqueued_at) "
+                "VALUES (?, ?, ?, 'pending', 0, ?, NULL, ?) ON CONFLICT(user_id) DO UPDATE SET version = excluded.version, "
+                "row = excluded.row, status = 'pending', attempts = 0, next_attempt_at = excluded.next_attempt_at, "
+                "last_error = NULL",
+                (user_id, uuid.uuid4().hex, json.dumps(row), now, now)
+            )
+            self._conn.commit()
+        metrics.inc("glycosight_profile_outbox_total", {"outcome": "enqueued"})
+        self.start()
+        self._wake.set()
+
+    def pending_row(self, user_id: str):
+        """
+        The user's newest profile if it is still on its way to the database, so reads see their own writes. A row
+        given up on as 'dead' is not served: the database's copy is the last one known to have been stored.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT row FROM profile_outbox WHERE user_id = ? AND status = 'pending'", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _due(self) -> list:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT user_id, version, row, attempts FROM profile_outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY enqueued_at LIMIT ?",
+                (time.time(), self.batch_size)
+            ).fetchall()
+
+    def _delivered(self, entries: list):
+        # A write that arrived while this batch was in flight has a new version and stays queued.
+        with self._lock:
+            self._conn.executemany("DELETE FROM profile_outbox WHERE user_id = ? AND version = ?",
+                                   [(user_id, version) for user_id, version, _, _ in entries])
+            self._conn.commit()
+        metrics.inc("glycosight_profile_outbox_total", {"outcome": "flushed"}, len(entries))
+
+    def _failed(self, entry, error: Exception):
+        user_id, version, _, attempts = entry
+        attempts += 1
+        cap = min(self.retry_max_seconds, self.retry_base_seconds * 2 ** (attempts - 1))
+        delay = cap / 2 + random.uniform(0, cap / 2)
+        dead = attempts >= self.max_attempts
+        with self._lock:
+            updated = self._conn.execute(
+                "UPDATE profile_outbox SET attempts = ?, next_attempt_at = ?, last_error = ?, status = ? "
+                "WHERE user_id = ? AND version = ?",
+                (attempts, time.time() + delay, str(error), "dead" if dead else "pending", user_id, version)
+            ).rowcount
+            self._conn.commit()
+        metrics.inc("glycosight_profile_outbox_total", {"outcome": "dead" if dead else "retried"})
+        if dead:
+            print(f"---PROFILE_OUTBOX: Giving up on the profile write for {user_id} after {attempts} attempts: {error}---")
+            # A newer write that replaced the row meanwhile is still on its way, and still the right one to serve.
+            if updated and self.on_dead is not None:
+                self.on_dead(user_id)
+        else:
+            print(f"---PROFILE_OUTBOX: Profile write for {user_id} failed, retry {attempts} in {delay:.1f}s: {error}---")
+
+    def flush(self) -> int:
+        """Sends every due row, a batch per request. Returns how many were delivered."""
+        delivered = 0
+        while entries := self._due():
+            try:
+                self.write_rows([json.loads(row) for _, _, row, _ in entries])
+                self._delivered(entries)
+                delivered += len(entries)
+            except Exception as e:
+                if len(entries) == 1:
+                    self._failed(entries[0], e)
+                    continue
+                # Retry one by one, so a single bad row doesn't hold back the rest of the batch.
+                for entry in entries:
+                    try:
+                        self.write_rows([json.loads(entry[2])])
+                        self._delivered([entry])
+                        delivered += 1
+                    except Exception as row_error:
+                        self._failed(entry, row_error)
+            if len(entries) < self.batch_size:
+                break
+        return delivered
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"---PROFILE_OUTBOX: Flush failed: {e}---")
+
+    def start(self):
+        """Starts the background flusher, which also drains anything left over from a previous run."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name="profile-outbox", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 10):
+        """Stops the flusher after a last flush. Whatever is still undelivered stays on disk for the next start."""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*), MIN(enqueued_at) FROM profile_outbox GROUP BY status"
+            ).fetchall()
+        counts = {status: count for status, count, _ in rows}
+        oldest = min((enqueued_at for _, _, enqueued_at in rows), default=None)
+        return {
+            "pending": counts.get("pending", 0),
+            "dead": counts.get("dead", 0),
+            "oldest_age_seconds": round(time.time() - oldest, 1) if oldest is not None else None,
+        }
+
+
+def create_profile_outbox(write_rows, on_dead=None, enabled: bool = PROFILE_OUTBOX_ENABLED):
+    return ProfileOutbox(write_rows, on_dead) if enabled else None
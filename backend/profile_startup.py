@@ -0,0 +1,82 @@
+# Cold-start profile for the serverless deployment. Each measurement runs in a fresh interpreter, the way a new
+# Vercel instance would: import api, serve the first GET /, then load the workflow the first /diagnose needs.
+# Also prints the slowest imports from `python -X importtime`.
+#
+# Usage: python profile_startup.py --runs 5 --top 15
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = pathlib.Path(__file__).parent
+
+COLD_START_SCRIPT = """
+import asyncio, json, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+
+async def main():
+    import httpx
+    transport = httpx.ASGITransport(app=api.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://profile") as client:
+        before = time.perf_counter()
+        await client.get("/")
+        first_response = time.perf_counter()
+    await api.get_workflow()
+    workflow_loaded = time.perf_counter()
+    return {
+        "import_api_ms": (imported - started) * 1000,
+        "first_get_ms": (first_response - before) * 1000,
+        "load_workflow_ms": (workflow_loaded - first_response) * 1000,
+    }
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def measure_cold_start() -> dict:
+    output = subprocess.run([sys.executable, "-c", COLD_START_SCRIPT], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, top: int) -> list:
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces of indentation per level; keep the modules our own code imports directly.
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth <= 1:
+            rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start and import-time profile for the GlycoSight AI API.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--module", default="api")
+    args = parser.parse_args()
+
+    runs = [measure_cold_start() for _ in range(args.runs)]
+    print(f"{'phase':>18} {'median_ms':>10} {'max_ms':>8}")
+    for phase in runs[0]:
+        values = [run[phase] for run in runs]
+        print(f"{phase:>18} {statistics.median(values):>10.1f} {max(values):>8.1f}")
+
+    print(f"\nSlowest imports under `import {args.module}` (cumulative):")
+    print(f"{'cumulative_ms':>13} {'self_ms':>8}  module")
+    for name, self_ms, cumulative_ms in slowest_imports(args.module, args.top):
+        print(f"{cumulative_ms:>13.1f} {self_ms:>8.1f}  {name}")
+
+
+if __name__ == "__main__":
+    main()
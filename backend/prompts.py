@@ -80,6 +80,20 @@ Do not provide any additional text, explanations, or comments outside of the "TR
 If it is neither a medical report nor a medical scan, respond with "NEITHER".
 """
 
+fused_image_prompt = f"""
+Your task has two parts, and you must answer both in a single JSON object with the keys "image_type" and "clinical_data".
+
+Part 1 - Classification:
+Determine whether the provided image is a medical report or a medical scan.
+Set "image_type" strictly to "TRUE" if the image is a medical report, and "FALSE" if it is a medical scan.
+If it is neither a medical report nor a medical scan, set "image_type" to "NEITHER".
+
+Part 2 - Extraction:
+Only if "image_type" is "TRUE", fill "clinical_data" by following these instructions:
+{patient_json_maker_prompt}
+If "image_type" is "FALSE" or "NEITHER", set every value inside "clinical_data" to null (and "current_medications_keywords" to an empty list).
+"""
+
 final_rag_prompt = """
 You are a highly skilled medical professional with expertise in diabetes management. Your habit is to provide accurate and comprehensive responses based on the latest medical guidelines and research.
 One of your key strengths is to analyze patient data and compare it with established medical guidelines and corpus to provide the best possible diagnosis.
@@ -141,6 +155,13 @@ For the summary as well, you can be as verbose as you want to, but ensure that i
 Here's the JSON object containing patient parameters:
 """
 
+retrieved_corpus_prompt = """
+The corpus for this request is the set of guideline passages below, retrieved for this patient's parameters. Each passage starts with its id in square brackets, followed by the page, subsection, section and document it comes from.
+Base your analysis and citations ONLY on these passages. For every citation, set "chunk_id" to the id of the passage you cite (for example "ada-p4-2"), and "page" to its page number.
+
+{passages}
+"""
+
 visual_rag_prompt = """
 You are a highly skilled medical professional with expertise in diabetes management. Your habit is to provide accurate and comprehensive responses based on the latest medical guidelines and research.
 One of your key strengths is to analyze patient scans, along with their past analysis, and compare it with established medical guidelines and corpus to provide the best possible diagnosis.
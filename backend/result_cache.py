@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "/tmp/glycosight_result_cache.sqlite3")
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+
+
+def file_sha256(file_data) -> str:
+    if isinstance(file_data, (bytes, bytearray)):
+        return hashlib.sha256(file_data).hexdigest()
+    digest = hashlib.sha256()
+    with open(file_data, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prompt_version(*parts) -> str:
+    return hashlib.sha256("\n".join(str(part) for part in parts).encode()).hexdigest()[:12]
+
+
+class LRUResultCache:
+    """In-process cache bounded by both entry count and total serialized size."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(self._entries[key])
+
+    def set(self, key: str, value):
+        serialized = json.dumps(value)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = serialized
+            self._total_bytes += len(serialized)
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResultCache:
+    """On-disk cache that survives restarts and can be shared by workers on the same host."""
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS result_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM result_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE result_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, value, accessed_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM result_cache WHERE key NOT IN "
+                "(SELECT key FROM result_cache ORDER BY accessed_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+
+
+class ResultCache:
+    """Caches model results for a file, keyed by its SHA-256, the task, the prompt version and the model."""
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUResultCache()
+        self.hits = {}
+        self.misses = {}
+        self.local = {}
+
+    @staticmethod
+    def make_key(task: str, sha256: str, model: str, version: str) -> str:
+        return f"{task}:{model}:{version}:{sha256}"
+
+    def get(self, task: str, key: str):
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"---RESULT_CACHE: Lookup failed, treating as a miss: {e}---")
+            value = None
+        counter = self.misses if value is None else self.hits
+        counter[task] = counter.get(task, 0) + 1
+        return value
+
+    def record_local(self, task: str):
+        """Moves the last miss for `task` to `local`: it was answered without the model, so it cost no call."""
+        self.misses[task] -= 1
+        self.local[task] = self.local.get(task, 0) + 1
+
+    def set(self, key: str, value):
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"---RESULT_CACHE: Store failed: {e}---")
+
+    def stats(self) -> dict:
+        return {
+            "backend": type(self.backend).__name__,
+            "entries": len(self.backend),
+            "hits": dict(self.hits),
+            "misses": dict(self.misses),
+            "local": dict(self.local),
+        }
+
+
+def create_result_cache(backend_name: str = RESULT_CACHE_BACKEND) -> ResultCache:
+    if backend_name == "sqlite":
+        return ResultCache(SQLiteResultCache())
+    return ResultCache(LRUResultCache())
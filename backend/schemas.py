@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Literal
 
 class LabResultDetail(BaseModel):
     value: Optional[Union[float, int]] = None
@@ -54,6 +54,8 @@ class Citations(BaseModel):
     id: int
     reference: str
     url: str
+    chunk_id: Optional[str] = None
+    page: Optional[int] = None
 
 class RAGDiagnosisResponse(BaseModel):
     summary: str
@@ -61,4 +63,8 @@ class RAGDiagnosisResponse(BaseModel):
     citations: List[Citations]
     final_diagnosis: str
     confidence_score: ConfidenceScore
-    alert_color: str
\ No newline at end of file
+    alert_color: str
+
+class ImageClassificationWithData(BaseModel):
+    image_type: Literal["TRUE", "FALSE", "NEITHER"]
+    clinical_data: DiabetesClinicalData = Field(default_factory=DiabetesClinicalData)
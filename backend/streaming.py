@@ -0,0 +1,57 @@
+import json
+
+
+def format_sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class PartialJSONFieldParser:
+    """
+    Incrementally parses a streamed top-level JSON object and yields each key/value pair as soon as its
+    value is complete, so fields like "summary" can be shown before the rest of the object has arrived.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.started = False
+        self._decoder = json.JSONDecoder()
+
+    def _skip(self, characters: str):
+        while self.position < len(self.buffer) and self.buffer[self.position] in characters:
+            self.position += 1
+
+    def feed(self, text: str) -> list:
+        self.buffer += text
+        completed = []
+        if not self.started:
+            self._skip(" \t\r\n")
+            if self.position >= len(self.buffer):
+                return completed
+            if self.buffer[self.position] != "{":
+                raise ValueError("Streamed response is not a JSON object")
+            self.position += 1
+            self.started = True
+
+        while True:
+            start = self.position
+            self._skip(" \t\r\n,")
+            try:
+                key, end = self._decoder.raw_decode(self.buffer, self.position)
+                self.position = end
+                self._skip(" \t\r\n")
+                if self.position >= len(self.buffer) or self.buffer[self.position] != ":":
+                    raise ValueError("Key is not followed by a value yet")
+                self.position += 1
+                self._skip(" \t\r\n")
+                value, end = self._decoder.raw_decode(self.buffer, self.position)
+                # A number (or literal) is only complete once something other than its own characters follows:
+                # "12" may still become "12.5".
+                if not isinstance(value, (dict, list, str)) and (
+                        end >= len(self.buffer) or self.buffer[end] not in " \t\r\n,}"):
+                    raise ValueError("Scalar value may be incomplete")
+            except ValueError:
+                self.position = start
+                return completed
+            self.position = end
+            completed.append((key, value))
@@ -0,0 +1,32 @@
+import argparse
+import os
+import sys
+import pytest
+
+# The backend is a flat set of modules run from its own directory, so tests import them the same way.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    """The fake Gemini and Supabase clients the benchmark uses, with no injected latency and empty caches."""
+    import benchmark
+    import utils
+    from result_cache import LRUResultCache, ResultCache
+
+    # install_fakes swaps these globals in place; patching each with its current value first has them restored.
+    for name in ("_supabase", "_async_supabase", "profile_outbox", "result_cache", "UPLOAD_HANDLE_MAX_ENTRIES"):
+        monkeypatch.setattr(utils, name, getattr(utils, name))
+    for task in utils.model_router.targets:
+        provider = utils.model_router.route(task).provider
+        monkeypatch.setattr(provider, "_client", provider._client)
+    original_outbox = utils.profile_outbox
+
+    args = argparse.Namespace(latency_ms=0, jitter_ms=0, upload_latency_ms=0, db_latency_ms=0, error_rate=0.0,
+                              db_error_rate=0.0, seed=0, keep_caches=True)
+    gemini = benchmark.install_fakes(args)
+    monkeypatch.setattr(utils, "result_cache", ResultCache(LRUResultCache()))
+    monkeypatch.setattr(utils, "_uploaded_files", type(utils._uploaded_files)())
+    yield gemini.fake
+    if utils.profile_outbox is not original_outbox:
+        utils.profile_outbox.stop()
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+from admission import AdmissionController, Overloaded, UserLanes
+
+
+def test_global_and_per_user_limits():
+    controller = AdmissionController(max_in_flight=3, max_per_user=2, retry_after_seconds=7)
+    releases = [controller.admit("u1"), controller.admit("u1")]
+    with pytest.raises(Overloaded) as shed:
+        controller.admit("u1")
+    assert (shed.value.scope, shed.value.retry_after) == ("user", 7)
+
+    releases.append(controller.admit("u2"))
+    with pytest.raises(Overloaded) as shed:
+        controller.admit("u3")
+    assert shed.value.scope == "global"
+
+    releases[0]()
+    releases[0]()
+    assert controller.in_flight == 2
+    controller.admit("u3")
+
+
+def test_identical_requests_share_one_execution():
+    controller = AdmissionController(max_in_flight=1)
+    calls = []
+
+    async def diagnose():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"final_diagnosis": "High risk"}
+
+    async def scenario():
+        key = ("u1", "pdf", None, "sha")
+        return await asyncio.gather(*(controller.run(key, "u1", diagnose) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [{"final_diagnosis": "High risk"}] * 5
+    assert calls == [1]
+    assert controller.in_flight == 0
+
+
+def test_uploads_queued_behind_a_running_diagnosis_are_merged():
+    lanes = UserLanes(lambda existing, new: {"files": existing["files"] + new["files"]})
+    runs = []
+
+    async def run(data):
+        runs.append(data["files"])
+        await asyncio.sleep(0.01)
+        return len(data["files"])
+
+    async def scenario():
+        first = asyncio.ensure_future(lanes.merge_and_run("u1", {"files": ["a"]}, run))
+        await asyncio.sleep(0)
+        rest = [lanes.merge_and_run("u1", {"files": [name]}, run) for name in ("b", "c")]
+        return await asyncio.gather(first, *rest)
+
+    assert asyncio.run(scenario()) == [1, 2, 2]
+    assert runs == [["a"], ["b", "c"]]
+
+
+def test_a_cancelled_upload_is_dropped_from_the_merge():
+    lanes = UserLanes(lambda existing, new: {"files": existing["files"] + new["files"]})
+    runs = []
+
+    async def run(data):
+        runs.append(data["files"])
+        await asyncio.sleep(0.01)
+        return data["files"]
+
+    async def scenario():
+        first = asyncio.ensure_future(lanes.merge_and_run("u1", {"files": ["a"]}, run))
+        await asyncio.sleep(0)
+        cancelled = asyncio.ensure_future(lanes.merge_and_run("u1", {"files": ["b"]}, run))
+        kept = asyncio.ensure_future(lanes.merge_and_run("u1", {"files": ["c"]}, run))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        return await first, await kept
+
+    assert asyncio.run(scenario()) == (["a"], ["c"])
+    assert runs == [["a"], ["c"]]
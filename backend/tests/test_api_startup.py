@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+import api
+import utils
+
+
+def test_refresh_survives_a_failed_warm_up(monkeypatch):
+    refreshed = []
+
+    async def unreachable():
+        raise OSError("network is unreachable")
+
+    async def refresh():
+        refreshed.append(True)
+        if len(refreshed) == 1:
+            raise OSError("network is unreachable")
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(utils, "awarm_up_connections", unreachable)
+    monkeypatch.setattr(utils, "awarm_up_static_context", refresh)
+    monkeypatch.setattr(utils, "profile_outbox", None)
+    monkeypatch.setattr(api, "STATIC_CONTEXT_REFRESH_SECONDS", 0)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(api.refresh_static_context())
+    assert len(refreshed) == 2
+
+
+def test_refresh_survives_a_failed_workflow_load(monkeypatch):
+    loads = []
+
+    async def flaky_workflow():
+        loads.append(True)
+        if len(loads) == 1:
+            raise ImportError("langgraph is not installed")
+
+    async def refresh():
+        raise asyncio.CancelledError
+
+    async def connected():
+        pass
+
+    monkeypatch.setattr(api, "get_workflow", flaky_workflow)
+    monkeypatch.setattr(utils, "awarm_up_connections", connected)
+    monkeypatch.setattr(utils, "awarm_up_static_context", refresh)
+    monkeypatch.setattr(utils, "profile_outbox", None)
+    monkeypatch.setattr(api, "STATIC_CONTEXT_REFRESH_SECONDS", 0)
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(api.refresh_static_context())
+    assert len(loads) == 2
@@ -0,0 +1,89 @@
+import asyncio
+import httpx
+import agentic_workflow
+import api
+import benchmark
+from schemas import DiabetesClinicalData
+
+
+def count_calls(monkeypatch, name: str) -> list:
+    """Wraps a model helper the workflow imported, recording the user of each call."""
+    original = getattr(agentic_workflow, name)
+    calls = []
+
+    async def counted(user_id, *args, **kwargs):
+        calls.append(user_id)
+        return await original(user_id, *args, **kwargs)
+
+    monkeypatch.setattr(agentic_workflow, name, counted)
+    return calls
+
+
+def batch_state(user_id: str, input_type: str, file_name: str, file_bytes: bytes) -> dict:
+    return {"user_id": user_id, "file_bytes": file_bytes, "file_name": file_name, "input_type": input_type}
+
+
+def test_each_users_files_are_diagnosed_with_one_rag_call(fake_backend, monkeypatch):
+    rag_calls = count_calls(monkeypatch, "arag_from_corpus")
+    report = benchmark.make_pdf_report()
+    states = [batch_state("batch-a", "pdf", "a1.pdf", report), batch_state("batch-b", "pdf", "b1.pdf", report),
+              batch_state("batch-a", "pdf", "a2.pdf", report)]
+
+    results = asyncio.run(agentic_workflow.run_batch_diagnosis(states))
+
+    assert sorted(rag_calls) == ["batch-a", "batch-b"]
+    assert set(results) == {"batch-a", "batch-b"}
+    assert all(result["diagnosis"]["final_diagnosis"] and not result["errors"] for result in results.values())
+
+
+def test_scans_are_analysed_and_reports_without_values_are_not_diagnosed(fake_backend, monkeypatch):
+    rag_calls = count_calls(monkeypatch, "arag_from_corpus")
+    scan_calls = count_calls(monkeypatch, "avlm_analysis_for_scans")
+
+    async def nothing_extracted(file_data):
+        return DiabetesClinicalData().model_dump()
+
+    monkeypatch.setattr(agentic_workflow, "aextract_patient_parameters_from_pdf", nothing_extracted)
+    states = [batch_state("batch-scan", "image", "fundus.png", benchmark.make_scan_image()),
+              batch_state("batch-scan", "pdf", "empty.pdf", benchmark.make_pdf_report())]
+
+    result = asyncio.run(agentic_workflow.run_batch_diagnosis(states))["batch-scan"]
+
+    assert scan_calls == ["batch-scan"]
+    assert rag_calls == []
+    assert [scan["file_name"] for scan in result["scan_diagnoses"]] == ["fundus.png"]
+    assert result["diagnosis"] is None
+    assert result["errors"] == [{"file_name": "empty.pdf", "error": "No clinical values could be extracted from the file."}]
+
+
+def test_a_failed_file_is_reported_without_failing_the_batch(fake_backend, monkeypatch):
+    original = agentic_workflow.aextract_patient_parameters_from_pdf
+
+    async def fails_on_corrupt(file_data):
+        if file_data == b"corrupt":
+            raise ValueError("not a PDF")
+        return await original(file_data)
+
+    monkeypatch.setattr(agentic_workflow, "aextract_patient_parameters_from_pdf", fails_on_corrupt)
+    states = [batch_state("batch-err", "pdf", "good.pdf", benchmark.make_pdf_report()),
+              batch_state("batch-err", "pdf", "bad.pdf", b"corrupt")]
+
+    result = asyncio.run(agentic_workflow.run_batch_diagnosis(states))["batch-err"]
+
+    assert result["diagnosis"] is not None
+    assert result["errors"] == [{"file_name": "bad.pdf", "error": "Failed to process PDF: not a PDF"}]
+
+
+def test_user_ids_must_match_the_number_of_files():
+    async def post():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(
+                "/diagnose/batch",
+                data={"user_ids": ["u1", "u2", "u3"], "input_types": ["pdf"]},
+                files=[("files", ("a.pdf", b"%PDF")), ("files", ("b.pdf", b"%PDF"))]
+            )
+
+    response = asyncio.run(post())
+    assert response.status_code == 400
+    assert response.json()["detail"] == "user_ids must have one entry or one entry per file."
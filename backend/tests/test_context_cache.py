@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import utils
+from context_cache import ContextCacheManager
+from corpus import CorpusRegistry
+from fakes import FakeGeminiClient, FaultProfile
+from schemas import RAGDiagnosisResponse
+
+
+class InlineCorpus:
+    async def aget(self, name: str):
+        return f"<{name} corpus>"
+
+
+def cache_manager(client) -> ContextCacheManager:
+    route = SimpleNamespace(client=client, model="fake-model")
+    return ContextCacheManager(lambda key: route, InlineCorpus(), enabled=True)
+
+
+def test_a_cache_is_created_once_and_reused():
+    client = FakeGeminiClient()
+    manager = cache_manager(client)
+
+    async def scenario():
+        return [await manager.aget("ada_rag"), await manager.aget("ada_rag")]
+
+    first, second = asyncio.run(scenario())
+    assert first.startswith("cachedContents/") and second == first
+    assert client.fake.calls["cache"] == 1
+
+
+def test_a_cache_near_expiry_is_renewed():
+    client = FakeGeminiClient()
+    manager = cache_manager(client)
+    asyncio.run(manager.aget("ada_rag"))
+    manager._entries["ada_rag"]["expires_at"] = datetime.now(timezone.utc) + manager.renew_margin / 2
+
+    assert asyncio.run(manager.aget("ada_rag"))
+    assert client.fake.calls["cache"] == 2
+    assert manager._entries["ada_rag"]["expires_at"] > datetime.now(timezone.utc) + manager.ttl - timedelta(minutes=1)
+
+
+def test_a_failed_create_is_not_retried_within_the_backoff():
+    client = FakeGeminiClient(model_faults=FaultProfile(error_rate=1.0))
+    manager = cache_manager(client)
+
+    async def scenario():
+        return [await manager.aget("ada_rag"), await manager.aget("ada_rag")]
+
+    assert asyncio.run(scenario()) == [None, None]
+    assert client.fake.calls["cache"] == 1
+
+
+def test_a_failed_cached_call_falls_back_to_the_inline_corpus(fake_backend, monkeypatch):
+    registry = CorpusRegistry(utils.get_client)
+    monkeypatch.setattr(utils, "corpus_registry", registry)
+    monkeypatch.setattr(utils, "context_cache", ContextCacheManager(utils.model_router.route, registry, enabled=True))
+    respond = fake_backend.respond
+    configs = []
+
+    def respond_without_cache(contents, config=None):
+        configs.append(config)
+        if config.get("cached_content"):
+            raise ValueError("cached content not found")
+        return respond(contents, config)
+
+    monkeypatch.setattr(fake_backend, "respond", respond_without_cache)
+    response = asyncio.run(utils._agenerate_with_static_prefix("visual_rag", [], "Patient data", RAGDiagnosisResponse))
+
+    assert [bool(config.get("cached_content")) for config in configs] == [True, False]
+    assert response.text
+    assert "visual_rag" not in utils.context_cache._entries
@@ -0,0 +1,18 @@
+import asyncio
+from google.genai import types
+from corpus import CorpusRegistry
+from fakes import FakeGeminiClient, FaultProfile
+
+
+def test_a_failed_upload_is_not_retried_within_the_backoff(tmp_path):
+    guideline = tmp_path / "ADA.pdf"
+    guideline.write_bytes(b"%PDF-1.4 guideline")
+    client = FakeGeminiClient(upload_faults=FaultProfile(error_rate=1.0))
+    registry = CorpusRegistry(lambda: client, files={"ada": guideline})
+
+    async def scenario():
+        return [await registry.aget("ada"), await registry.aget("ada")]
+
+    parts = asyncio.run(scenario())
+    assert client.fake.calls["upload"] == 1
+    assert all(isinstance(part, types.Part) and part.inline_data.data == b"%PDF-1.4 guideline" for part in parts)
@@ -0,0 +1,62 @@
+import corpus_index
+from corpus_index import CorpusIndex, chunk_pages, resolve_citations, retrieval_queries, tokenize
+
+PAGES = [
+    "CLASSIFICATION AND DIAGNOSIS\nThe A1C test should be performed using a certified method.\n"
+    "Diabetes is diagnosed at an A1C of 6.5% or higher.",
+    "OBESITY MANAGEMENT\nWeight loss of 5% improves glycemic outcomes in overweight adults.",
+]
+
+
+def build_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(corpus_index, "extract_pages", lambda path: PAGES)
+    source = tmp_path / "ada.pdf"
+    source.write_bytes(b"%PDF")
+    corpus_index.build({"ada": source}, tmp_path / "index")
+    return CorpusIndex(tmp_path / "index", enabled=True)
+
+
+def test_tokens_are_normalised():
+    assert tokenize("The HbA1c tests are Glycated") == ["a1c", "test", "a1c"]
+
+
+def test_chunks_carry_their_page_and_section():
+    chunks = chunk_pages("ada", PAGES)
+    assert [(chunk["id"], chunk["page"], chunk["section"]) for chunk in chunks] == [
+        ("ada-p1-1", 1, "CLASSIFICATION AND DIAGNOSIS"),
+        ("ada-p2-1", 2, "OBESITY MANAGEMENT"),
+    ]
+
+
+def test_search_ranks_the_matching_passage_first(tmp_path, monkeypatch):
+    index = build_index(tmp_path, monkeypatch)
+    assert index.available()
+    hits = index.search("HbA1c 6.5% diagnosis", k=2)
+    assert hits[0]["id"] == "ada-p1-1"
+    assert index.search("weight loss overweight", k=1)[0]["page"] == 2
+    assert index.search("hypertension", k=2) == []
+
+
+def test_abnormal_results_are_searched_first():
+    queries = retrieval_queries({"lab_results": {
+        "bmi": {"value": 22, "status_flag": "Normal"},
+        "hba1c": {"value": 6.8, "status_flag": "High"},
+    }})
+    assert queries[:2] == [corpus_index.LAB_QUERIES["hba1c"], corpus_index.LAB_QUERIES["bmi"]]
+
+
+def test_citations_are_rewritten_from_the_passages_they_name(tmp_path, monkeypatch):
+    passages = build_index(tmp_path, monkeypatch).search("A1C diagnosis", k=1)
+    response = resolve_citations({"citations": [
+        {"chunk_id": "ada-p1-1", "reference": "made up", "page": 99},
+        {"chunk_id": "ada-p9-9", "reference": "unknown"},
+    ]}, passages)
+    assert response["citations"][0]["page"] == 1
+    assert "made up" not in response["citations"][0]["reference"]
+    assert response["citations"][1]["chunk_id"] is None
+
+
+def test_the_shipped_index_finds_diagnostic_criteria():
+    index = CorpusIndex(enabled=True)
+    passages = index.passages_for({"lab_results": {"hba1c": {"value": 6.8, "status_flag": "High"}}}, k=4)
+    assert passages and all(passage["corpus"] == "ada" for passage in passages)
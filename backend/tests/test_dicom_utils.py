@@ -0,0 +1,86 @@
+import io
+import numpy as np
+import pydicom
+from PIL import Image
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, CTImageStorage, generate_uid
+from dicom_utils import convert_dicom_to_jpeg_bytes, normalize_to_uint8, select_frame_indices
+
+
+def make_study(frames: int, size: int = 64, window_center=40, window_width=80, volume=None) -> bytes:
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = CTImageStorage
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    dataset = Dataset()
+    dataset.file_meta = meta
+    dataset.SOPClassUID = CTImageStorage
+    dataset.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    dataset.Modality = "CT"
+    dataset.Rows = dataset.Columns = size
+    dataset.NumberOfFrames = frames
+    dataset.SamplesPerPixel = 1
+    dataset.PhotometricInterpretation = "MONOCHROME2"
+    dataset.BitsAllocated = 16
+    dataset.BitsStored = 12
+    dataset.HighBit = 11
+    dataset.PixelRepresentation = 0
+    dataset.RescaleSlope = 1
+    dataset.RescaleIntercept = -1024
+    dataset.WindowCenter = window_center
+    dataset.WindowWidth = window_width
+    # Every row runs from -1024 HU to +1000 HU, left to right.
+    if volume is None:
+        row = np.linspace(0, 2024, size).round().astype(np.uint16)
+        volume = np.broadcast_to(row, (frames, size, size)).copy()
+    dataset.PixelData = volume.tobytes()
+
+    buffer = io.BytesIO()
+    dataset.save_as(buffer, enforce_file_format=True)
+    return buffer.getvalue()
+
+
+def test_select_frame_indices_spreads_frames_evenly():
+    assert select_frame_indices(3, 4) == [0, 1, 2]
+    assert select_frame_indices(9, 1) == [4]
+    assert select_frame_indices(10, 4) == [0, 3, 6, 9]
+
+
+def test_multi_frame_study_with_several_windows_uses_the_first_window_for_every_frame():
+    study = make_study(frames=6, window_center=[40, 400], window_width=[80, 800])
+    dataset = pydicom.dcmread(io.BytesIO(study))
+    frames = dataset.pixel_array
+
+    column_at_40_hu = int(np.abs(np.linspace(-1024, 1000, 64) - 40).argmin())
+
+    rendered = [normalize_to_uint8(frame, dataset) for frame in frames]
+
+    # 40 HU sits mid-window for the 40/80 soft-tissue window; the 400/800 bone window would render it near black.
+    for frame in rendered:
+        assert 100 <= frame[0, column_at_40_hu] <= 160
+        assert frame[0, 0] == 0 and frame[0, -1] == 255
+
+
+def test_frames_with_different_content_share_the_window_scaling():
+    # The first frame spans the whole HU range; the second only 20-60 HU, all of it inside the 40/80 window.
+    full = np.broadcast_to(np.linspace(0, 2024, 64).round(), (64, 64))
+    narrow = np.broadcast_to(np.linspace(1044, 1084, 64).round(), (64, 64))
+    volume = np.stack([full, narrow]).astype(np.uint16)
+    dataset = pydicom.dcmread(io.BytesIO(make_study(frames=2, volume=volume)))
+
+    full_frame, narrow_frame = (normalize_to_uint8(frame, dataset) for frame in dataset.pixel_array)
+
+    # 20 HU and 60 HU sit a quarter of the way in from either edge of the window, not at black and white.
+    assert 50 <= narrow_frame[0, 0] <= 80
+    assert 175 <= narrow_frame[0, -1] <= 205
+    column_at_40_hu = int(np.abs(np.linspace(-1024, 1000, 64) - 40).argmin())
+    assert abs(int(full_frame[0, column_at_40_hu]) - int(narrow_frame[0, 32])) <= 16
+
+
+def test_convert_dicom_to_jpeg_bytes_tiles_selected_frames():
+    study = make_study(frames=8, window_center=[40, 400], window_width=[80, 800])
+
+    with Image.open(io.BytesIO(convert_dicom_to_jpeg_bytes(study, max_frames=4))) as image:
+        assert image.format == "JPEG"
+        assert image.size == (128, 128)
@@ -0,0 +1,74 @@
+import io
+import numpy as np
+import benchmark
+from PIL import Image, ImageDraw, ImageFont
+from image_classifier import classify_image
+
+
+def encode(image: Image.Image, format: str = "JPEG") -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def make_report_on_dark_background() -> bytes:
+    """A report photographed on a dark desk, with the page filling only the middle of the frame."""
+    photo = Image.new("RGB", (3000, 4000), (45, 35, 30))
+    page = Image.open(io.BytesIO(benchmark.make_report_image()))
+    photo.paste(page.resize((1800, 2400)), (600, 800))
+    return encode(photo)
+
+
+def make_orange_ball() -> bytes:
+    """A round, evenly lit orange object on black: fundus-shaped, but with no optic disc."""
+    size = 1600
+    y, x = np.ogrid[:size, :size]
+    radius = np.hypot(x - size / 2, y - size / 2) / (size / 2)
+    level = np.where(radius < 0.95, 200 - 40 * radius + np.random.default_rng(1).normal(0, 5, (size, size)), 8)
+    return encode(Image.fromarray(np.stack([level, level * 0.55, level * 0.25], axis=-1).clip(0, 255).astype(np.uint8)))
+
+
+def make_screenshot(lines: list) -> bytes:
+    """A phone screenshot: text on a flat white screen under a coloured app bar."""
+    image = Image.new("RGB", (1170, 2532), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, 1170, 220), fill=(30, 100, 220))
+    font = ImageFont.load_default(size=34)
+    for i, line in enumerate(lines):
+        draw.text((40, 280 + i * 80), line, fill="black", font=font)
+    return encode(image, "PNG")
+
+
+def make_letter() -> bytes:
+    """A scanned A4 letter with nothing medical in it, printed like a report."""
+    image = Image.new("RGB", (1240, 1754), "white")
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=22)
+    lines = ["Dear Tenant,", "", "This is a reminder that the rent for March is due on the 1st.",
+             "Please pay by bank transfer to the account on file.", "Late payments incur a fee of 25.00.",
+             "", "Kind regards,", "The Property Manager"]
+    for i, line in enumerate(lines * 6):
+        draw.text((120, 150 + i * 32), line, fill="black", font=font)
+    return encode(image)
+
+
+def test_a_photographed_report_is_left_to_the_model():
+    assert classify_image(benchmark.make_report_image())[0] is None
+
+
+def test_a_fundus_photo_is_classified_locally():
+    assert classify_image(benchmark.make_scan_image())[0] == "FALSE"
+
+
+def test_anything_else_is_left_to_the_model():
+    assert classify_image(encode(Image.new("RGB", (800, 600), (90, 140, 200))))[0] is None
+    assert classify_image(encode(Image.new("RGB", (800, 800), "white")))[0] is None
+    assert classify_image(b"not an image") == (None, {})
+
+
+def test_lookalikes_are_left_to_the_model():
+    assert classify_image(make_report_on_dark_background())[0] is None
+    assert classify_image(make_letter())[0] != "TRUE"
+    assert classify_image(make_orange_ball())[0] is None
+    assert classify_image(make_screenshot(["Messages", "Contact name", "Last message preview"] * 8))[0] is None
+    assert classify_image(make_screenshot(benchmark.REPORT_LINES * 3))[0] is None
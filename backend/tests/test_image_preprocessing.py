@@ -0,0 +1,59 @@
+import io
+from PIL import Image, ImageCms
+from image_preprocessing import EXIF_ORIENTATION, IMAGE_PROFILES, preprocess_image
+
+
+def encode(image: Image.Image, format: str = "JPEG", **kwargs) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format, **kwargs)
+    return buffer.getvalue()
+
+
+def test_a_sideways_phone_photo_is_oriented_stripped_and_downsized():
+    exif = Image.Exif()
+    exif[EXIF_ORIENTATION] = 6  # stored landscape, displayed portrait
+    exif[0x010F] = "PhoneMaker"
+    photo = encode(Image.new("RGB", (4000, 3000), "white"), exif=exif, quality=95)
+
+    processed, outcome = preprocess_image(photo, "document")
+
+    assert outcome == "reencoded"
+    with Image.open(io.BytesIO(processed)) as image:
+        assert image.format == "JPEG"
+        assert image.size == (1536, 2048)
+        assert not image.getexif()
+
+
+def test_an_image_that_already_fits_is_left_alone():
+    small = encode(Image.new("RGB", (800, 600), "white"), quality=85)
+    assert preprocess_image(small, "scan") == (small, "unchanged")
+
+
+def test_transparency_is_flattened_onto_white():
+    png = encode(Image.new("RGBA", (3000, 3000), (255, 0, 0, 0)), "PNG")
+    processed, outcome = preprocess_image(png, "scan")
+    assert outcome == "reencoded"
+    with Image.open(io.BytesIO(processed)) as image:
+        assert image.mode == "RGB"
+        assert max(image.size) == IMAGE_PROFILES["scan"]["max_dimension"]
+        assert min(image.getpixel((10, 10))) > 245
+
+
+def test_undecodable_bytes_are_uploaded_as_they_are():
+    assert preprocess_image(b"not an image", "document") == (b"not an image", "undecodable")
+
+
+def test_an_icc_profile_is_kept_only_when_the_color_mode_is():
+    srgb = ImageCms.ImageCmsProfile(ImageCms.createProfile("sRGB")).tobytes()
+    rgb = encode(Image.new("RGB", (4000, 3000), (200, 120, 90)), icc_profile=srgb)
+    cmyk = encode(Image.new("CMYK", (4000, 3000), (0, 60, 80, 10)), icc_profile=b"cmyk profile")
+
+    rgb_result, _ = preprocess_image(rgb, "scan")
+    cmyk_result, outcome = preprocess_image(cmyk, "scan")
+
+    with Image.open(io.BytesIO(rgb_result)) as image:
+        assert image.info.get("icc_profile") == srgb
+    assert outcome == "reencoded"
+    with Image.open(io.BytesIO(cmyk_result)) as image:
+        assert image.mode == "RGB"
+        assert "icc_profile" not in image.info
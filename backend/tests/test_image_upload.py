@@ -0,0 +1,51 @@
+import asyncio
+import agentic_workflow
+import benchmark
+import image_classifier
+from agentic_workflow import get_app
+
+
+def diagnose(user_id: str, file_bytes: bytes, file_name: str, input_type: str = "image") -> dict:
+    return asyncio.run(get_app().ainvoke({
+        "user_id": user_id, "file_bytes": file_bytes, "file_name": file_name, "input_type": input_type
+    }))
+
+
+def record_profile_fetches(monkeypatch) -> list:
+    fetched = []
+
+    async def afetch_user_profile(user_id):
+        fetched.append(user_id)
+        return None
+
+    monkeypatch.setattr(agentic_workflow, "afetch_user_profile", afetch_user_profile)
+    return fetched
+
+
+def test_an_unsupported_upload_does_not_prefetch_the_profile(monkeypatch):
+    fetched = record_profile_fetches(monkeypatch)
+    final_state = diagnose("upload-docx", b"PK", "notes.docx", input_type="docx")
+    assert final_state.get("error_message")
+    assert fetched == []
+
+
+def test_an_accepted_upload_prefetches_the_profile(fake_backend, monkeypatch):
+    monkeypatch.setattr(image_classifier, "LOCAL_IMAGE_CLASSIFIER", False)
+    fetched = record_profile_fetches(monkeypatch)
+    final_state = diagnose("upload-prefetch", benchmark.make_scan_image(), "fundus.jpg")
+    assert final_state.get("past_profile_loaded")
+    assert fetched == ["upload-prefetch"]
+
+
+def test_a_scan_the_model_classifies_is_uploaded_once(fake_backend, monkeypatch):
+    monkeypatch.setattr(image_classifier, "LOCAL_IMAGE_CLASSIFIER", False)
+    final_state = diagnose("upload-scan", benchmark.make_scan_image(), "fundus.jpg")
+    assert final_state.get("final_response") and not final_state.get("error_message")
+    assert len(fake_backend.image_types) == 1
+
+
+def test_a_report_the_model_classifies_is_uploaded_once(fake_backend, monkeypatch):
+    monkeypatch.setattr(image_classifier, "LOCAL_IMAGE_CLASSIFIER", False)
+    final_state = diagnose("upload-report", benchmark.make_report_image(), "report.jpg")
+    assert final_state.get("final_response") and not final_state.get("error_message")
+    assert len(fake_backend.image_types) == 1
@@ -0,0 +1,158 @@
+import asyncio
+import time
+import pytest
+import api
+from admission import AdmissionController
+from job_queue import JobQueue, MemoryJobStore, QueueFull, QueueNotRunning, SQLiteJobStore
+
+
+def test_submissions_beyond_the_bound_are_refused():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(payload):
+            await release.wait()
+            return {"file": payload["file_name"]}
+
+        queue = JobQueue(handler, MemoryJobStore(), workers=1, max_pending=2)
+        await queue.start()
+        first = await queue.submit({"file_name": "a.pdf"})
+        await queue.submit({"file_name": "b.pdf"})
+        with pytest.raises(QueueFull):
+            await queue.submit({"file_name": "c.pdf"})
+        release.set()
+        await queue._queue.join()
+        await queue.submit({"file_name": "c.pdf"})
+        await queue._queue.join()
+        await queue.stop()
+        return queue, first
+
+    queue, first = asyncio.run(scenario())
+    assert queue.get(first)["result"] == {"file": "a.pdf"}
+    assert queue.pending == 0
+
+
+def test_submitting_before_the_queue_starts_is_refused():
+    async def handler(payload):
+        return {}
+
+    queue = JobQueue(handler, MemoryJobStore(), workers=1)
+    with pytest.raises(QueueNotRunning):
+        asyncio.run(queue.submit({"file_name": "a.pdf"}))
+    assert queue.pending == 0
+
+
+def test_store_writes_do_not_block_the_event_loop():
+    class SlowStore(MemoryJobStore):
+        def create(self, job_id, payload):
+            time.sleep(0.2)
+            super().create(job_id, payload)
+
+    async def scenario():
+        async def handler(payload):
+            return {}
+
+        queue = JobQueue(handler, SlowStore(), workers=1)
+        await queue.start()
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await queue.submit({"file_name": "a.pdf"})
+        ticker.cancel()
+        await queue._queue.join()
+        await queue.stop()
+        return ticks
+
+    assert asyncio.run(scenario()) >= 5
+
+
+def test_queued_jobs_survive_a_restart_with_their_upload(tmp_path):
+    store_path = str(tmp_path / "jobs.sqlite3")
+    received = []
+
+    async def handler(payload):
+        received.append(payload)
+        return {"ok": True}
+
+    async def restart():
+        queue = JobQueue(handler, SQLiteJobStore(store_path), workers=1)
+        await queue.start()
+        await queue._queue.join()
+        await queue.stop()
+        return queue
+
+    async def submit_without_workers():
+        queue = JobQueue(handler, SQLiteJobStore(store_path), workers=0)
+        await queue.start()
+        return await queue.submit({"user_id": "u1", "file_bytes": b"%PDF-1.4"})
+
+    job_id = asyncio.run(submit_without_workers())
+    queue = asyncio.run(restart())
+    assert received == [{"user_id": "u1", "file_bytes": b"%PDF-1.4"}]
+    assert queue.get(job_id)["status"] == "succeeded"
+
+
+def test_jobs_wait_for_an_admission_slot(monkeypatch):
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, retry_after_seconds=0.01)
+        monkeypatch.setattr(api, "admission", controller)
+
+        async def run_workflow(initial_state):
+            return {"in_flight": controller.in_flight}
+
+        monkeypatch.setattr(api, "run_workflow", run_workflow)
+        release = controller.admit("someone-else")
+        job = asyncio.create_task(api.run_job({"user_id": "u1", "input_type": "pdf", "file_bytes": b"%PDF"}))
+        await asyncio.sleep(0.05)
+        assert not job.done()
+        release()
+        return await job
+
+    assert asyncio.run(scenario()) == {"in_flight": 1}
+
+
+def test_a_restart_in_the_same_process_counts_leftover_jobs_once():
+    async def scenario():
+        async def handler(payload):
+            return {}
+
+        queue = JobQueue(handler, MemoryJobStore(), workers=0, max_pending=2)
+        await queue.start()
+        await queue.submit({"file_name": "a.pdf"})
+        await queue.stop()
+        await queue.start()
+        pending = queue.pending
+        await queue.submit({"file_name": "b.pdf"})
+        return pending
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_a_store_error_while_recording_a_failure_keeps_the_worker_alive():
+    class FlakyStore(MemoryJobStore):
+        def update(self, job_id, status, **kwargs):
+            if status == "failed":
+                raise OSError("disk full")
+            super().update(job_id, status, **kwargs)
+
+    async def scenario():
+        async def handler(payload):
+            if payload["file_name"] == "bad.pdf":
+                raise ValueError("unreadable")
+            return {"file": payload["file_name"]}
+
+        queue = JobQueue(handler, FlakyStore(), workers=1)
+        await queue.start()
+        await queue.submit({"file_name": "bad.pdf"})
+        second = await queue.submit({"file_name": "good.pdf"})
+        await asyncio.wait_for(queue._queue.join(), timeout=5)
+        await queue.stop()
+        return queue.get(second)
+
+    assert asyncio.run(scenario())["result"] == {"file": "good.pdf"}
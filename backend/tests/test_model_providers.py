@@ -0,0 +1,26 @@
+import pytest
+from fakes import FakeGeminiClient
+from model_providers import ModelRouter
+
+
+def test_the_stub_provider_answers_with_the_fake_client():
+    router = ModelRouter(fast="stub:fast-model", strong="stub:strong-model", overrides="")
+    route = router.route("extract_pdf")
+    assert (route.provider.name, route.model) == ("stub", "fast-model")
+    assert isinstance(route.client, FakeGeminiClient)
+    assert router.route("ada_rag").client is route.client
+
+
+def test_per_task_overrides():
+    router = ModelRouter(fast="stub:fast-model", strong="stub:strong-model",
+                         overrides="identify_image_type=strong, extract_pdf=stub:other-model")
+    assert router.describe()["identify_image_type"] == "stub:strong-model"
+    assert router.describe()["extract_pdf"] == "stub:other-model"
+    assert router.describe()["extract_image"] == "stub:fast-model"
+
+
+def test_corpus_tasks_must_stay_with_the_strong_provider():
+    with pytest.raises(ValueError):
+        ModelRouter(fast="stub:fast-model", strong="stub:strong-model", overrides="ada_rag=gemini:gemini-2.5-pro")
+    with pytest.raises(ValueError):
+        ModelRouter(fast="nowhere:model", strong="stub:strong-model", overrides="")
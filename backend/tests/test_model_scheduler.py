@@ -0,0 +1,69 @@
+import asyncio
+import pytest
+from model_scheduler import ModelCallScheduler
+
+
+class ServerError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+def test_hedged_call_that_finishes_before_the_hedge_returns_its_result():
+    scheduler = ModelCallScheduler(hedge_after_seconds=0.5)
+
+    async def fast_call():
+        return "ok"
+
+    assert asyncio.run(scheduler.arun("extract_pdf", fast_call, hedge=True)) == "ok"
+    assert scheduler._in_flight == 0
+
+
+def test_hedged_call_that_fails_before_the_hedge_raises_its_error():
+    scheduler = ModelCallScheduler(hedge_after_seconds=0.5, max_retries=0)
+
+    async def failing_call():
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError, match="bad request"):
+        asyncio.run(scheduler.arun("extract_pdf", failing_call, hedge=True))
+
+
+def test_slow_call_is_hedged_and_the_faster_request_wins():
+    scheduler = ModelCallScheduler(hedge_after_seconds=0.05)
+    calls = []
+
+    async def call():
+        calls.append(len(calls))
+        await asyncio.sleep(1 if len(calls) == 1 else 0.01)
+        return len(calls)
+
+    assert asyncio.run(scheduler.arun("extract_pdf", call, hedge=True)) == 2
+    assert len(calls) == 2
+
+
+def test_retryable_errors_are_retried():
+    scheduler = ModelCallScheduler(retry_base_seconds=0.01, retry_max_seconds=0.01)
+    attempts = []
+
+    async def flaky_call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ServerError(503)
+        return "ok"
+
+    assert asyncio.run(scheduler.arun("ada_rag", flaky_call)) == "ok"
+    assert len(attempts) == 3
+
+
+def test_non_retryable_errors_are_raised_straight_away():
+    scheduler = ModelCallScheduler(retry_base_seconds=0.01)
+    attempts = []
+
+    async def bad_call():
+        attempts.append(1)
+        raise ServerError(400)
+
+    with pytest.raises(ServerError):
+        asyncio.run(scheduler.arun("ada_rag", bad_call))
+    assert len(attempts) == 1
@@ -0,0 +1,77 @@
+import pytest
+from benchmark import make_pdf_report
+from pdf_extraction import Ambiguous, extract_clinical_data, parse_report_text
+
+REPORTED_LINES = [
+    ("HbA1c (Glycated Hemoglobin) 6.8 % [4.0 - 5.6] HIGH", "hba1c", 6.8, "%", "high"),
+    ("Glycated Hb 5.2 %", "hba1c", 5.2, "%", "normal"),
+    ("Glycosylated Haemoglobin 7.1 %", "hba1c", 7.1, "%", "high"),
+    ("HbA1c 6.8 % 48 mmol/mol", "hba1c", 6.8, "%", "high"),
+    ("HbA1c (IFCC) 48 mmol/mol 20 - 38", "hba1c", 48, "mmol/mol", "high"),
+    ("Fasting Plasma Glucose 131 mg/dL [70 - 99] HIGH", "fasting_plasma_glucose", 131, "mg/dL", "high"),
+    ("Plasma Glucose (Fasting) 140 mg/dL", "fasting_plasma_glucose", 140, "mg/dL", "high"),
+    ("Glucose - Fasting 140 mg/dL", "fasting_plasma_glucose", 140, "mg/dL", "high"),
+    ("Glucose, Fasting (F) 99 mg/dL 70-99 N", "fasting_plasma_glucose", 99, "mg/dL", "normal"),
+    ("FBS 5.1 mmol/L", "fasting_plasma_glucose", 5.1, "mmol/L", "normal"),
+    ("Blood sugar (random) 250 mg/dl", "random_plasma_glucose", 250, "mg/dL", "high"),
+    ("Random Blood Glucose 110 mg/dL Normal < 140", "random_plasma_glucose", 110, "mg/dL", "normal"),
+    ("OGTT (2 hr) 162 mg/dL", "two_hr_ogtt_glucose", 162, "mg/dL", "high"),
+    ("2 hr Plasma Glucose (75 g, 2 hr) 130 mg/dL", "two_hr_ogtt_glucose", 130, "mg/dL", "normal"),
+    ("Body Mass Index 29.4 kg/m2 [18.5 - 24.9] HIGH", "bmi", 29.4, "kg/m2", "high"),
+    ("Fasting Plasma Glucose [70 - 99] 131 mg/dL", "fasting_plasma_glucose", 131, "mg/dL", "high"),
+    ("HbA1c 4.0 - 5.6 6.8 %", "hba1c", 6.8, "%", "high"),
+    ("Random Blood Glucose Normal < 140  110 mg/dL", "random_plasma_glucose", 110, "mg/dL", "normal"),
+]
+
+# Each of these must send the report to the model rather than lose or misread a value.
+AMBIGUOUS_TEXTS = [
+    "Glucose PP (2 hrs) 210 mg/dL",
+    "Glucose 2 hr PP 190 mg/dL",
+    "Post Prandial Blood Sugar 180 mg/dL",
+    "Serum glucose 140 mg/dL",
+    "HbA1c 6.8 %\nHbA1c (IFCC) 60 mmol/mol",
+    "Fasting Plasma Glucose 120 mg/dL\nFasting Plasma Glucose 131 mg/dL",
+    "HbA1c 15",
+    "Report Date: 03/04/2025",
+    "HbA1c   Pending   (4.0 - 5.6) %",
+    "Fasting Plasma Glucose    [70 - 99] mg/dL",
+    "Random Blood Glucose   NA   Normal: 140 mg/dL",
+    "HbA1c   —   4.0 - 5.6 %",
+    "OGTT (2 hr)   not done   70 - 139 mg/dL",
+]
+
+
+@pytest.mark.parametrize("line, field, value, unit, flag", REPORTED_LINES)
+def test_reads_common_report_phrasing(line, field, value, unit, flag):
+    assert parse_report_text(line)["lab_results"][field] == {"value": value, "unit": unit, "status_flag": flag}
+
+
+@pytest.mark.parametrize("text", AMBIGUOUS_TEXTS)
+def test_unclear_results_are_left_to_the_model(text):
+    with pytest.raises(Ambiguous):
+        parse_report_text(text)
+
+
+def test_the_same_result_in_both_units_is_one_reading():
+    text = "HbA1c (NGSP) 6.8 %\nHbA1c (IFCC) 48 mmol/mol\nFasting Glucose 7.8 mmol/L\nFasting Glucose 140 mg/dL"
+    lab_results = parse_report_text(text)["lab_results"]
+    assert lab_results["hba1c"]["value"] == 6.8
+    assert lab_results["fasting_plasma_glucose"] == {"value": 140, "unit": "mg/dL", "status_flag": "high"}
+
+
+def test_patient_details():
+    text = "Patient Name : Jane Doe    Age: 52    Sex: F\nReport Date: 14-Mar-2025\nCollected on 12/03/2025"
+    patient_info = parse_report_text(text)["patient_info"]
+    assert patient_info == {"name": "Jane Doe", "age_years": 52, "gender": "Female", "report_date": "2025-03-14"}
+
+
+def test_extracts_a_text_layer_pdf_locally():
+    data, outcome = extract_clinical_data(make_pdf_report())
+    assert outcome == "local"
+    assert data["lab_results"]["hba1c"] == {"value": 6.8, "unit": "%", "status_flag": "high"}
+    assert data["patient_info"]["report_date"] == "2025-03-14"
+
+
+def test_a_report_without_a_glycaemic_result_goes_to_the_model():
+    data, outcome = extract_clinical_data(make_pdf_report(), required="two_hr_ogtt_glucose")
+    assert data is None and outcome == "missing_fields"
@@ -0,0 +1,63 @@
+import asyncio
+from profile_cache import MemoryProfileStore, ProfileCache, SQLiteProfileStore
+
+
+def fetch_returning(profile, started=None, release=None):
+    async def fetch():
+        if started is not None:
+            started.set()
+            await release.wait()
+        return profile
+    return fetch
+
+
+def test_concurrent_reads_share_one_fetch():
+    cache = ProfileCache(MemoryProfileStore())
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": "u1"}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.aget_or_fetch("u1", fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == [{"id": "u1"}] * 5
+    assert calls == [1]
+    assert cache.lookup("u1") == (True, {"id": "u1"})
+
+
+def test_a_fetch_that_started_before_a_write_does_not_overwrite_it():
+    cache = ProfileCache(MemoryProfileStore())
+
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+        read = asyncio.ensure_future(cache.aget_or_fetch("u1", fetch_returning({"visit": 1}, started, release)))
+        await started.wait()
+        cache.write_through("u1", {"visit": 2})
+        release.set()
+        return await read
+
+    assert asyncio.run(scenario()) == {"visit": 1}
+    assert cache.lookup("u1") == (True, {"visit": 2})
+
+
+def test_a_write_in_another_process_stops_a_stale_fill(tmp_path):
+    path = str(tmp_path / "profiles.sqlite3")
+    # Two workers on one host: separate caches, each with its own connection to the shared file.
+    this_worker, other_worker = ProfileCache(SQLiteProfileStore(path)), ProfileCache(SQLiteProfileStore(path))
+
+    generation = this_worker.generation("u1")
+    other_worker.write_through("u1", {"visit": 2})
+    this_worker.fill("u1", {"visit": 1}, generation)
+
+    assert this_worker.lookup("u1") == (True, {"visit": 2})
+    assert this_worker.generation("u1") == other_worker.generation("u1") == 1
+
+
+def test_generations_are_kept_with_caching_off():
+    cache = ProfileCache(None)
+    cache.write_through("u1", {"visit": 1})
+    assert cache.generation("u1") == 1
+    assert cache.lookup("u1") == (False, None)
@@ -0,0 +1,43 @@
+import asyncio
+import pytest
+import benchmark
+import fakes
+import utils
+
+
+class ProfileReadError(Exception):
+    code = "57014"
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    writes = []
+
+    async def record_upsert(user_id, structured_data, diagnosis):
+        writes.append((user_id, structured_data))
+
+    monkeypatch.setattr(utils, "aupsert_user_profile", record_upsert)
+    return writes
+
+
+def fetch_failing_with(error):
+    async def fetch(user_id):
+        raise error
+    return fetch
+
+
+def test_a_failed_profile_read_does_not_overwrite_the_history(fake_backend, monkeypatch, stored):
+    monkeypatch.setattr(utils, "afetch_user_profile", fetch_failing_with(ProfileReadError("statement timeout")))
+    diagnosis = asyncio.run(utils.arag_from_corpus("u1", fakes.SAMPLE_CLINICAL_DATA))
+    scan_diagnosis = asyncio.run(utils.avlm_analysis_for_scans("u1", benchmark.make_scan_image(), "fundus.jpg"))
+    assert diagnosis["final_diagnosis"] and scan_diagnosis["final_diagnosis"]
+    assert stored == []
+
+
+def test_a_user_without_a_profile_gets_one(fake_backend, monkeypatch, stored):
+    async def no_profile(user_id):
+        return None
+
+    monkeypatch.setattr(utils, "afetch_user_profile", no_profile)
+    asyncio.run(utils.arag_from_corpus("u1", fakes.SAMPLE_CLINICAL_DATA))
+    assert stored == [("u1", fakes.SAMPLE_CLINICAL_DATA)]
@@ -0,0 +1,76 @@
+from profile_outbox import ProfileOutbox
+
+
+class FlakyDatabase:
+    def __init__(self, failing_users=()):
+        self.failing_users = set(failing_users)
+        self.requests = []
+
+    def write_rows(self, rows):
+        self.requests.append([row["id"] for row in rows])
+        if any(row["id"] in self.failing_users for row in rows):
+            raise ConnectionError("database unavailable")
+
+
+def make_outbox(tmp_path, database, **kwargs):
+    outbox = ProfileOutbox(database.write_rows, path=str(tmp_path / "outbox.sqlite3"), retry_base_seconds=0, **kwargs)
+    # Flushed by hand in these tests rather than by the background thread.
+    outbox.start = lambda: None
+    return outbox
+
+
+def test_a_newer_write_replaces_the_pending_one(tmp_path):
+    database = FlakyDatabase()
+    outbox = make_outbox(tmp_path, database)
+    outbox.enqueue("u1", {"id": "u1", "visit": 1})
+    outbox.enqueue("u1", {"id": "u1", "visit": 2})
+    assert outbox.pending_row("u1") == {"id": "u1", "visit": 2}
+    assert outbox.flush() == 1
+    assert database.requests == [["u1"]]
+    assert outbox.pending_row("u1") is None
+
+
+def test_one_failing_row_does_not_hold_back_the_batch(tmp_path):
+    database = FlakyDatabase(failing_users={"u2"})
+    outbox = make_outbox(tmp_path, database)
+    for user_id in ("u1", "u2", "u3"):
+        outbox.enqueue(user_id, {"id": user_id})
+    assert outbox.flush() == 2
+    assert outbox.stats()["pending"] == 1
+    assert outbox.pending_row("u2") == {"id": "u2"}
+
+
+def test_dead_rows_are_not_served_as_pending(tmp_path):
+    database = FlakyDatabase(failing_users={"u1"})
+    outbox = make_outbox(tmp_path, database, max_attempts=2)
+    outbox.enqueue("u1", {"id": "u1"})
+    outbox.flush()
+    outbox.flush()
+    assert outbox.stats()["dead"] == 1
+    assert outbox.pending_row("u1") is None
+
+    database.failing_users.clear()
+    outbox.enqueue("u1", {"id": "u1", "visit": 2})
+    assert outbox.pending_row("u1") == {"id": "u1", "visit": 2}
+    assert outbox.flush() == 1
+
+
+def test_undelivered_rows_survive_a_restart(tmp_path):
+    database = FlakyDatabase()
+    make_outbox(tmp_path, database).enqueue("u1", {"id": "u1"})
+    assert database.requests == []
+    assert make_outbox(tmp_path, database).flush() == 1
+
+
+def test_giving_up_on_a_write_reports_the_user(tmp_path):
+    database = FlakyDatabase(failing_users={"u1"})
+    abandoned = []
+    outbox = make_outbox(tmp_path, database, max_attempts=2, on_dead=abandoned.append)
+    outbox.enqueue("u1", {"id": "u1"})
+    outbox.flush()
+    assert abandoned == ["u1"] and outbox.stats()["dead"] == 1
+
+
+def test_the_outbox_is_opt_in():
+    from profile_outbox import create_profile_outbox
+    assert create_profile_outbox(FlakyDatabase().write_rows) is None
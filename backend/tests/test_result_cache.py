@@ -0,0 +1,23 @@
+import asyncio
+import benchmark
+import utils
+from result_cache import LRUResultCache, ResultCache
+
+
+def test_hits_and_misses_are_counted_per_task():
+    cache = ResultCache(LRUResultCache())
+    assert cache.get("extract_pdf", "a") is None
+    cache.set("a", {"lab_results": {}})
+    assert cache.get("extract_pdf", "a") == {"lab_results": {}}
+    assert cache.stats()["hits"] == {"extract_pdf": 1}
+    assert cache.stats()["misses"] == {"extract_pdf": 1}
+
+
+def test_a_pdf_read_locally_is_not_a_miss(fake_backend):
+    for _ in range(2):
+        data = asyncio.run(utils.aextract_patient_parameters_from_pdf(benchmark.make_pdf_report()))
+        assert data["lab_results"]["hba1c"]["value"] == 6.8
+    stats = utils.result_cache.stats()
+    assert stats["local"] == {"extract_pdf": 2}
+    assert stats["misses"] == {"extract_pdf": 0}
+    assert fake_backend.calls["generate"] == 0
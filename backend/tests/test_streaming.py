@@ -0,0 +1,60 @@
+import asyncio
+import json
+import pytest
+import api
+import benchmark
+import fakes
+from streaming import PartialJSONFieldParser, format_sse
+
+
+def feed_in_chunks(text: str, size: int) -> list:
+    parser = PartialJSONFieldParser()
+    fields = []
+    for start in range(0, len(text), size):
+        fields.extend(parser.feed(text[start:start + size]))
+    return fields
+
+
+def test_fields_are_yielded_once_complete_whatever_the_chunking():
+    document = {"summary": "Meets the \"ADA\" thresholds, {see below}", "analysis": [{"a": 1}],
+                "confidence_score": {"score": 85}, "flag": True, "score": 12.5, "note": None}
+    text = json.dumps(document, indent=1)
+    for size in (1, 3, 7, len(text)):
+        assert feed_in_chunks(text, size) == list(document.items())
+
+
+def test_a_trailing_number_waits_for_its_next_character():
+    parser = PartialJSONFieldParser()
+    assert parser.feed('{"score": 8') == []
+    assert parser.feed('5, "label": "x"}') == [("score", 85), ("label", "x")]
+
+
+def test_a_response_that_is_not_an_object_is_rejected():
+    parser = PartialJSONFieldParser()
+    with pytest.raises(ValueError):
+        parser.feed('["summary"]')
+
+
+def parse_sse(chunks: list) -> list:
+    events = []
+    for chunk in chunks:
+        event, data = chunk.strip().split("\n", 1)
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_citations_are_only_sent_with_the_final_response(fake_backend):
+    async def collect():
+        initial_state = {"user_id": "stream-user", "file_bytes": benchmark.make_pdf_report(), "file_name": "report.pdf",
+                         "input_type": "pdf", "stream_diagnosis": True}
+        return [chunk async for chunk in api.stream_workflow(initial_state)]
+
+    chunks = asyncio.run(collect())
+    events = parse_sse(chunks)
+    streamed = [data["field"] for event, data in events if event == "diagnosis_field"]
+    assert "summary" in streamed and "citations" not in streamed
+    final_index = next(i for i, (event, _) in enumerate(events) if event == "final_response")
+    unresolved = fakes.SAMPLE_DIAGNOSIS["citations"][0]["reference"]
+    assert not any("citations" in chunk or unresolved in chunk for chunk in chunks[:final_index])
+    assert events[final_index][1]["citations"]
+    assert format_sse("done", {}) == "event: done\ndata: {}\n\n"
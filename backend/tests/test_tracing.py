@@ -0,0 +1,16 @@
+import asyncio
+from tracing import end_trace, start_trace, traced_node
+
+
+def test_node_spans_use_the_registered_name():
+    async def entry_point_node(state):
+        return {"seen": state["value"]}
+
+    async def run():
+        token = start_trace()
+        result = await traced_node("entry_point", entry_point_node)({"value": 1})
+        return result, end_trace(token)
+
+    result, trace = asyncio.run(run())
+    assert result == {"seen": 1}
+    assert [(s["category"], s["name"]) for s in trace.spans] == [("node", "entry_point")]
@@ -0,0 +1,49 @@
+import asyncio
+import httpx
+import api
+
+PART_HEADER = (b'--abc\r\nContent-Disposition: form-data; name="file"; filename="scan.png"\r\n'
+               b'Content-Type: image/png\r\n\r\n')
+
+
+def post_chunked(monkeypatch, total_bytes):
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(api, "MULTIPART_OVERHEAD_BYTES", 256)
+
+    async def body():
+        yield PART_HEADER
+        for _ in range(total_bytes // 512):
+            yield b"x" * 512
+
+    async def post():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/diagnose", content=body(),
+                                     headers={"content-type": "multipart/form-data; boundary=abc",
+                                              "origin": "https://dashboard.example"})
+
+    return asyncio.run(post())
+
+
+def test_a_chunked_upload_over_the_limit_is_rejected(monkeypatch):
+    response = post_chunked(monkeypatch, 64 * 1024)
+    assert "content-length" not in response.request.headers
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Upload exceeds the 1024 byte limit."
+    assert response.headers["access-control-allow-origin"] == "https://dashboard.example"
+
+
+def test_a_declared_length_over_the_limit_is_rejected_up_front(monkeypatch):
+    monkeypatch.setattr(api, "MAX_UPLOAD_BYTES", 1024)
+    monkeypatch.setattr(api, "MULTIPART_OVERHEAD_BYTES", 256)
+
+    async def post():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/diagnose", content=b"x" * 4096,
+                                     headers={"content-type": "multipart/form-data; boundary=abc",
+                                              "origin": "https://dashboard.example"})
+
+    response = asyncio.run(post())
+    assert response.status_code == 413
+    assert response.headers["access-control-allow-origin"] == "https://dashboard.example"
@@ -0,0 +1,138 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class RequestTrace:
+    """Collects the spans recorded while handling a single request."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.spans = []
+
+    def add(self, category: str, name: str, duration: float, attrs: dict):
+        self.spans.append({"category": category, "name": name, "duration_ms": round(duration * 1000, 1), **attrs})
+
+    def server_timing(self) -> str:
+        totals = {}
+        for s in self.spans:
+            key = f"{s['category']}.{s['name']}"
+            totals[key] = totals.get(key, 0) + s["duration_ms"]
+        entries = [f"{key};dur={duration:.1f}" for key, duration in totals.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+
+class MetricsRegistry:
+    """A small Prometheus-compatible registry, so metrics need no extra dependency."""
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+
+    def observe_duration(self, category: str, name: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.setdefault((category, name), {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += seconds
+            histogram["count"] += 1
+
+    def inc(self, metric: str, labels: dict, value: float = 1):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP glycosight_span_duration_seconds Wall time of workflow nodes, model calls, uploads and database calls.",
+            "# TYPE glycosight_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (category, name), histogram in sorted(self._histograms.items()):
+                labels = f'category="{category}",name="{name}"'
+                for bound, count in zip(self.buckets, histogram["buckets"]):
+                    lines.append(f'glycosight_span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'glycosight_span_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram["count"]}')
+                lines.append(f"glycosight_span_duration_seconds_sum{{{labels}}} {histogram['sum']}")
+                lines.append(f"glycosight_span_duration_seconds_count{{{labels}}} {histogram['count']}")
+
+            seen_metrics = set()
+            for (metric, labels), value in sorted(self._counters.items()):
+                if metric not in seen_metrics:
+                    lines.append(f"# TYPE {metric} counter")
+                    seen_metrics.add(metric)
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+_current_trace: ContextVar = ContextVar("glycosight_trace", default=None)
+
+
+def start_trace():
+    return _current_trace.set(RequestTrace())
+
+
+def end_trace(token) -> RequestTrace:
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+@contextmanager
+def span(category: str, name: str, **attrs):
+    """Times the enclosed block into the metrics registry and, when a request is being traced, into its trace."""
+    start = time.perf_counter()
+    try:
+        yield attrs
+    except Exception:
+        metrics.inc("glycosight_span_errors_total", {"category": category, "name": name})
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.observe_duration(category, name, duration)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(category, name, duration, attrs)
+
+
+def traced_node(name: str, node):
+    """Wraps a graph node in a span named after the node as registered, which needn't match the function's name."""
+    @functools.wraps(node)
+    async def wrapper(state):
+        with span("node", name):
+            return await node(state)
+    return wrapper
+
+
+def record_tokens(task: str, usage_metadata) -> dict:
+    if usage_metadata is None:
+        return {}
+    prompt_tokens = usage_metadata.prompt_token_count or 0
+    cached_tokens = usage_metadata.cached_content_token_count or 0
+    counts = {
+        "input": prompt_tokens - cached_tokens,
+        "cached": cached_tokens,
+        "output": usage_metadata.candidates_token_count or 0,
+    }
+    for kind, value in counts.items():
+        metrics.inc("glycosight_model_tokens_total", {"task": task, "kind": kind}, value)
+    return {f"{kind}_tokens": value for kind, value in counts.items()}
+
+
+def record_payload(kind: str, size_bytes: int):
+    metrics.inc("glycosight_payload_bytes_total", {"kind": kind}, size_bytes)
+    metrics.inc("glycosight_payloads_total", {"kind": kind})
@@ -1,33 +1,151 @@
-from google import genai
 from google.genai import types
 import os
 from dotenv import load_dotenv
 import pathlib
 import json
-from prompts import patient_json_maker_prompt, is_image_prompt, final_rag_prompt, visual_rag_prompt
-from schemas import DiabetesClinicalData, RAGDiagnosisResponse
-import pydicom
+import io
+from prompts import patient_json_maker_prompt, is_image_prompt, fused_image_prompt, final_rag_prompt, retrieved_corpus_prompt
+from schemas import DiabetesClinicalData, RAGDiagnosisResponse, ImageClassificationWithData
 from PIL import Image
-from supabase import create_client, Client
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 import copy
+from types import SimpleNamespace
+import asyncio
+import threading
+from corpus import CorpusRegistry
+from context_cache import ContextCacheManager
+from result_cache import ResultCache, create_result_cache, file_sha256, prompt_version
+from profile_cache import create_profile_cache, is_missing_profile
+from profile_outbox import create_profile_outbox
+from tracing import span, record_tokens, record_payload
+import http_transport
+from model_scheduler import ModelCallScheduler
+from model_providers import ModelRouter, GEMINI_TIMEOUT_SECONDS
+import pdf_extraction
+import image_preprocessing
+import image_classifier
+from corpus_index import CorpusIndex, format_passages, resolve_citations
 load_dotenv()
 
-api_key = os.getenv("GEMINI_API_KEY")
-client = genai.Client(api_key=api_key)
-MODEL = "gemini-2.5-flash-preview-05-20"
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/"
+# Per-call deadlines; short tasks fail fast instead of holding a connection for the full default.
+MODEL_CALL_TIMEOUTS = {
+    "identify_image_type": 30,
+    "extract_pdf": 60,
+    "extract_image": 60,
+    "classify_and_extract_image": 60,
+}
+# Short, non-streamed calls that may be hedged by the scheduler; RAG answers are too long to send twice.
+HEDGED_TASKS = {"identify_image_type", "extract_pdf", "extract_image", "classify_and_extract_image"}
 
+# Clients are built on first use rather than at import, so cold starts that never reach the model
+# (health checks, job polling, metrics) don't pay for the Gemini and Supabase SDKs.
+_supabase = None
+_async_supabase = None
+_client_lock = threading.Lock()
+_async_supabase_lock = asyncio.Lock()
+
+
+model_router = ModelRouter()
+
+
+def get_client():
+    """The default provider's client, which also holds the guideline corpus and its context caches."""
+    return model_router.default_provider.get_client()
+
+
+def get_supabase():
+    global _supabase
+    if _supabase is None:
+        with _client_lock:
+            if _supabase is None:
+                from supabase import create_client, ClientOptions
+                _supabase = create_client(
+                    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"),
+                    options=ClientOptions(httpx_client=http_transport.get_sync_http_client())
+                )
+    return _supabase
+
+
+async def get_async_supabase():
+    global _async_supabase
+    if _async_supabase is None:
+        async with _async_supabase_lock:
+            if _async_supabase is None:
+                from supabase import acreate_client, AsyncClientOptions
+                _async_supabase = await acreate_client(
+                    os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_SERVICE_KEY"),
+                    options=AsyncClientOptions(httpx_client=http_transport.get_async_http_client())
+                )
+    return _async_supabase
+
+
+async def awarm_up_connections():
+    get_client()
+    await get_async_supabase()
+    await http_transport.awarm_up([GEMINI_BASE_URL, os.getenv("SUPABASE_URL")])
+
+
+corpus_registry = CorpusRegistry(get_client)
+context_cache = ContextCacheManager(model_router.route, corpus_registry)
+corpus_index = CorpusIndex()
+result_cache = create_result_cache()
+profile_cache = create_profile_cache()
+
+
+def _write_profile_rows(rows: list):
+    with span("supabase", "upsert_user_profile", rows=len(rows)):
+        get_supabase().table('user_health_profiles').upsert(rows).execute()
 
-def fetch_user_profile(user_id: str):
-    try:
-        response = supabase.table('user_health_profiles').select('*').eq('id', user_id).single().execute()
-    except Exception as e:
-        response = f"No past records found for this user. Here's the error: {e}"
 
-    return response.data
+def _profile_write_abandoned(user_id: str):
+    # The cache was written through with a row that never reached the database.
+    profile_cache.invalidate(user_id)
+
+
+profile_outbox = create_profile_outbox(_write_profile_rows, _profile_write_abandoned)
+model_scheduler = ModelCallScheduler()
+
+
+async def awarm_up_static_context():
+    """Uploads and caches the corpora that are still sent whole; with the retrieval index, ADA no longer is."""
+    keys = [key for key in context_cache.prefixes if not (key == "ada_rag" and corpus_index.available())]
+    await corpus_registry.awarm_up([context_cache.prefixes[key][0] for key in keys])
+    await context_cache.awarm_up(keys)
+
+
+def use_clients(gemini_client=None, supabase_client=None, async_supabase_client=None):
+    """Swaps in other model/Supabase clients, such as the local stand-ins used by benchmark.py."""
+    global _supabase, _async_supabase
+    if gemini_client is not None:
+        for task in model_router.targets:
+            model_router.route(task).provider.set_client(gemini_client)
+    if supabase_client is not None:
+        _supabase = supabase_client
+    if async_supabase_client is not None:
+        _async_supabase = async_supabase_client
+
+
+# Passed by callers that haven't read the user's profile yet; None means they read it and there isn't one.
+PROFILE_NOT_LOADED = object()
+
+
+async def afetch_user_profile(user_id: str):
+    async def fetch():
+        if profile_outbox is not None and (pending := await asyncio.to_thread(profile_outbox.pending_row, user_id)):
+            return pending
+        async_supabase = await get_async_supabase()
+        try:
+            with span("supabase", "fetch_user_profile"):
+                response = await async_supabase.table('user_health_profiles').select('*').eq('id', user_id).single().execute()
+        except Exception as e:
+            if is_missing_profile(e):
+                return None
+            raise
+        return response.data
+
+    return await profile_cache.aget_or_fetch(user_id, fetch)
 
 
 def _get_report_date(data: dict):
@@ -75,24 +193,185 @@ def merge_clinical_data(existing_data: dict, new_data: dict):
     return merged
 
 
-def upsert_user_profile(user_id: str, final_structured_data: dict, final_diagnostic_response: dict):
+def _upserted_row(response, data_to_upsert: dict) -> dict:
+    """The row as stored (with the real updated_at), falling back to what was sent if it wasn't returned."""
+    rows = getattr(response, "data", None)
+    if rows:
+        return rows[0]
+    return {**data_to_upsert, "updated_at": datetime.now(timezone.utc).isoformat()}
+
+
+def _enqueue_profile_write(user_id: str, data_to_upsert: dict):
+    # Stamped now rather than by the database, since the row may only be flushed later.
+    row = {**data_to_upsert, 'updated_at': datetime.now(timezone.utc).isoformat()}
+    profile_outbox.enqueue(user_id, row)
+    profile_cache.write_through(user_id, row)
+
+
+async def aupsert_user_profile(user_id: str, final_structured_data: dict, final_diagnostic_response: dict):
     data_to_upsert = {
         'id': user_id,
         'structured_clinical_data': final_structured_data,
         'latest_diagnostic_response': final_diagnostic_response,
         'updated_at': 'now()'
     }
-    
-    supabase.table('user_health_profiles').upsert(data_to_upsert).execute()
+    if profile_outbox is not None:
+        await asyncio.to_thread(_enqueue_profile_write, user_id, data_to_upsert)
+        return
+
+    async_supabase = await get_async_supabase()
+    try:
+        with span("supabase", "upsert_user_profile"):
+            response = await async_supabase.table('user_health_profiles').upsert(data_to_upsert).execute()
+    except Exception:
+        profile_cache.invalidate(user_id)
+        raise
+    profile_cache.write_through(user_id, _upserted_row(response, data_to_upsert))
+
+
+UPLOAD_HANDLE_TTL = timedelta(hours=47)
+UPLOAD_HANDLE_MAX_ENTRIES = 256
+_uploaded_files = OrderedDict()
+
+
+def _cached_upload_handle(sha256: str):
+    handle = _uploaded_files.get(sha256)
+    if handle and datetime.now(timezone.utc) < handle["expires_at"]:
+        _uploaded_files.move_to_end(sha256)
+        return handle["file"]
+    return None
+
+
+def _remember_upload_handle(sha256: str, uploaded):
+    _uploaded_files[sha256] = {"file": uploaded, "expires_at": datetime.now(timezone.utc) + UPLOAD_HANDLE_TTL}
+    while len(_uploaded_files) > UPLOAD_HANDLE_MAX_ENTRIES:
+        _uploaded_files.popitem(last=False)
+    return uploaded
+
+
+def read_file_data(file_data) -> bytes:
+    if isinstance(file_data, (bytes, bytearray)):
+        return file_data
+    return pathlib.Path(file_data).read_bytes()
+
+
+def guess_mime_type(file_data: bytes) -> str:
+    if file_data[:4] == b"%PDF":
+        return "application/pdf"
+    try:
+        with Image.open(io.BytesIO(file_data)) as image:
+            return image.get_format_mimetype()
+    except Exception:
+        return "application/octet-stream"
+
+
+def _upload_kwargs(file_data) -> dict:
+    if isinstance(file_data, (bytes, bytearray)):
+        return {"file": io.BytesIO(file_data), "config": {"mime_type": guess_mime_type(file_data)}}
+    return {"file": file_data}
+
+
+def _upload_handle_key(route, sha256: str, image_profile) -> str:
+    # Uploaded files belong to one provider, and preprocessed images to one profile, so handles are cached per both.
+    if image_profile is None:
+        return f"{route.provider.name}:{sha256}"
+    return f"{route.provider.name}:{image_profile}:{sha256}"
+
+
+def _reusable_upload_handle(route, sha256: str, image_profile):
+    """An upload of this file for the task's profile, or for one that serves it as well (see PROFILE_SUBSTITUTES)."""
+    profiles = (None,) if image_profile is None else image_preprocessing.acceptable_profiles(image_profile)
+    for profile in profiles:
+        if cached := _cached_upload_handle(_upload_handle_key(route, sha256, profile)):
+            return cached
+    return None
 
 
-def extract_patient_parameters_from_pdf(pdf_path):
-    filepath = pathlib.Path(pdf_path)
-    response = client.models.generate_content(
-        model=MODEL,
+def prepare_image(file_data, image_profile: str) -> bytes:
+    """The upload-ready version of an image: oriented, stripped of metadata and sized for the task."""
+    original = read_file_data(file_data)
+    with span("image_preprocess", image_profile, original_bytes=len(original)) as attrs:
+        prepared, attrs["outcome"] = image_preprocessing.preprocess_image(original, image_profile)
+        attrs["size_bytes"] = len(prepared)
+    return prepared
+
+
+async def aupload_file(file_data, sha256=None, route=None):
+    route = route or model_router.route("visual_rag")
+    sha256 = sha256 or await asyncio.to_thread(file_sha256, file_data)
+    image_profile = image_preprocessing.profile_for(route.task)
+    if cached := _reusable_upload_handle(route, sha256, image_profile):
+        return cached
+    handle_key = _upload_handle_key(route, sha256, image_profile)
+    if image_profile is not None:
+        file_data = await asyncio.to_thread(prepare_image, file_data, image_profile)
+    size_bytes = len(file_data) if isinstance(file_data, (bytes, bytearray)) else os.path.getsize(file_data)
+    record_payload("gemini_upload", size_bytes)
+    with span("gemini_upload", "files.upload", size_bytes=size_bytes):
+        uploaded = await model_scheduler.arun(
+            "upload", lambda: route.client.aio.files.upload(**_upload_kwargs(file_data)), rate_limited=False
+        )
+        return _remember_upload_handle(handle_key, uploaded)
+
+
+def _result_cache_key(task: str, sha256: str, *prompt_parts):
+    return ResultCache.make_key(task, sha256, model_router.route(task).model, prompt_version(*prompt_parts))
+
+
+def _with_timeout(task: str, config: dict = None) -> dict:
+    timeout_seconds = MODEL_CALL_TIMEOUTS.get(task, GEMINI_TIMEOUT_SECONDS)
+    return {**(config or {}), "http_options": {"timeout": int(timeout_seconds * 1000)}}
+
+
+async def _agenerate_content(task: str, contents: list, config: dict = None, on_text=None):
+    config = _with_timeout(task, config)
+    route = model_router.route(task)
+    with span("gemini_generate", task, model=route.model, streamed=on_text is not None) as attrs:
+        if on_text is None:
+            response = await model_scheduler.arun(
+                task,
+                lambda: route.client.aio.models.generate_content(model=route.model, contents=contents, config=config),
+                hedge=task in HEDGED_TASKS
+            )
+        else:
+            streamed = []
+
+            async def stream():
+                text_parts = []
+                usage_metadata = None
+                async for chunk in await route.client.aio.models.generate_content_stream(model=route.model, contents=contents, config=config):
+                    if chunk.text:
+                        text_parts.append(chunk.text)
+                        streamed.append(chunk.text)
+                        on_text(chunk.text)
+                    usage_metadata = chunk.usage_metadata or usage_metadata
+                return SimpleNamespace(text="".join(text_parts), usage_metadata=usage_metadata)
+
+            # Text already forwarded to the client can't be taken back, so only retry before the first chunk.
+            response = await model_scheduler.arun(task, stream, can_retry=lambda: not streamed)
+        attrs.update(record_tokens(task, response.usage_metadata))
+    return response
+
+
+async def aextract_patient_parameters_from_pdf(pdf_data):
+    sha256 = await asyncio.to_thread(file_sha256, pdf_data)
+    cache_key = _result_cache_key("extract_pdf", sha256, patient_json_maker_prompt, DiabetesClinicalData.model_json_schema())
+    if (cached := result_cache.get("extract_pdf", cache_key)) is not None:
+        return cached
+
+    pdf_bytes = await asyncio.to_thread(read_file_data, pdf_data)
+    with span("local_extract", "pdf") as attrs:
+        local_data, attrs["outcome"] = await asyncio.to_thread(pdf_extraction.extract_clinical_data, pdf_bytes)
+    if local_data is not None:
+        result_cache.record_local("extract_pdf")
+        return local_data
+
+    record_payload("gemini_inline_pdf", len(pdf_bytes))
+    response = await _agenerate_content(
+        "extract_pdf",
         contents=[
             types.Part.from_bytes(
-                data=filepath.read_bytes(),
+                data=pdf_bytes,
                 mime_type="application/pdf",
             ),
             patient_json_maker_prompt
@@ -101,16 +380,22 @@ def extract_patient_parameters_from_pdf(pdf_path):
             "response_mime_type": "application/json",
             "response_schema": DiabetesClinicalData
         }
-    ).text
+    )
 
-    final_dict = json.loads(response)
+    final_dict = json.loads(response.text)
+    result_cache.set(cache_key, final_dict)
     return final_dict
 
 
-def extract_patient_parameters_from_image(image_path):
-    imgpath = client.files.upload(file=image_path)
-    response = client.models.generate_content(
-        model=MODEL,
+async def aextract_patient_parameters_from_image(image_data):
+    sha256 = await asyncio.to_thread(file_sha256, image_data)
+    cache_key = _result_cache_key("extract_image", sha256, patient_json_maker_prompt, DiabetesClinicalData.model_json_schema())
+    if (cached := result_cache.get("extract_image", cache_key)) is not None:
+        return cached
+
+    imgpath = await aupload_file(image_data, sha256, model_router.route("extract_image"))
+    response = await _agenerate_content(
+        "extract_image",
         contents=[
             imgpath,
             patient_json_maker_prompt
@@ -119,30 +404,157 @@ def extract_patient_parameters_from_image(image_path):
             "response_mime_type": "application/json",
             "response_schema": DiabetesClinicalData
         }
-    ).text
+    )
 
-    final_dict = json.loads(response)
+    final_dict = json.loads(response.text)
+    result_cache.set(cache_key, final_dict)
     return final_dict
 
 
-def identify_image_type(image_path):
-    imgpath = client.files.upload(file=image_path)
-    response = client.models.generate_content(
-        model=MODEL,
+def local_image_type(image_data):
+    """The image type when it's clear from the pixels alone, else None and the model decides."""
+    if not image_classifier.LOCAL_IMAGE_CLASSIFIER:
+        return None
+    with span("local_classify", "image") as attrs:
+        image_type, _ = image_classifier.classify_image(read_file_data(image_data))
+        attrs["image_type"] = image_type
+    return image_type
+
+
+async def aidentify_image_type(image_data):
+    sha256 = await asyncio.to_thread(file_sha256, image_data)
+    cache_key = _result_cache_key("identify_image_type", sha256, is_image_prompt)
+    if (cached := result_cache.get("identify_image_type", cache_key)) is not None:
+        return cached
+    if (image_type := await asyncio.to_thread(local_image_type, image_data)) is not None:
+        result_cache.record_local("identify_image_type")
+        return image_type
+
+    imgpath = await aupload_file(image_data, sha256, model_router.route("identify_image_type"))
+    response = await _agenerate_content(
+        "identify_image_type",
         contents=[
             imgpath,
             is_image_prompt
         ]
-    ).text
+    )
+
+    result_cache.set(cache_key, response.text)
+    return response.text
 
+
+async def aclassify_and_extract_image(image_data):
+    sha256 = await asyncio.to_thread(file_sha256, image_data)
+    cache_key = _result_cache_key("classify_and_extract_image", sha256, fused_image_prompt, ImageClassificationWithData.model_json_schema())
+    if (cached := result_cache.get("classify_and_extract_image", cache_key)) is not None:
+        return cached
+    if await asyncio.to_thread(local_image_type, image_data) == "FALSE":
+        result_cache.record_local("classify_and_extract_image")
+        return {"image_type": "FALSE", "clinical_data": DiabetesClinicalData().model_dump()}
+
+    imgpath = await aupload_file(image_data, sha256, model_router.route("classify_and_extract_image"))
+    response = await _agenerate_content(
+        "classify_and_extract_image",
+        contents=[
+            imgpath,
+            fused_image_prompt
+        ],
+        config={
+            "response_mime_type": "application/json",
+            "response_schema": ImageClassificationWithData
+        }
+    )
+
+    final_dict = json.loads(response.text)
+    result_cache.set(cache_key, final_dict)
+    return final_dict
+
+
+async def _agenerate_with_static_prefix(cache_key: str, leading_parts: list, dynamic_text: str, response_schema, on_text=None):
+    corpus_name, static_prompt = context_cache.prefixes[cache_key]
+    config = {
+        "response_mime_type": "application/json",
+        "response_schema": response_schema
+    }
+
+    cache_name = await context_cache.aget(cache_key)
+    if cache_name:
+        streamed = []
+
+        def on_cached_text(text):
+            streamed.append(text)
+            on_text(text)
+
+        try:
+            response = await _agenerate_content(
+                cache_key,
+                [*leading_parts, dynamic_text],
+                {**config, "cached_content": cache_name},
+                on_text=None if on_text is None else on_cached_text
+            )
+            context_cache.record_usage(cache_key, response)
+            return response
+        except Exception as e:
+            # Once part of the answer has been streamed, retrying would send the client a second copy.
+            if streamed:
+                raise
+            print(f"---CONTEXT_CACHE: Cached call for '{cache_key}' failed, retrying uncached: {e}---")
+            context_cache.invalidate(cache_key)
+
+    response = await _agenerate_content(
+        cache_key,
+        [
+            *leading_parts,
+            await corpus_registry.aget(corpus_name),
+            f"{static_prompt}\n{dynamic_text}"
+        ],
+        config,
+        on_text=on_text
+    )
+    context_cache.record_usage(cache_key, response)
     return response
 
 
-def rag_from_corpus(userid, json_params):
-    filepath = pathlib.Path("assets/ADA.pdf")
+def _retrieve_passages(json_params):
+    """The guideline passages for these parameters, or None to send the whole ADA document as before."""
+    if not corpus_index.available():
+        return None
+    try:
+        with span("retrieval", "ada_rag") as attrs:
+            passages = corpus_index.passages_for(json_params)
+            attrs["passages"] = len(passages)
+        return passages or None
+    except Exception as e:
+        print(f"---CORPUS_INDEX: Retrieval failed, sending the whole corpus instead: {e}---")
+        return None
+
+
+async def _load_past_profile(userid, patient_past_data):
+    """
+    The user's stored profile, None when they have none yet, or PROFILE_NOT_LOADED when it couldn't be read. In
+    that last case the caller must not store its result, which would overwrite the unread history.
+    """
+    if patient_past_data is not PROFILE_NOT_LOADED:
+        return patient_past_data
     try:
-        patient_past_data = fetch_user_profile(userid)
+        return await afetch_user_profile(userid)
     except Exception as e:
+        print(f"---PROFILE: Could not read the profile for {userid}, diagnosing without past records "
+              f"and leaving the stored profile untouched: {e}---")
+        return PROFILE_NOT_LOADED
+
+
+async def _astore_diagnosis(userid, history_known: bool, structured_data: dict, diagnosis: dict):
+    if history_known:
+        await aupsert_user_profile(userid, structured_data, diagnosis)
+    else:
+        print(f"---PROFILE: Not storing the diagnosis for {userid}, since the past profile is unknown---")
+
+
+async def arag_from_corpus(userid, json_params, on_text=None, patient_past_data=PROFILE_NOT_LOADED):
+    patient_past_data = await _load_past_profile(userid, patient_past_data)
+    history_known = patient_past_data is not PROFILE_NOT_LOADED
+    if not history_known:
         patient_past_data = None
 
     if patient_past_data:
@@ -152,126 +564,77 @@ def rag_from_corpus(userid, json_params):
         latest_json_params = json_params
         past_analysis = {}
 
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=[
-            types.Part.from_bytes(
-                data=filepath.read_bytes(),
-                mime_type="application/pdf",
-            ),
-            f"{final_rag_prompt}\n{latest_json_params}\nHere's the past analysis:\n{past_analysis}"
-        ],
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": RAGDiagnosisResponse
-        }
-    ).text
-
-    parsed_response = json.loads(response)
+    dynamic_text = f"{latest_json_params}\nHere's the past analysis:\n{past_analysis}"
+    passages = await asyncio.to_thread(_retrieve_passages, latest_json_params)
+    if passages:
+        response = await _agenerate_content(
+            "ada_rag",
+            [retrieved_corpus_prompt.format(passages=format_passages(passages)), f"{final_rag_prompt}\n{dynamic_text}"],
+            {
+                "response_mime_type": "application/json",
+                "response_schema": RAGDiagnosisResponse
+            },
+            on_text=on_text
+        )
+        context_cache.record_usage("ada_rag", response)
+        parsed_response = resolve_citations(json.loads(response.text), passages)
+    else:
+        response = await _agenerate_with_static_prefix("ada_rag", [], dynamic_text, RAGDiagnosisResponse, on_text=on_text)
+        parsed_response = json.loads(response.text)
 
-    upsert_user_profile(userid, latest_json_params, parsed_response)
+    await _astore_diagnosis(userid, history_known, latest_json_params, parsed_response)
     return parsed_response
 
 
+def convert_dicom_to_jpeg_bytes(dicom_data) -> bytes:
+    # pydicom and its pixel handlers are only needed on the DICOM path.
+    from dicom_utils import convert_dicom_to_jpeg_bytes as render
+    return render(dicom_data)
+
+
+async def aconvert_dicom_to_jpeg_bytes(dicom_data) -> bytes:
+    return await asyncio.to_thread(convert_dicom_to_jpeg_bytes, dicom_data)
+
+
 def convert_dicom_to_jpeg(dicom_path, jpeg_path):
-    dicom_file = pydicom.dcmread(dicom_path)
-    pixel_array = dicom_file.pixel_array
-    image = Image.fromarray(pixel_array)
-    image.save(jpeg_path, "JPEG")
+    pathlib.Path(jpeg_path).write_bytes(convert_dicom_to_jpeg_bytes(dicom_path))
     return jpeg_path
 
 
-def vlm_analysis_for_scans(userid, image_path):
-    file_extension = pathlib.Path(image_path).suffix.lower()
-    path_to_upload = image_path
+def _is_dicom_name(image_data, file_name):
+    name = file_name or ("" if isinstance(image_data, (bytes, bytearray)) else str(image_data))
+    return pathlib.Path(name).suffix.lower() == ".dcm"
+
 
-    if file_extension == ".dcm":
+async def avlm_analysis_for_scans(userid, image_data, file_name=None, on_text=None,
+                                  patient_past_data=PROFILE_NOT_LOADED):
+    data_to_upload = image_data
+
+    if _is_dicom_name(image_data, file_name):
         print("---VLM_NODE: Detected DICOM, converting to JPEG...---")
-        jpeg_path = image_path + ".jpg"
-        path_to_upload = convert_dicom_to_jpeg(image_path, jpeg_path)
+        data_to_upload = await aconvert_dicom_to_jpeg_bytes(image_data)
 
-    imgpath = client.files.upload(file=path_to_upload)
-    filepath = pathlib.Path("assets/VisualRAG.pdf")
-    try:
-        patient_past_data = fetch_user_profile(userid)
-    except Exception as e:
+    imgpath = await aupload_file(data_to_upload)
+    patient_past_data = await _load_past_profile(userid, patient_past_data)
+    history_known = patient_past_data is not PROFILE_NOT_LOADED
+    if not history_known:
         patient_past_data = None
 
     if patient_past_data:
         json_params = patient_past_data["structured_clinical_data"]
         past_analysis = patient_past_data["latest_diagnostic_response"]
     else:
-        json_params = {
-            "patient_info": {
-                "name": None,
-                "age_years": None,
-                "gender": None,
-                "report_date": None
-            },
-            "lab_results": {
-                "hba1c": {
-                    "value": None,
-                    "unit": None,
-                    "status_flag": None
-                },
-                "fasting_plasma_glucose": {
-                    "value": None,
-                    "unit": None,
-                    "status_flag": None
-                },
-                "two_hr_ogtt_glucose": {
-                    "value": None,
-                    "unit": None,
-                    "status_flag": None
-                },
-                "random_plasma_glucose": {
-                    "value": None,
-                    "unit": None,
-                    "status_flag": None
-                },
-                "bmi": {
-                    "value": None,
-                    "unit": None,
-                    "status_flag": None
-                }
-            },
-            "symptoms_history": {
-                "polyuria": None,
-                "polydipsia": None,
-                "polyphagia": None,
-                "unexplained_weight_loss": None,
-                "fatigue": None,
-                "blurred_vision": None,
-                "slow_healing_sores_infections": None,
-                "family_history_diabetes": None,
-                "ethnicity": None,
-                "history_gestational_diabetes": None,
-                "history_prediabetes": None,
-                "history_hypertension": None,
-                "history_dyslipidemia": None,
-                "history_pcos": None,
-                "current_medications_keywords": [],
-                "other_relevant_medical_history": None
-            }
-        }
+        json_params = DiabetesClinicalData().model_dump()
         past_analysis = {}
-    
-    response = client.models.generate_content(
-        model=MODEL,
-        contents=[
-            imgpath,
-            types.Part.from_bytes(
-                data=filepath.read_bytes(),
-                mime_type="application/pdf",
-            ),
-            f"{visual_rag_prompt}\n{past_analysis}"
-        ],
-        config={
-            "response_mime_type": "application/json",
-            "response_schema": RAGDiagnosisResponse
-        }
-    ).text
 
-    final_dict = json.loads(response)
-    upsert_user_profile(userid, json_params, final_dict)
-    return final_dict
\ No newline at end of file
+    response = await _agenerate_with_static_prefix(
+        "visual_rag",
+        [imgpath],
+        f"{past_analysis}",
+        RAGDiagnosisResponse,
+        on_text=on_text
+    )
+
+    final_dict = json.loads(response.text)
+    await _astore_diagnosis(userid, history_known, json_params, final_dict)
+    return final_dict